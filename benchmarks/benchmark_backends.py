@@ -0,0 +1,99 @@
+"""Benchmark the backends of the OKP model kernels.
+
+This script simulates a synthetic regional batch of lakes (one run per lake
+with calc_epilimnion_temperature() and calc_hypolimnion_temperature(), and
+one run of the batched functions for all the lakes) with each of the
+available backends, and prints the execution times and the speedup relative
+to the backend 'numpy'. The backend 'numba' is only tested if numba is
+installed.
+
+Run it from the root directory of the package:
+
+    python benchmarks/benchmark_backends.py [nlakes] [nyears]
+
+"""
+# Copyright 2020-2022 Segula Technologies - Office Français de la Biodiversité.
+#
+# This file is part of the Python package "okplm".
+#
+# The package "okplm" is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# The package "okplm" is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with "okplm".  If not, see <https://www.gnu.org/licenses/>.
+import sys
+import time
+
+import numpy as np
+
+from okplm import kernels
+from okplm.okp_model import calc_epilimnion_temperature
+from okplm.okp_model import calc_epilimnion_temperature_batch
+from okplm.okp_model import calc_hypolimnion_temperature
+from okplm.okp_model import calc_hypolimnion_temperature_batch
+
+
+nlakes = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+nyears = int(sys.argv[2]) if len(sys.argv) > 2 else 30
+
+# Synthetic forcing and parameter values
+ndays = int(nyears*365.25)
+rng = np.random.default_rng(0)
+t = np.arange(ndays)
+tair = 10 - 8*np.cos(2*np.pi*t/365.25) + rng.normal(0, 2, (nlakes, ndays))
+sr = 150 - 100*np.cos(2*np.pi*t/365.25) + np.zeros((nlakes, ndays))
+par_vals = {'A': rng.uniform(5, 15, nlakes), 'B': rng.uniform(0.8, 1.05,
+                                                                nlakes),
+            'C': rng.uniform(-0.007, 0.001, nlakes), 'D': 0.51,
+            'E': rng.uniform(0.1, 1, nlakes),
+            'ALPHA': rng.uniform(0.02, 0.3, nlakes),
+            'BETA': rng.choice([0.13, 1.0], nlakes),
+            'at_factor': 1.0, 'sw_factor': 1.0, 'mat': 10.0}
+
+backends = ['python', 'numpy']
+if kernels.numba is not None:
+    backends.append('numba')
+    # compile the kernels before timing
+    calc_hypolimnion_temperature_batch(
+            calc_epilimnion_temperature_batch(tair[:, :10], sr[:, :10],
+                                              par_vals, backend='numba'),
+            par_vals, backend='numba')
+
+
+def run_per_lake(backend):
+    for i in range(nlakes):
+        pars = {k: v[i] if np.ndim(v) else v for k, v in par_vals.items()}
+        tepi = calc_epilimnion_temperature(tair[i], sr[i], pars,
+                                           backend=backend)
+        calc_hypolimnion_temperature(tepi, pars, backend=backend)
+
+
+def run_batch(backend):
+    tepi = calc_epilimnion_temperature_batch(tair, sr, par_vals,
+                                             backend=backend)
+    calc_hypolimnion_temperature_batch(tepi, par_vals, backend=backend)
+
+
+print('Regional batch: %d lakes, %d days' % (nlakes, ndays))
+print('%8s %14s %14s' % ('backend', 'per lake (s)', 'batched (s)'))
+times = dict()
+for backend in backends:
+    t0 = time.perf_counter()
+    run_per_lake(backend)
+    t1 = time.perf_counter()
+    run_batch(backend)
+    t2 = time.perf_counter()
+    times[backend] = (t1 - t0, t2 - t1)
+    print('%8s %14.3f %14.3f' % (backend, t1 - t0, t2 - t1))
+print('Speedup relative to numpy:')
+for backend in backends:
+    print('%8s %14.1f %14.1f' % (
+            backend, times['numpy'][0]/times[backend][0],
+            times['numpy'][1]/times[backend][1]))
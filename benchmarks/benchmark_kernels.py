@@ -0,0 +1,80 @@
+"""Benchmark the kernels of the OKP model.
+
+This script compares the execution time of the reference (loop) and the
+vectorized implementations of the kernels in the module kernels.py
+(exponential smoothing and hypolimnion recursion), using a synthetic series
+of 100 years of daily data. It also checks that both implementations give
+the same results.
+
+Run it from the root directory of the package:
+
+    python benchmarks/benchmark_kernels.py
+
+"""
+# Copyright 2020-2022 Segula Technologies - Office Français de la Biodiversité.
+#
+# This file is part of the Python package "okplm".
+#
+# The package "okplm" is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# The package "okplm" is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with "okplm".  If not, see <https://www.gnu.org/licenses/>.
+import timeit
+
+import numpy as np
+
+from okplm.kernels import exponential_smoothing, hypolimnion_recursion
+
+
+# Synthetic air temperature: 100 years of daily data
+nyears = 100
+ndays = int(nyears*365.25)
+rng = np.random.default_rng(0)
+t = np.arange(ndays)
+tair = 10 - 8*np.cos(2*np.pi*t/365.25) + rng.normal(0, 2, ndays)
+nrep = 5
+
+print('Exponential smoothing, %d days' % ndays)
+print('%8s %12s %12s %10s %12s' % ('alpha', 'python (s)', 'numpy (s)',
+                                   'speedup', 'max diff'))
+for alpha in [0.01, 0.07, 0.3, 0.9]:
+    t_loop = min(timeit.repeat(
+        lambda: exponential_smoothing(tair, alpha, backend='python'),
+        number=1, repeat=nrep))
+    t_vec = min(timeit.repeat(
+        lambda: exponential_smoothing(tair, alpha, backend='numpy'),
+        number=1, repeat=nrep))
+    diff = np.max(np.abs(exponential_smoothing(tair, alpha, 'python') -
+                         exponential_smoothing(tair, alpha, 'numpy')))
+    print('%8.3f %12.4f %12.4f %10.1f %12.2e' % (alpha, t_loop, t_vec,
+                                                 t_loop/t_vec, diff))
+
+# Synthetic epilimnion temperature
+tepi = np.maximum(2 + exponential_smoothing(tair, 0.07), 0)
+
+print('')
+print('Hypolimnion recursion, %d days' % ndays)
+print('%8s %12s %12s %10s %12s' % ('beta', 'python (s)', 'numpy (s)',
+                                   'speedup', 'max diff'))
+for beta in [0.13, 1.0]:
+    t_loop = min(timeit.repeat(
+        lambda: hypolimnion_recursion(tepi, beta, 0.51, 6.2, 0.24,
+                                      backend='python'),
+        number=1, repeat=nrep))
+    t_vec = min(timeit.repeat(
+        lambda: hypolimnion_recursion(tepi, beta, 0.51, 6.2, 0.24,
+                                      backend='numpy'),
+        number=1, repeat=nrep))
+    diff = np.max(np.abs(
+        hypolimnion_recursion(tepi, beta, 0.51, 6.2, 0.24, 'python') -
+        hypolimnion_recursion(tepi, beta, 0.51, 6.2, 0.24, 'numpy')))
+    print('%8.3f %12.4f %12.4f %10.1f %12.2e' % (beta, t_loop, t_vec,
+                                                 t_loop/t_vec, diff))
@@ -53,9 +53,21 @@ Management of Aquatic Ecosystems*, 420, 8, doi:
 
 
 from .parameter_constants import *
-from .parameter_functions import estimate_parameters
-from .input_output import read_dict, write_dict
+from .parameter_functions import estimate_parameters, lake_type_constants
+from .parameters import OKPParameters, as_parameters
+from .input_output import build_meteo_index, iter_meteo, read_dict, read_meteo
+from .input_output import read_meteo_range, read_output
+from .input_output import write_dict, write_output
+from .cache import clear_cache, read_meteo_cached
 from .time_functions import *
-from .validation import error_statistics
-from .okp_model import run_okp
+from .validation import error_statistics, error_statistics_batch
+from .validation import error_statistics_pairs
+from .okp_model import run_okp, run_okp_arrays
+from .batch import read_manifest, run_batch
+from .calibration import calibrate, calibrate_okp, calibrate_separable
+from .simulator import OKPModel
+from .ensemble import run_ensemble, saltelli_design, sobol_indices
+from .reducers import EnsembleStatistics, P2Quantiles
+from .streaming import calc_climatology, run_okp_incremental
+from .streaming import run_okp_streaming
 from ._version import __version__
@@ -0,0 +1,299 @@
+"""Batch simulation of many water bodies.
+
+The functions in this module run the OKP model for all the water bodies
+listed in a manifest file, distributing them over a pool of processes, so that
+Python and numpy are started only once per process and not once per water
+body.
+
+The manifest is a CSV file (with a header line) or a JSON file (a list of
+objects) with one entry per water body and the following fields, named as the
+options of the command line application run_okp:
+
+    * name: identifier of the water body (optional, the path of the output
+      file by default).
+    * folder: path to the model data folder (optional, the folder of the
+      manifest by default).
+    * meteo, lake, par, output: names of the meteorological data, lake data,
+      parameter and output files (optional, 'meteo.txt', 'lake.txt',
+      'par.txt' and 'output.txt' by default).
+    * obs_data, val_results: names of the observation data file and of the
+      validation results file (optional).
+
+Relative paths are relative to the folder of each water body. The completed
+water bodies are recorded in a journal file, so that an interrupted batch can
+be resumed without simulating them again.
+
+This module contains the following functions:
+
+    * main: parse command line arguments and run a batch of simulations.
+    * read_manifest: read a manifest file.
+    * run_batch: run the OKP model for the water bodies of a manifest.
+
+"""
+# Copyright 2020-2022 Segula Technologies - Office Français de la Biodiversité.
+#
+# This file is part of the Python package "okplm".
+#
+# The package "okplm" is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# The package "okplm" is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with "okplm".  If not, see <https://www.gnu.org/licenses/>.
+
+
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import time
+
+from okplm.okp_model import run_okp
+
+
+def main():
+    """Parse command line arguments and run a batch of simulations.
+
+    To obtain help on this function type "run_okp_batch -h" in the command
+    line.
+    """
+    # parser
+    parser = argparse.ArgumentParser(description='Run OKP model for the ' +
+                                     'water bodies of a manifest file')
+    parser.add_argument('manifest', help='path to the manifest file ' +
+                        '(CSV or JSON)')
+    parser.add_argument('-j', '--processes', type=int, help='number of ' +
+                        'processes (default: number of CPUs)')
+    parser.add_argument('--chunksize', type=int, help='number of water ' +
+                        'bodies submitted at once to each process')
+    parser.add_argument('--journal', help='path to the journal file ' +
+                        '(default: manifest path followed by .journal)')
+    parser.add_argument('--restart', action='store_true',
+                        help='ignore the journal and simulate all the ' +
+                        'water bodies')
+    parser.add_argument('-s', '--start', help='start date (YYYY-mm-dd)')
+    parser.add_argument('-e', '--end', help='end date (YYYY-mm-dd)')
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('-d', '--daily', action='store_true',
+                       help='daily simulation (default)')
+    group.add_argument('-w', '--weekly', action='store_true',
+                       help='weekly simulation')
+    group.add_argument('-n', '--monthly', action='store_true',
+                       help='monthly simulation')
+    parser.add_argument('--cache_dir', help='folder used to cache the ' +
+                        'parsed meteorological data')
+    parser.add_argument('--backend', choices=['auto', 'python', 'numpy',
+                                              'numba'],
+                        help='implementation of the model kernels (default: ' +
+                        'environment variable OKPLM_BACKEND or auto)')
+
+    # parse arguments
+    args = parser.parse_args()
+
+    # periodicity of simulation
+    periodicity = 'daily'
+    if args.weekly:
+        periodicity = 'weekly'
+    elif args.monthly:
+        periodicity = 'monthly'
+
+    # run batch
+    run_batch(args.manifest, processes=args.processes,
+              chunksize=args.chunksize, journal_file=args.journal,
+              restart=args.restart, start_date=args.start, end_date=args.end,
+              periodicity=periodicity, backend=args.backend,
+              cache_dir=args.cache_dir)
+
+    return
+
+
+def read_manifest(path):
+    """Read a manifest file.
+
+    Args:
+        path: path of the manifest file, in CSV format (with a header line) or
+            in JSON format (a list of objects); see the description of the
+            fields in the module documentation.
+
+    Returns:
+        A list with one dictionary per water body, with the keys name,
+        meteo_file, lake_file, par_file, output_file, validation_data_file
+        and validation_res_file, containing full paths (None for missing
+        validation files).
+    """
+    path = os.path.expanduser(path)
+    with open(path, 'rt', encoding='utf-8') as f:
+        if os.path.splitext(path)[1].lower() == '.json':
+            entries = json.load(f)
+        else:
+            entries = list(csv.DictReader(f))
+
+    base_folder = os.path.dirname(os.path.abspath(path))
+    lakes = []
+    for entry in entries:
+        # empty fields are considered missing
+        entry = {k: v for k, v in entry.items() if v not in [None, '']}
+        folder = os.path.join(base_folder,
+                              os.path.expanduser(entry.get('folder', '')))
+        lake = dict()
+        for k in ['meteo', 'lake', 'par', 'output']:
+            lake[k + '_file'] = os.path.join(
+                    folder, os.path.expanduser(entry.get(k, k + '.txt')))
+        for k, k_file in [('obs_data', 'validation_data_file'),
+                          ('val_results', 'validation_res_file')]:
+            if k in entry:
+                lake[k_file] = os.path.join(folder,
+                                            os.path.expanduser(entry[k]))
+            else:
+                lake[k_file] = None
+        lake['name'] = str(entry.get('name', lake['output_file']))
+        lakes.append(lake)
+
+    return lakes
+
+
+def run_batch(manifest, processes=None, chunksize=None, journal_file=None,
+              restart=False, **kwargs):
+    """Run the OKP model for the water bodies of a manifest.
+
+    The water bodies are simulated with okp_model.run_okp in a pool of
+    processes. Each completed water body is recorded in the journal file;
+    the water bodies already recorded are skipped, so that an interrupted
+    batch can be resumed. A summary of the throughput is printed at the end.
+
+    Args:
+        manifest: path of the manifest file (see read_manifest).
+        processes: number of processes. If None, the number of CPUs is used.
+            If 1, the water bodies are simulated in the current process.
+        chunksize: number of water bodies submitted at once to each process.
+            If None, it is chosen so that each process receives about four
+            chunks.
+        journal_file: path of the journal file. If None, the path of the
+            manifest followed by '.journal' is used.
+        restart: if True, the journal file is emptied and all the water
+            bodies are simulated.
+        **kwargs: other arguments passed to okp_model.run_okp (e.g.,
+            start_date, end_date, periodicity, backend, cache_dir,
+            output_format).
+
+    Returns:
+        A dictionary with the number of simulated (n_done), skipped
+        (n_skipped) and failed (n_failed) water bodies, the number of
+        simulated time steps (n_steps) and the elapsed time in seconds
+        (time).
+    """
+    manifest = os.path.expanduser(manifest)
+    if journal_file is None:
+        journal_file = manifest + '.journal'
+    journal_file = os.path.expanduser(journal_file)
+
+    # Water bodies not completed yet
+    lakes = read_manifest(manifest)
+    if restart and os.path.exists(journal_file):
+        os.remove(journal_file)
+    done, complete = _read_journal(journal_file)
+    tasks = [(lake, kwargs) for lake in lakes if lake['name'] not in done]
+    n_skipped = len(lakes) - len(tasks)
+    if n_skipped > 0:
+        print('Skipping %d water bodies already simulated (see %s).' %
+              (n_skipped, journal_file))
+
+    if processes is None:
+        processes = os.cpu_count() or 1
+    processes = max(1, min(processes, len(tasks)))
+    if chunksize is None:
+        chunksize = max(1, len(tasks)//(4*processes))
+
+    # Simulations
+    n_done = 0
+    n_failed = 0
+    n_steps = 0
+    t0 = time.time()
+    with open(journal_file, 'at') as journal:
+        if not complete:
+            # terminate the incomplete line of an interrupted batch
+            journal.write('\n')
+        if processes == 1:
+            results = map(_run_lake, tasks)
+            pool = None
+        else:
+            pool = multiprocessing.Pool(processes)
+            results = pool.imap_unordered(_run_lake, tasks, chunksize)
+        try:
+            for name, nmes, err_msg in results:
+                if err_msg is not None:
+                    n_failed += 1
+                    print('Error in ' + name + ': ' + err_msg)
+                    continue
+                n_done += 1
+                n_steps += nmes
+                journal.write(json.dumps({'name': name, 'n': nmes}) + '\n')
+                journal.flush()
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+    elapsed = time.time() - t0
+
+    # Throughput summary
+    unit = {'daily': 'days', 'weekly': 'weeks',
+            'monthly': 'months'}[kwargs.get('periodicity', 'daily')]
+    rate = 1/elapsed if elapsed > 0 else float('inf')
+    print('%d water bodies simulated (%d failed) in %.2f s with %d ' %
+          (n_done, n_failed, elapsed, processes) +
+          'processes: %.1f water bodies/s, %.0f %s/s' %
+          (n_done*rate, n_steps*rate, unit))
+
+    return {'n_done': n_done, 'n_skipped': n_skipped, 'n_failed': n_failed,
+            'n_steps': n_steps, 'time': elapsed}
+
+
+def _read_journal(journal_file):
+    """Read the names of the completed water bodies in a journal.
+
+    Returns the set of names and a flag that is False if the last line of the
+    journal is incomplete.
+    """
+    done = set()
+    complete = True
+    if not os.path.exists(journal_file):
+        return done, complete
+    with open(journal_file, 'rt') as f:
+        for line in f:
+            complete = line.endswith('\n')
+            try:
+                done.add(json.loads(line)['name'])
+            except (ValueError, KeyError):
+                # incomplete line written by an interrupted batch
+                pass
+    return done, complete
+
+
+def _run_lake(task):
+    """Simulate one water body (executed in the worker processes).
+
+    Returns a tuple (name, number of time steps, error message), with an
+    error message of None if the simulation succeeded.
+    """
+    lake, kwargs = task
+    try:
+        if not os.path.exists(lake['par_file']) and \
+                not os.path.exists(lake['lake_file']):
+            raise FileNotFoundError('One of lake_file or par_file is ' +
+                                    'necessary')
+        nmes = run_okp(output_file=lake['output_file'],
+                       meteo_file=lake['meteo_file'],
+                       par_file=lake['par_file'], lake_file=lake['lake_file'],
+                       validation_data_file=lake['validation_data_file'],
+                       validation_res_file=lake['validation_res_file'],
+                       **kwargs)
+    except Exception as e:
+        return lake['name'], 0, '%s: %s' % (type(e).__name__, e)
+    return lake['name'], nmes, None
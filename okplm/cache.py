@@ -0,0 +1,231 @@
+"""On-disk cache of parsed data files.
+
+The functions in this module store the meteorological data read from text
+files as binary numpy files (.npy), so that later runs using the same files
+do not need to parse the text again. Cached data are opened with memory
+mapping, so that loading them does not copy the data into memory.
+
+Each cache entry is a folder containing one .npy file per column of the data
+file (dates are stored as int64 days since 1970-01-01). Entries are keyed by
+the path, size and modification time of the data file, so that looking up an
+entry does not read the file and any modification of the file invalidates its
+entry. The hash of the content of the file is also stored in the entry, and
+it is checked on request (strict validation), e.g., for files modified
+without updating their modification time. When the total size of the cache
+exceeds its limit, the least recently used entries are removed.
+
+The location of the cache and its size limit may be defined with the
+environment variables OKPLM_CACHE_DIR and OKPLM_CACHE_SIZE (in bytes).
+
+This module contains the following functions:
+
+    * clear_cache: remove all the entries of the cache.
+    * read_meteo_cached: read meteorological data file using the cache.
+
+"""
+# Copyright 2020-2022 Segula Technologies - Office Français de la Biodiversité.
+#
+# This file is part of the Python package "okplm".
+#
+# The package "okplm" is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# The package "okplm" is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with "okplm".  If not, see <https://www.gnu.org/licenses/>.
+
+
+import hashlib
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from okplm.input_output import read_meteo
+
+# Default size limit of the cache (bytes)
+DEFAULT_CACHE_SIZE = 2**30
+
+
+def clear_cache(cache_dir=None):
+    """Remove all the entries of the cache.
+
+    Args:
+        cache_dir: path of the cache folder. If None, the value of the
+            environment variable OKPLM_CACHE_DIR is used.
+
+    Returns:
+        The number of removed entries.
+    """
+    cache_dir = _cache_dir(cache_dir)
+    if cache_dir is None or not os.path.isdir(cache_dir):
+        return 0
+    entries = _list_entries(cache_dir)
+    for entry in entries:
+        shutil.rmtree(entry, ignore_errors=True)
+    return len(entries)
+
+
+def read_meteo_cached(path, cache_dir=None, max_size=None, strict=False):
+    """Read meteorological data file using the cache.
+
+    If the cache contains an entry for the current version of the file (same
+    path, size and modification time), the data are loaded from the cache
+    with memory mapping. Otherwise, the file is read with read_meteo() and
+    the data are stored in the cache.
+
+    Args:
+        path: path of the meteorological data file (see read_meteo).
+        cache_dir: path of the cache folder. If None, the value of the
+            environment variable OKPLM_CACHE_DIR is used. If it is not defined
+            either, the file is read without using the cache.
+        max_size: size limit of the cache in bytes. If None, the value of the
+            environment variable OKPLM_CACHE_SIZE is used, or 1 GiB if it is
+            not defined.
+        strict: if True, the content of the file is also compared with the
+            content hash stored in the entry, and the entry is replaced if
+            they differ. It requires reading the whole file.
+
+    Returns:
+        A Python dictionary with one array per column, as read_meteo(). The
+        arrays loaded from the cache are read-only memory-mapped arrays.
+    """
+    cache_dir = _cache_dir(cache_dir)
+    if cache_dir is None:
+        return read_meteo(path)
+    if max_size is None:
+        max_size = int(os.environ.get('OKPLM_CACHE_SIZE',
+                                      DEFAULT_CACHE_SIZE))
+
+    entry = os.path.join(cache_dir, _cache_key(path))
+    content_hash = _content_hash(path) if strict else None
+    if os.path.isdir(entry):
+        try:
+            data = _load_entry(entry, content_hash)
+        except (OSError, ValueError):
+            # entry removed, incomplete or with another content: read the
+            # file again
+            pass
+        else:
+            # update access time for LRU eviction
+            os.utime(entry)
+            return data
+        shutil.rmtree(entry, ignore_errors=True)
+
+    data = read_meteo(path)
+    if content_hash is None:
+        content_hash = _content_hash(path)
+    _store_entry(entry, data, content_hash)
+    _evict(cache_dir, max_size, keep=entry)
+    return data
+
+
+def _cache_dir(cache_dir):
+    """Return the path of the cache folder."""
+    if cache_dir is None:
+        cache_dir = os.environ.get('OKPLM_CACHE_DIR')
+    if cache_dir is not None:
+        cache_dir = os.path.expanduser(cache_dir)
+    return cache_dir
+
+
+def _cache_key(path):
+    """Return the key of a file from its path, size and mtime."""
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    key = '%s\n%d\n%d' % (path, stat.st_size, stat.st_mtime_ns)
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def _content_hash(path):
+    """Return the hash of the content of a file."""
+    content_hash = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(2**20), b''):
+            content_hash.update(block)
+    return content_hash.hexdigest()
+
+
+def _entry_size(entry):
+    """Return the size in bytes of a cache entry."""
+    return sum(os.path.getsize(os.path.join(entry, f))
+               for f in os.listdir(entry))
+
+
+def _evict(cache_dir, max_size, keep=None):
+    """Remove the least recently used entries exceeding the size limit."""
+    entries = _list_entries(cache_dir)
+    sizes = dict()
+    for entry in entries:
+        try:
+            sizes[entry] = _entry_size(entry)
+        except OSError:
+            sizes[entry] = 0
+    total = sum(sizes.values())
+    entries.sort(key=lambda e: os.path.getmtime(e) if os.path.exists(e)
+                 else 0)
+    for entry in entries:
+        if total <= max_size:
+            break
+        if entry == keep:
+            continue
+        shutil.rmtree(entry, ignore_errors=True)
+        total -= sizes[entry]
+
+
+def _list_entries(cache_dir):
+    """Return the list of entry folders in the cache."""
+    return [os.path.join(cache_dir, f) for f in os.listdir(cache_dir)
+            if not f.startswith('.') and
+            os.path.isdir(os.path.join(cache_dir, f))]
+
+
+def _load_entry(entry, content_hash=None):
+    """Load the data of a cache entry with memory mapping.
+
+    If content_hash is given, a ValueError is raised if it differs from the
+    content hash of the entry.
+    """
+    if content_hash is not None:
+        with open(os.path.join(entry, 'hash.txt'), 'rt') as f:
+            if f.read().strip() != content_hash:
+                raise ValueError('Content of the file modified')
+    with open(os.path.join(entry, 'columns.txt'), 'rt') as f:
+        names = f.read().split()
+    data = dict()
+    for k in names:
+        x = np.load(os.path.join(entry, k + '.npy'), mmap_mode='r')
+        if k == 'date':
+            x = x.view('datetime64[D]')
+        data[k] = x
+    return data
+
+
+def _store_entry(entry, data, content_hash):
+    """Store data and the content hash of their file in a new cache entry."""
+    cache_dir = os.path.dirname(entry)
+    os.makedirs(cache_dir, exist_ok=True)
+
+    # Write to a temporary folder that is then renamed, so that other
+    # processes never see an incomplete entry
+    tmp_entry = tempfile.mkdtemp(dir=cache_dir, prefix='.tmp')
+    for k, x in data.items():
+        if k == 'date':
+            x = x.astype('datetime64[D]').view(np.int64)
+        np.save(os.path.join(tmp_entry, k + '.npy'), x)
+    with open(os.path.join(tmp_entry, 'columns.txt'), 'wt') as f:
+        f.write(' '.join(data.keys()))
+    with open(os.path.join(tmp_entry, 'hash.txt'), 'wt') as f:
+        f.write(content_hash)
+    try:
+        os.rename(tmp_entry, entry)
+    except OSError:
+        # entry created meanwhile by another process
+        shutil.rmtree(tmp_entry, ignore_errors=True)
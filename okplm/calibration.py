@@ -0,0 +1,512 @@
+"""Calibration of the parameters of the OKP model.
+
+The functions in this module calibrate the parameters of the OKP model for
+one water body against observed epilimnion and/or hypolimnion temperature,
+with a differential evolution search over bounded parameter values. At each
+generation, the whole population of candidate parameter sets is simulated at
+once with the batched simulation functions (one row per candidate, see
+okp_model.calc_epilimnion_temperature_batch and
+okp_model.calc_hypolimnion_temperature_batch) and scored at once with
+validation.error_statistics_batch.
+
+Epilimnion temperature is linear in the parameters A, B and C for a given
+value of ALPHA (apart from the clipping at 0 ºC). The separable calibration
+(calibrate_separable) exploits this: it only searches over ALPHA, and it
+solves A, B and C by linear least squares at the observation dates.
+
+This module contains the following functions:
+
+    * calibrate: calibrate the parameters of the OKP model on arrays of data.
+    * calibrate_okp: calibrate the parameters of the OKP model from data
+      files and write them to a parameter file.
+    * calibrate_separable: calibrate the parameters of the OKP model by
+      separable least squares.
+
+"""
+# Copyright 2020-2022 Segula Technologies - Office Français de la Biodiversité.
+#
+# This file is part of the Python package "okplm".
+#
+# The package "okplm" is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# The package "okplm" is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with "okplm".  If not, see <https://www.gnu.org/licenses/>.
+
+
+import os
+
+import numpy as np
+
+import okplm
+from okplm.kernels import exponential_smoothing, hypolimnion_recursion
+from okplm.okp_model import calc_epilimnion_temperature_batch
+from okplm.okp_model import calc_hypolimnion_temperature_batch
+from okplm.okp_model import calc_sinusoidal, fit_sinusoidal_batch
+from okplm.okp_model import _estimate_lake_parameters
+from okplm.parameters import PARAMETER_NAMES, _periods_per_year
+from okplm.validation import error_statistics_batch
+
+
+# Default bounds of the calibrated parameters
+DEFAULT_BOUNDS = {'A': (-5., 15.), 'B': (0., 2.), 'C': (-0.1, 0.1),
+                  'ALPHA': (0.001, 0.5), 'BETA': (0.001, 0.5), 'E': (0., 1.)}
+
+# Indices of the statistics returned by error_statistics_batch
+_STATISTICS = {'sd': 1, 'me': 3, 'mae': 4, 'rmse': 5}
+
+
+def calibrate(date, tair, sr, obs_data, par_vals, bounds=None,
+              periodicity='daily', objective='rmse', popsize=None,
+              maxiter=200, mutation=(0.5, 1.), recombination=0.7, tol=1e-4,
+              seed=None, backend=None):
+    """Calibrate the parameters of the OKP model on arrays of data.
+
+    The parameters are calibrated with differential evolution
+    (DE/rand/1/bin with a mutation factor drawn at each generation). The
+    objective is the sum of the error statistic of epilimnion and
+    hypolimnion temperature, for the variables present in obs_data.
+
+    Args:
+        date: sorted array of dates of the meteorological data
+            (numpy.datetime64[D]).
+        tair: array of air temperature (ºC).
+        sr: array of solar radiation (W/m\\ :sup:`2`\\ ).
+        obs_data: a dictionary with an array of dates ('date') and arrays of
+            observed epilimnion ('tepi') and/or hypolimnion ('thyp')
+            temperature. Missing values (nan) are ignored.
+        par_vals: a dictionary or an OKPParameters object with the initial
+            parameter values (e.g., estimated from the lake characteristics).
+            The parameters not calibrated keep these values. It is not
+            modified.
+        bounds: a dictionary with a tuple (lower, upper) of bounds for each
+            calibrated parameter. If None, DEFAULT_BOUNDS is used (parameters
+            A, B, C, ALPHA, BETA and E).
+        periodicity: periodicity of the input meteorological data and of the
+            simulation; it can take the values 'daily', 'weekly', 'monthly'.
+        objective: error statistic minimized ('rmse', 'mae', 'sd' or 'me';
+            the absolute value is used for 'me').
+        popsize: number of candidate parameter sets of the population. If
+            None, 15 times the number of calibrated parameters is used.
+        maxiter: maximum number of generations.
+        mutation: a tuple (min, max) of the interval of the mutation factor,
+            or a number for a constant mutation factor.
+        recombination: crossover probability.
+        tol: relative tolerance of convergence: the search stops when the
+            standard deviation of the objective over the population is less
+            than tol times the absolute value of its mean.
+        seed: seed of the random number generator.
+        backend: implementation of the model kernels ('python', 'numpy',
+            'numba' or 'auto'; see the module kernels). If None, the value of
+            the environment variable OKPLM_BACKEND is used.
+
+    Returns:
+        A dictionary with the calibrated parameter values ('par_vals', a
+        dictionary with all the parameters), the value of the objective
+        ('score'), the number of generations ('niter') and the number of
+        simulated parameter sets ('nfev').
+    """
+    if bounds is None:
+        bounds = DEFAULT_BOUNDS
+    if objective not in _STATISTICS:
+        raise ValueError('Unknown objective ' + str(objective))
+    names = [k for k in PARAMETER_NAMES if k in bounds]
+    unknown = set(bounds) - set(names)
+    if unknown:
+        raise KeyError(', '.join(sorted(unknown)))
+    lower = np.array([bounds[k][0] for k in names], dtype=float)
+    upper = np.array([bounds[k][1] for k in names], dtype=float)
+    npar = len(names)
+    if popsize is None:
+        popsize = 15*npar
+    popsize = max(popsize, 5)
+    par_vals = {k: float(par_vals[k]) for k in PARAMETER_NAMES}
+
+    # Simulation time steps corresponding to the observations
+    tair = np.asarray(tair, dtype=float)
+    sr = np.asarray(sr, dtype=float)
+    obs = _match_observations(date, obs_data)
+    nmes = len(tair)
+
+    def evaluate(pop):
+        # Simulate and score all the candidate parameter sets at once
+        pars = dict(par_vals)
+        for i, k in enumerate(names):
+            pars[k] = pop[:, i]
+        shape = (len(pop), nmes)
+        tepi = calc_epilimnion_temperature_batch(
+                np.broadcast_to(tair, shape), np.broadcast_to(sr, shape),
+                pars, periodicity=periodicity, backend=backend)
+        sims = {'tepi': tepi}
+        if 'thyp' in obs:
+            sims['thyp'] = calc_hypolimnion_temperature_batch(
+                    tepi, pars, periodicity=periodicity, backend=backend)
+        score = np.zeros(len(pop))
+        for k, (ind_k, v_obs) in obs.items():
+            stats = error_statistics_batch(
+                    sims[k][:, ind_k], np.broadcast_to(v_obs,
+                                                       (len(pop), len(v_obs))))
+            score += np.abs(stats[_STATISTICS[objective]])
+        score[~np.isfinite(score)] = np.inf
+        return score
+
+    # Initial population, including the initial parameter values
+    rng = np.random.RandomState(seed)
+    pop = lower + rng.random_sample((popsize, npar))*(upper - lower)
+    pop[0] = np.clip([par_vals[k] for k in names], lower, upper)
+    score = evaluate(pop)
+    nfev = popsize
+
+    # Differential evolution
+    niter = 0
+    rows = np.arange(popsize)
+    for niter in range(1, maxiter + 1):
+        # Mutation: three distinct random members, different from each one
+        keys = rng.random_sample((popsize, popsize))
+        keys[rows, rows] = 2
+        r = np.argsort(keys, axis=1)[:, :3]
+        if np.ndim(mutation) == 0:
+            f = mutation
+        else:
+            f = rng.uniform(mutation[0], mutation[1])
+        mutant = pop[r[:, 0]] + f*(pop[r[:, 1]] - pop[r[:, 2]])
+
+        # Binomial crossover (at least one parameter from the mutant)
+        cross = rng.random_sample((popsize, npar)) < recombination
+        cross[rows, rng.randint(npar, size=popsize)] = True
+        trial = np.where(cross, mutant, pop)
+
+        # Values out of bounds are drawn between the parent and the bound
+        u = rng.random_sample((popsize, npar))
+        trial = np.where(trial < lower, lower + u*(pop - lower), trial)
+        trial = np.where(trial > upper, upper - u*(upper - pop), trial)
+
+        # Selection
+        trial_score = evaluate(trial)
+        nfev += popsize
+        better = trial_score <= score
+        pop[better] = trial[better]
+        score[better] = trial_score[better]
+
+        # Convergence
+        if np.all(np.isfinite(score)) and \
+                np.std(score) <= tol*np.abs(np.mean(score)):
+            break
+
+    best = int(np.argmin(score))
+    par_best = dict(par_vals)
+    for i, k in enumerate(names):
+        par_best[k] = float(pop[best, i])
+
+    return {'par_vals': par_best, 'score': float(score[best]),
+            'niter': niter, 'nfev': nfev}
+
+
+def calibrate_okp(meteo_file, obs_file, par_file, lake_file=None,
+                  output_par_file=None, start_date=None, end_date=None,
+                  **kwargs):
+    """Calibrate the parameters of the OKP model from data files.
+
+    Args:
+        meteo_file: path of the meteorological data file.
+        obs_file: path of the file containing observational data (with the
+            same format as the validation data file of okp_model.run_okp).
+        par_file: path of the parameter file with the initial parameter
+            values. If it does not exist, initial values are estimated from
+            lake_file.
+        lake_file: path of the lake data file (optional, it is only necessary
+            if par_file does not exist).
+        output_par_file: path of the file where the calibrated parameter
+            values are written. If None, par_file is used.
+        start_date: date of start of the calibration period in the format
+            'YYYY-mm-dd'.
+        end_date: date of end of the calibration period in the format
+            'YYYY-mm-dd'.
+        **kwargs: other arguments passed to calibrate (e.g., bounds,
+            periodicity, objective, popsize, maxiter, seed, backend).
+
+    Returns:
+        The dictionary returned by calibrate. The calibrated parameter values
+        are written to output_par_file.
+    """
+    # Allow tilde expansion
+    meteo_file = os.path.expanduser(meteo_file)
+    obs_file = os.path.expanduser(obs_file)
+    par_file = os.path.expanduser(par_file)
+    if lake_file is not None:
+        lake_file = os.path.expanduser(lake_file)
+    if output_par_file is None:
+        output_par_file = par_file
+    output_par_file = os.path.expanduser(output_par_file)
+
+    # Read meteorological and observed data
+    meteo = okplm.read_meteo(meteo_file)
+    ind = okplm.daterange_slice(meteo['date'], start_date, end_date)
+    meteo = {k: v[ind] for k, v in meteo.items()}
+    v_data = np.genfromtxt(obs_file, names=True, encoding='utf-8',
+                           dtype=None)
+    obs_data = {k: v_data[k] for k in v_data.dtype.names}
+
+    # Initial parameter values
+    if os.path.exists(par_file):
+        par_vals = okplm.read_dict(par_file)
+    else:
+        par_vals = _estimate_lake_parameters(lake_file,
+                                             np.mean(meteo['tair']))
+
+    # Calibration
+    res = calibrate(meteo['date'], meteo['tair'], meteo['sr'], obs_data,
+                    par_vals, **kwargs)
+    okplm.write_dict(res['par_vals'], output_par_file)
+
+    return res
+
+
+def calibrate_separable(date, tair, sr, obs_data, par_vals,
+                        alpha_bounds=DEFAULT_BOUNDS['ALPHA'],
+                        beta_bounds=DEFAULT_BOUNDS['BETA'],
+                        e_bounds=DEFAULT_BOUNDS['E'], periodicity='daily',
+                        ngrid=24, tol=1e-4, backend=None):
+    """Calibrate the parameters of the OKP model by separable least squares.
+
+    ALPHA is searched over a grid of values (simulated at once) refined by
+    golden-section search. For each value, the smoothed air temperature
+    ftair is computed once and cached, and A, B and C are the least squares
+    solution of tepi = A + B*ftair + C*fsr at the observation dates. The
+    observations at 0 ºC are only used where the model gives a positive
+    temperature, so that the clipping at 0 ºC is taken into account.
+
+    If hypolimnion temperature is observed, BETA and E are then searched
+    over a grid of values (simulated at once with the complete recursion,
+    including the overturn and the minimum temperature) refined by
+    golden-section search along each parameter, with D kept at its value in
+    par_vals.
+
+    Args:
+        date: sorted array of dates of the meteorological data
+            (numpy.datetime64[D]).
+        tair: array of air temperature (ºC).
+        sr: array of solar radiation (W/m\\ :sup:`2`\\ ).
+        obs_data: a dictionary with an array of dates ('date') and arrays of
+            observed epilimnion ('tepi') and optionally hypolimnion ('thyp')
+            temperature. Missing values (nan) are ignored.
+        par_vals: a dictionary or an OKPParameters object with the values of
+            the parameters not calibrated (D, at_factor, sw_factor and mat,
+            and BETA and E if hypolimnion temperature is not observed). It is
+            not modified.
+        alpha_bounds: tuple (lower, upper) of bounds of ALPHA.
+        beta_bounds: tuple (lower, upper) of bounds of BETA.
+        e_bounds: tuple (lower, upper) of bounds of E.
+        periodicity: periodicity of the input meteorological data and of the
+            simulation; it can take the values 'daily', 'weekly', 'monthly'.
+        ngrid: number of values of the initial grids of ALPHA, BETA and E
+            (logarithmically spaced for ALPHA and BETA).
+        tol: tolerance of the golden-section searches (relative for ALPHA and
+            BETA, absolute for E).
+        backend: implementation of the model kernels ('python', 'numpy',
+            'numba' or 'auto'; see the module kernels). If None, the value of
+            the environment variable OKPLM_BACKEND is used.
+
+    Returns:
+        A dictionary with the calibrated parameter values ('par_vals', a
+        dictionary with all the parameters), the sum of the root mean square
+        errors of epilimnion and hypolimnion temperature ('score', as in
+        calibrate) and the number of simulated values of ALPHA and of pairs
+        of values of BETA and E, including the golden-section searches
+        ('nfev').
+    """
+    par_vals = {k: float(par_vals[k]) for k in PARAMETER_NAMES}
+    tair = np.asarray(tair, dtype=float)
+    sr = np.asarray(sr, dtype=float)
+    obs = _match_observations(date, obs_data)
+    if 'tepi' not in obs:
+        raise ValueError('No observations of epilimnion temperature in ' +
+                         'the simulation period')
+    nper_yr = _periods_per_year(periodicity)
+    c = 365.25/nper_yr
+    nmes = len(tair)
+
+    # fsr, independent of the parameters searched
+    x = tair*par_vals['at_factor'] - par_vals['mat']
+    m_sr, a_sr, ph_sr = fit_sinusoidal_batch(sr*par_vals['sw_factor'],
+                                             period=nper_yr)
+    fsr = calc_sinusoidal(m_sr, a_sr, ph_sr, nmes, period=nper_yr)
+
+    # Epilimnion: search of ALPHA, with A, B, C solved by least squares
+    ind_epi, tepi_obs = obs['tepi']
+    ftair_cache = dict()
+
+    def score_alpha(alphas):
+        new = [v for v in alphas if v not in ftair_cache]
+        if new:
+            ftair = exponential_smoothing(
+                    np.broadcast_to(x, (len(new), nmes)),
+                    np.minimum(np.array(new)*c, 1), backend=backend)
+            for v, f in zip(new, ftair[:, ind_epi]):
+                ftair_cache[v] = f
+        ftair = np.array([ftair_cache[v] for v in alphas])
+        design = np.stack([np.ones_like(ftair), ftair,
+                           np.broadcast_to(fsr[ind_epi], ftair.shape)],
+                          axis=-1)
+        coefs = _clipped_least_squares(design, tepi_obs)
+        tepi = np.maximum(np.einsum('gmk,gk->gm', design, coefs), 0)
+        return _rmse(tepi, tepi_obs), coefs
+
+    grid = np.geomspace(alpha_bounds[0], alpha_bounds[1], ngrid)
+    alpha, score, (a, b, c_sr) = _golden_section(score_alpha, grid, tol,
+                                                 log=True)
+    par_best = dict(par_vals, ALPHA=alpha, A=a, B=b, C=c_sr)
+    nfev = len(ftair_cache)
+
+    # Hypolimnion: search of BETA and E
+    if 'thyp' in obs:
+        ind_hyp, thyp_obs = obs['thyp']
+        ftair = exponential_smoothing(x, min(alpha*c, 1), backend=backend)
+        tepi = np.maximum(a + b*ftair + c_sr*fsr, 0)
+
+        def score_hyp(betas, es):
+            nonlocal nfev
+            nfev += len(betas)
+            thyp = hypolimnion_recursion(
+                    np.broadcast_to(tepi, (len(betas), nmes)),
+                    np.minimum(np.array(betas)*c, 1),
+                    np.full(len(betas), par_vals['D']),
+                    np.full(len(betas), a), np.array(es, dtype=float),
+                    backend=backend)
+            return _rmse(thyp[:, ind_hyp], thyp_obs)
+
+        betas, es = np.meshgrid(np.geomspace(beta_bounds[0], beta_bounds[1],
+                                             ngrid),
+                                np.linspace(e_bounds[0], e_bounds[1], ngrid))
+        scores = score_hyp(betas.ravel(), es.ravel()).reshape(betas.shape)
+        i, j = np.unravel_index(np.nanargmin(scores), scores.shape)
+        beta, e = betas[i, j], es[i, j]
+        for _ in range(2):
+            beta, _, _ = _golden_section(
+                    lambda v: (score_hyp(v, [e]*len(v)), [None]*len(v)),
+                    betas[i], tol, log=True, x0=beta)
+            e, score_hyp_best, _ = _golden_section(
+                    lambda v: (score_hyp([beta]*len(v), v), [None]*len(v)),
+                    es[:, j], tol, x0=e)
+        par_best.update(BETA=float(beta), E=float(e))
+        score += score_hyp_best
+
+    return {'par_vals': {k: float(v) for k, v in par_best.items()},
+            'score': float(score), 'nfev': nfev}
+
+
+def _clipped_least_squares(design, y, niter=5):
+    """Solve a stack of small linear least squares problems with clipping.
+
+    design is an array (problems x observations x coefficients) and y an
+    array of observations common to all the problems, of a model clipped at
+    0. The normal equations are solved for all the problems at once, first
+    with the positive observations only, then adding the observations at 0
+    where the model gives positive values. A ValueError is raised if there
+    are not enough positive observations or if they do not determine the
+    coefficients (collinear columns of design).
+    """
+    ncoefs = design.shape[-1]
+    if np.count_nonzero(y > 0) < ncoefs:
+        raise ValueError('At least %d observations of epilimnion ' % ncoefs +
+                         'temperature above 0 ºC are necessary in the ' +
+                         'calibration period')
+    weights = np.broadcast_to(y > 0, design.shape[:2]).astype(float)
+    for i in range(niter):
+        lhs = np.einsum('gmk,gm,gml->gkl', design, weights, design)
+        rhs = np.einsum('gmk,gm,m->gk', design, weights, y)
+        if i == 0 and np.any(np.linalg.matrix_rank(lhs) < ncoefs):
+            # the observations used later include these ones
+            raise ValueError('Rank-deficient least squares fit of A, B and ' +
+                             'C: the observations of epilimnion temperature ' +
+                             'above 0 ºC do not determine them')
+        coefs = np.linalg.solve(lhs, rhs[..., None])[..., 0]
+        pred = np.einsum('gmk,gk->gm', design, coefs)
+        new_weights = ((y > 0) | (pred > 0)).astype(float)
+        if np.array_equal(new_weights, weights):
+            break
+        weights = new_weights
+    return coefs
+
+
+def _golden_section(func, grid, tol, log=False, x0=None):
+    """Minimize a function of one variable over a grid, with refinement.
+
+    func takes a list of values and returns an array of scores and a
+    sequence of other results (one per value). The function is evaluated
+    over the grid (unless x0 is given), and the minimum is refined by
+    golden-section search between the neighbours of the best value of the
+    grid (or of x0), in logarithmic scale if log is True. Returns the best
+    value, its score and its other results.
+    """
+    grid = np.asarray(grid, dtype=float)
+    if x0 is None:
+        scores, results = func(list(grid))
+        i = int(np.nanargmin(scores))
+        best = (float(grid[i]), scores[i], results[i])
+    else:
+        i = int(np.argmin(np.abs(grid - x0)))
+        scores, results = func([float(x0)])
+        best = (float(x0), scores[0], results[0])
+
+    # Golden-section search
+    fwd, inv = (np.log, np.exp) if log else (float, float)
+    lo = fwd(grid[max(i - 1, 0)])
+    hi = fwd(grid[min(i + 1, len(grid) - 1)])
+    g = (np.sqrt(5) - 1)/2
+    x1 = hi - g*(hi - lo)
+    x2 = lo + g*(hi - lo)
+    (f1, f2), (r1, r2) = func([float(inv(x1)), float(inv(x2))])
+    while hi - lo > tol:
+        if f1 <= f2:
+            hi, x2, f2, r2 = x2, x1, f1, r1
+            x1 = hi - g*(hi - lo)
+            f, r = func([float(inv(x1))])
+            f1, r1 = f[0], r[0]
+        else:
+            lo, x1, f1, r1 = x1, x2, f2, r2
+            x2 = lo + g*(hi - lo)
+            f, r = func([float(inv(x2))])
+            f2, r2 = f[0], r[0]
+    for x, f, r in [(x1, f1, r1), (x2, f2, r2)]:
+        if f < best[1]:
+            best = (float(inv(x)), f, r)
+    return best
+
+
+def _match_observations(date, obs_data):
+    """Return the time steps and values of the observations of each variable.
+
+    The result is a dictionary with a tuple (indices in date, observed
+    values) for 'tepi' and 'thyp', for the observations in the simulation
+    period without missing values. A ValueError is raised if there are no
+    such observations (e.g., if date is empty).
+    """
+    t = np.asarray(date, dtype='datetime64[D]')
+    if len(t) == 0:
+        raise ValueError('No observations in the simulation period')
+    t_obs = np.asarray(obs_data['date'], dtype='datetime64[D]')
+    ind = np.minimum(np.searchsorted(t, t_obs), len(t) - 1)
+    ind_in = t[ind] == t_obs
+    obs = dict()
+    for k in ['tepi', 'thyp']:
+        if k in obs_data:
+            v_obs = np.asarray(obs_data[k], dtype=float)[ind_in]
+            valid = ~np.isnan(v_obs)
+            if np.any(valid):
+                obs[k] = (ind[ind_in][valid], v_obs[valid])
+    if not obs:
+        raise ValueError('No observations in the simulation period')
+    return obs
+
+
+def _rmse(sim, obs):
+    """Return the root mean square error of each row of sim."""
+    return np.sqrt(np.mean((sim - obs)**2, axis=-1))
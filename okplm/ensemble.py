@@ -0,0 +1,284 @@
+"""Ensemble simulations and sensitivity analysis of the OKP model.
+
+The functions in this module propagate the uncertainty of the lake
+characteristics (e.g., altitude, surface, volume, zmax), of the parameter
+constants (see the module parameter_constants) and of the parameter values of
+the OKP model to the simulated epilimnion and hypolimnion temperature.
+
+The uncertain factors are sampled uniformly within bounds with the design of
+Saltelli (2002): two independent samples A and B of N sets of values, and, for
+each factor i, the sample AB_i equal to A except for the factor i, taken from
+B. All the members of the ensemble (N(k + 2) for k factors) are passed at once
+to parameter_functions.estimate_parameters and simulated with the batched
+simulation functions (one row per member, see
+okp_model.calc_epilimnion_temperature_batch and
+okp_model.calc_hypolimnion_temperature_batch), by blocks of members if
+necessary, for one or several water bodies. First-order and total-order Sobol
+indices are estimated with the estimators of Saltelli et al. (2010) and Jansen
+(1999), and the ensemble statistics are updated online (see the module
+reducers), so that the simulations of the members are not stored.
+
+This module contains the following functions:
+
+    * run_ensemble: run an ensemble of simulations of the OKP model and
+      estimate the Sobol sensitivity indices.
+    * saltelli_design: sample the values of the uncertain factors.
+    * sobol_indices: estimate the Sobol sensitivity indices of the outputs of
+      a Saltelli design.
+
+References:
+    * Jansen, M. J. W. (1999) Analysis of variance designs for model output.
+      *Computer Physics Communications*, 117, 35-43.
+    * Saltelli, A. (2002) Making best use of model evaluations to compute
+      sensitivity indices. *Computer Physics Communications*, 145, 280-297.
+    * Saltelli, A.; Annoni, P.; Azzini, I.; Campolongo, F.; Ratto, M.;
+      Tarantola, S. (2010) Variance based sensitivity analysis of model
+      output. Design and estimator for the total sensitivity index. *Computer
+      Physics Communications*, 181, 259-270.
+
+"""
+# Copyright 2020-2022 Segula Technologies - Office Français de la Biodiversité.
+#
+# This file is part of the Python package "okplm".
+#
+# The package "okplm" is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# The package "okplm" is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with "okplm".  If not, see <https://www.gnu.org/licenses/>.
+
+
+import numpy as np
+
+from okplm.okp_model import calc_epilimnion_temperature_batch
+from okplm.okp_model import calc_hypolimnion_temperature_batch
+from okplm.parameter_functions import estimate_parameters
+from okplm.parameter_functions import lake_type_constants
+from okplm.parameters import PARAMETER_NAMES
+from okplm.reducers import EnsembleStatistics
+
+# Lake characteristics used to estimate the parameter values
+LAKE_VARIABLES = ('latitude', 'altitude', 'zmax', 'surface', 'volume')
+
+
+def run_ensemble(date, tair, sr, lake_data, bounds, n, periodicity='daily',
+                 block_size=None, quantiles=None, seed=None, backend=None):
+    """Run an ensemble of simulations of the OKP model.
+
+    Only the summary statistics are kept in memory: the members are
+    simulated by blocks, and each block updates the sums used by the Sobol
+    estimators and the online statistics of the samples A and B (see
+    reducers.EnsembleStatistics) before the next block is simulated.
+
+    Args:
+        date: array of dates of the meteorological data
+            (numpy.datetime64[D]).
+        tair: array of air temperature (ºC), with one row per water body if
+            there are several water bodies.
+        sr: array of solar radiation (W/m\\ :sup:`2`\\ ), with the same
+            shape of tair.
+        lake_data: a dictionary with the lake characteristics (see
+            parameter_functions.estimate_parameters), including the type of
+            water body ('type'). The values can be arrays with one value per
+            water body, or it can be a structured array with these fields.
+        bounds: a dictionary with a tuple (lower, upper) of bounds for each
+            uncertain factor. The factors can be lake characteristics (see
+            LAKE_VARIABLES), parameter constants (e.g., 'A1' or 'E2'; see
+            parameter_functions.lake_type_constants) or parameters of the
+            model (e.g., 'at_factor'), which replace the estimated values.
+            The same values are used for all the water bodies.
+        n: number of sets of values of each sample of the Saltelli design.
+        periodicity: periodicity of the input meteorological data and of the
+            simulation; it can take the values 'daily', 'weekly', 'monthly'.
+        block_size: number of sets of values (i.e., groups of k + 2 members
+            for k factors) simulated at once. If None, all the members are
+            simulated at once.
+        quantiles: sequence of probabilities [0 - 1] of the quantiles of the
+            ensemble to estimate (optional).
+        seed: seed of the random number generator (optional).
+        backend: implementation of the model kernels ('python', 'numpy',
+            'numba' or 'auto'; see the module kernels). If None, the value of
+            the environment variable OKPLM_BACKEND is used.
+
+    Returns:
+        A dictionary with the array of dates ('date'), the names of the
+        factors ('factors'), the number of members ('nmembers') and, for
+        'tepi' and 'thyp', a dictionary with the ensemble mean ('mean'),
+        standard deviation ('sd'), minimum ('min') and maximum ('max') at
+        each time step (over the samples A and B), the approximate quantiles
+        ('quantiles', quantiles x time steps, if quantiles is given) and the
+        first-order and total-order Sobol indices ('first_order' and
+        'total_order', factors x time steps). With several water bodies, the
+        arrays have one more dimension before the time steps (e.g., factors
+        x water bodies x time steps).
+    """
+    names, design = saltelli_design(bounds, n, seed=seed)
+    if block_size is None:
+        block_size = n
+
+    # Shape of the water bodies (() for one water body)
+    lake_shape = np.broadcast(*[np.asarray(lake_data[k]) for k in
+                                LAKE_VARIABLES + ('type',)]).shape
+    tair = np.asarray(tair, dtype=float)
+    nmes = tair.shape[-1]
+    tair = np.broadcast_to(tair, lake_shape + (nmes,))
+    sr = np.broadcast_to(np.asarray(sr, dtype=float), tair.shape)
+
+    # Constants for the type of water body and mean air temperature
+    par_cts = lake_type_constants(lake_data['type'])
+    mat = np.mean(tair, axis=-1)
+    for name in names:
+        if name not in LAKE_VARIABLES and name not in par_cts and \
+                name not in PARAMETER_NAMES:
+            raise ValueError('Unknown uncertain factor: ' + name)
+
+    # Simulation of the ensemble by blocks of members
+    sums = {'tepi': None, 'thyp': None}
+    shift = dict()
+    stats = {k: EnsembleStatistics(quantiles) for k in ['tepi', 'thyp']}
+    for start in range(0, n, block_size):
+        x = design[start:start + block_size]
+        nmembers = x.shape[0]*x.shape[1]
+        par_vals = _member_parameters(names, x.reshape(nmembers, -1),
+                                      lake_data, par_cts, mat, lake_shape)
+        tepi = calc_epilimnion_temperature_batch(
+                np.broadcast_to(tair, (nmembers,) + tair.shape).reshape(
+                    -1, nmes),
+                np.broadcast_to(sr, (nmembers,) + sr.shape).reshape(-1, nmes),
+                par_vals, periodicity=periodicity, backend=backend)
+        thyp = calc_hypolimnion_temperature_batch(
+                tepi, par_vals, periodicity=periodicity, backend=backend)
+        for k, y in [('tepi', tepi), ('thyp', thyp)]:
+            y = y.reshape(x.shape[:2] + tair.shape)
+            if sums[k] is None:
+                shift[k] = np.mean(y[:, :2], axis=(0, 1))
+                sums[k] = _sobol_sums(y, shift[k])
+            else:
+                sums[k] = {s: sums[k][s] + v
+                           for s, v in _sobol_sums(y, shift[k]).items()}
+            stats[k].update(y[:, :2].reshape((-1,) + tair.shape))
+
+    res = {'date': np.asarray(date), 'factors': names,
+           'nmembers': design.shape[0]*design.shape[1]}
+    for k in ['tepi', 'thyp']:
+        first, total = _sobol_estimates(sums[k])[2:]
+        res[k] = stats[k].result()
+        del res[k]['count']
+        res[k].update(first_order=first, total_order=total)
+    return res
+
+
+def saltelli_design(bounds, n, seed=None):
+    """Sample the values of the uncertain factors with a Saltelli design.
+
+    Args:
+        bounds: a dictionary with a tuple (lower, upper) of bounds for each
+            factor. The values are sampled uniformly within the bounds.
+        n: number of sets of values of each sample.
+        seed: seed of the random number generator (optional).
+
+    Returns:
+        A tuple (names, design) with the names of the factors (sorted) and an
+        array of shape (n, k + 2, k) for k factors, where design[:, 0] is the
+        sample A, design[:, 1] the sample B and design[:, 2 + i] the sample
+        AB_i (A with the values of the factor i of B).
+    """
+    names = tuple(sorted(bounds))
+    k = len(names)
+    lower = np.array([bounds[name][0] for name in names], dtype=float)
+    upper = np.array([bounds[name][1] for name in names], dtype=float)
+    rng = np.random.RandomState(seed)
+    a, b = lower + (upper - lower)*rng.random_sample((2, n, k))
+    design = np.repeat(a[:, None], k + 2, axis=1)
+    design[:, 1] = b
+    for i in range(k):
+        design[:, 2 + i, i] = b[:, i]
+    return names, design
+
+
+def sobol_indices(y):
+    """Estimate the Sobol sensitivity indices from the outputs of a design.
+
+    Args:
+        y: array of model outputs of shape (n, k + 2, ...) for the members of
+            a design returned by saltelli_design (one or several outputs per
+            member).
+
+    Returns:
+        A tuple (first_order, total_order) of arrays of shape (k, ...) with
+        the first-order and total-order Sobol indices of each factor. The
+        indices are nan for the outputs without variance.
+    """
+    y = np.asarray(y, dtype=float)
+    shift = np.mean(y[:, :2], axis=(0, 1))
+    return _sobol_estimates(_sobol_sums(y, shift))[2:]
+
+
+def _member_parameters(names, x, lake_data, par_cts, mat, lake_shape):
+    """Return the parameter values of the members of an ensemble.
+
+    x is an array (members x factors) of values of the factors names, and
+    lake_shape the shape of the water bodies of lake_data. The parameter
+    values are returned as arrays with one value per member and water body
+    (flattened, one row of the batched simulation functions per value).
+    """
+    var_vals = {k: lake_data[k] for k in LAKE_VARIABLES}
+    par_cts = dict(par_cts)
+    par_vals = dict()
+    x = x.reshape(x.shape + (1,)*len(lake_shape))
+    for i, name in enumerate(names):
+        if name in LAKE_VARIABLES:
+            var_vals[name] = x[:, i]
+        elif name in par_cts:
+            par_cts[name] = x[:, i]
+        else:
+            par_vals[name] = x[:, i]
+    pars = estimate_parameters(var_vals, par_cts)
+    pars['mat'] = mat
+    pars.update(par_vals)
+    shape = (len(x),) + lake_shape
+    return {k: np.broadcast_to(v, shape).reshape(-1)
+            for k, v in pars.items()}
+
+
+def _sobol_estimates(sums):
+    """Return the mean, variance and Sobol indices from sums of outputs.
+
+    The mean (relative to the shift of _sobol_sums) and variance are those of
+    the samples A and B. The outputs of B in the estimator of the first-order
+    indices are centered on this mean.
+    """
+    n = sums['n']
+    mean = sums['sum']/(2*n)
+    var = np.maximum(sums['sum2']/(2*n) - mean**2, 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        first = np.where(var > 0,
+                         (sums['first'] - mean*sums['diff'])/n/var, np.nan)
+        total = np.where(var > 0, sums['total']/(2*n)/var, np.nan)
+    return mean, var, first, total
+
+
+def _sobol_sums(y, shift):
+    """Return the sums of outputs used by the Sobol estimators.
+
+    y is an array (n, k + 2, ...) of outputs of a Saltelli design, shifted by
+    shift (e.g., an estimate of the mean) to reduce rounding errors. The sums
+    of several blocks of sets of values can be added.
+    """
+    y = y - shift
+    y_a = y[:, 0]
+    y_b = y[:, 1]
+    d = y[:, 2:] - y_a[:, None]
+    return {'n': y.shape[0],
+            'sum': np.sum(y_a, axis=0) + np.sum(y_b, axis=0),
+            'sum2': np.sum(y_a**2, axis=0) + np.sum(y_b**2, axis=0),
+            'first': np.sum(y_b[:, None]*d, axis=0),
+            'diff': np.sum(d, axis=0),
+            'total': np.sum(d**2, axis=0)}
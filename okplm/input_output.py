@@ -1,12 +1,38 @@
 """Functions to read and write data.
 
 The functions in this module are used to read the configuration and input data
-files of the OKP lake model, as well as for writing the results to a text file.
+files of the OKP lake model, as well as for writing the results to a text file
+or to a binary file.
 
 This module contains the following functions:
 
+    * build_meteo_index: build the date index of a meteorological data file.
+    * iter_meteo: read meteorological data file by chunks.
     * read_dict: read lake or parameter file to dictionary.
+    * read_meteo: read meteorological data file.
+    * read_meteo_range: read the rows of a date range of a meteorological data
+      file.
+    * read_output: read output file.
     * write_dict: write dictionary to file.
+    * write_output: write simulation results to file.
+
+The output files can be written in the following formats:
+
+    * 'text': text file with a header line ('date tepi thyp') and one row
+      per time step (default).
+    * 'npy': numpy binary file with a structured array of fields date
+      (numpy.datetime64[D]), tepi and thyp (float64).
+    * 'npz': numpy archive with the arrays date, tepi and thyp.
+    * 'raw': one line of JSON header (padded with spaces to a multiple of 64
+      bytes) followed by the raw little-endian float32 values of the columns
+      date (days since 1970-01-01), tepi and thyp, row by row. The header
+      contains the keys format, dtype, columns, nrows and date_unit.
+
+The date index of a meteorological data file is saved next to it, with the
+name of the file followed by '.idx' (e.g., 'meteo.txt.idx'). It contains the
+dates and the byte offsets of the rows of the file, as well as the size and
+modification time of the file when the index was built, so that an outdated
+index is detected and built again.
 
 """
 # Copyright 2019 Segula Technologies - Agence Française pour la Biodiversité.
@@ -28,6 +54,91 @@ This module contains the following functions:
 # along with "okplm".  If not, see <https://www.gnu.org/licenses/>.
 
 
+import io
+import json
+import os
+import warnings
+from itertools import islice
+
+import numpy as np
+
+
+# Columns of the output files
+OUTPUT_COLUMNS = ('date', 'tepi', 'thyp')
+OUTPUT_FORMATS = ('text', 'npy', 'npz', 'raw')
+
+
+def build_meteo_index(path, save=True):
+    """Build the date index of a meteorological data file.
+
+    Args:
+        path: path of text file (see read_meteo), with the dates in
+            increasing order.
+        save: if True, the index is saved next to the file (see the module
+            documentation). If the index cannot be written (e.g., read-only
+            folder), it is only returned.
+
+    Returns:
+        A Python dictionary with the array of dates of the rows ('date'), the
+        array of byte offsets of the start of the rows followed by the offset
+        of the end of the last row ('offset'), a flag indicating if the dates
+        are sorted in increasing order ('sorted'), and the size ('size') and
+        modification time in nanoseconds ('mtime') of the file.
+    """
+    stat = os.stat(path)
+    with open(path, 'rb') as f:
+        header = f.readline()
+        content = f.read()
+    icol = header.decode('utf-8').split().index('date')
+
+    # Offsets of the rows, skipping empty lines
+    lines = content.split(b'\n')
+    starts = len(header) + np.cumsum([0] + [len(l) + 1 for l in lines])
+    rows = [i for i, l in enumerate(lines) if l.strip()]
+    dates = np.array([lines[i].split()[icol].decode('utf-8') for i in rows],
+                     dtype='datetime64[D]')
+    offsets = np.empty(len(rows) + 1, dtype=np.int64)
+    offsets[:-1] = starts[rows]
+    offsets[-1] = min(starts[rows[-1] + 1], stat.st_size) if rows else \
+        len(header)
+
+    index = {'date': dates, 'offset': offsets,
+             'sorted': bool(np.all(dates[1:] > dates[:-1])),
+             'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+    if save:
+        try:
+            with open(path + '.idx', 'wb') as f:
+                np.savez(f, **index)
+        except OSError:
+            pass
+    return index
+
+
+def iter_meteo(path, chunk_size):
+    """Read meteorological data file by chunks.
+
+    The file is read sequentially, so that only one chunk of data is in
+    memory at a time.
+
+    Args:
+        path: path of text file (see read_meteo).
+        chunk_size: number of rows (time steps) of each chunk.
+
+    Yields:
+        A Python dictionary for each chunk of chunk_size rows (or less for
+        the last chunk), with one array per column as read_meteo().
+    """
+    with open(path, 'rt', encoding='utf-8') as f:
+        names = f.readline().split()
+        while True:
+            text = ''.join(islice(f, chunk_size))
+            if not text:
+                return
+            chunk = _meteo_columns(names, text, path)
+            if len(chunk[names[0]]) > 0:
+                yield chunk
+
+
 def read_dict(path):
     """Read lake or parameter file to dictionary.
 
@@ -57,6 +168,113 @@ def read_dict(path):
     return output
 
 
+def read_meteo(path):
+    """Read meteorological data file.
+
+    The whole file is read at once: dates are converted directly to
+    numpy.datetime64 values and the other columns to floats, without
+    creating Python objects for each row.
+
+    Args:
+        path: path of text file. The file should be structured in columns
+            separated by spaces, with a header line with the column names
+            (e.g., 'date tair sr'). The column 'date' contains dates in the
+            format 'YYYY-mm-dd' and the other columns contain numeric values.
+            Comments (starting with '#') and blank lines are skipped.
+
+    Returns:
+        A Python dictionary with one array per column. The array 'date' is of
+        type numpy.datetime64[D] and the other arrays are of type float64.
+    """
+    # Read file
+    with open(path, 'rt', encoding='utf-8') as f:
+        names = f.readline().split()
+        text = f.read()
+
+    return _meteo_columns(names, text, path)
+
+
+def read_meteo_range(path, start_date=None, end_date=None):
+    """Read the rows of a date range of a meteorological data file.
+
+    The date index of the file is used to read only the rows of the date
+    range: it is loaded from the file saved next to the meteorological data
+    file, or built (and saved) with build_meteo_index if it does not exist or
+    if the file has been modified since it was built. If the dates of the
+    file are not sorted, the whole file is read.
+
+    Args:
+        path: path of text file (see read_meteo).
+        start_date: first date of the range in the format 'YYYY-mm-dd'. If
+            None, the range starts at the beginning of the file.
+        end_date: last date of the range in the format 'YYYY-mm-dd'. If None,
+            the range ends at the end of the file.
+
+    Returns:
+        A Python dictionary with one array per column (see read_meteo),
+        containing the rows with dates between start_date and end_date (or
+        equal).
+    """
+    index = _load_meteo_index(path)
+    if index is None:
+        index = build_meteo_index(path)
+    if not index['sorted']:
+        meteo = read_meteo(path)
+        t = meteo['date']
+        ind = np.ones(len(t), dtype=bool)
+        if start_date is not None:
+            ind &= t >= np.datetime64(start_date, 'D')
+        if end_date is not None:
+            ind &= t <= np.datetime64(end_date, 'D')
+        return {k: v[ind] for k, v in meteo.items()}
+
+    # Seek to the first row of the range and read up to the last one
+    i1 = 0 if start_date is None else \
+        np.searchsorted(index['date'], np.datetime64(start_date, 'D'))
+    i2 = len(index['date']) if end_date is None else \
+        np.searchsorted(index['date'], np.datetime64(end_date, 'D'),
+                        side='right')
+    i2 = max(i1, i2)
+    with open(path, 'rb') as f:
+        names = f.readline().decode('utf-8').split()
+        f.seek(index['offset'][i1])
+        content = f.read(index['offset'][i2] - index['offset'][i1])
+
+    return _meteo_columns(names, content.decode('utf-8'), path)
+
+
+def read_output(path, output_format='text'):
+    """Read output file.
+
+    Args:
+        path: path of the output file.
+        output_format: format of the file ('text', 'npy', 'npz' or 'raw'; see
+            the module documentation).
+
+    Returns:
+        A Python dictionary with the arrays 'date' (numpy.datetime64[D]),
+        'tepi' and 'thyp'.
+    """
+    if output_format == 'text':
+        return read_meteo(path)
+    elif output_format == 'npy':
+        data = np.load(path)
+        return {k: data[k] for k in OUTPUT_COLUMNS}
+    elif output_format == 'npz':
+        with np.load(path) as data:
+            return {k: data[k] for k in OUTPUT_COLUMNS}
+    elif output_format == 'raw':
+        with open(path, 'rb') as f:
+            header = json.loads(f.readline().decode('utf-8'))
+            values = np.fromfile(f, dtype=header['dtype'])
+        values = values.reshape((header['nrows'], len(header['columns'])))
+        output = {k: values[:, i].astype(float)
+                  for i, k in enumerate(header['columns'])}
+        output['date'] = output['date'].astype(int).astype('datetime64[D]')
+        return output
+    raise ValueError('Unknown output format ' + str(output_format))
+
+
 def write_dict(x_dict, path):
     """Write dictionary to file.
 
@@ -71,3 +289,139 @@ def write_dict(x_dict, path):
         for k, v in x_dict.items():
             f.write(k + ' ' + str(v) + '\n')
     return
+
+
+def write_output(path, t, tepi, thyp, output_format='text',
+                 precision=None):
+    """Write simulation results to file.
+
+    Args:
+        path: path of the output file.
+        t: array of dates (numpy.datetime64[D]).
+        tepi: array of epilimnion temperature.
+        thyp: array of hypolimnion temperature.
+        output_format: format of the file ('text', 'npy', 'npz' or 'raw'; see
+            the module documentation).
+        precision: number of decimals of the temperature values in text
+            files. If None, the shortest representation that gives back the
+            same values is used. It is not used for binary formats.
+
+    Returns:
+        A file located at "path" where the simulation results are written.
+    """
+    t = np.asarray(t, dtype='datetime64[D]')
+    if output_format == 'text':
+        with open(path, 'wt') as f:
+            f.write(' '.join(OUTPUT_COLUMNS) + '\n')
+            _write_text_rows(f, t, tepi, thyp, precision)
+    elif output_format == 'npy':
+        data = np.empty(len(t), dtype=[('date', 'datetime64[D]'),
+                                       ('tepi', float), ('thyp', float)])
+        data['date'] = t
+        data['tepi'] = tepi
+        data['thyp'] = thyp
+        with open(path, 'wb') as f:
+            np.save(f, data)
+    elif output_format == 'npz':
+        with open(path, 'wb') as f:
+            np.savez(f, date=t, tepi=tepi, thyp=thyp)
+    elif output_format == 'raw':
+        values = np.empty((len(t), 3), dtype='<f4')
+        values[:, 0] = t.astype(int)
+        values[:, 1] = tepi
+        values[:, 2] = thyp
+        header = json.dumps({'format': 'okplm-raw', 'dtype': '<f4',
+                             'columns': list(OUTPUT_COLUMNS),
+                             'nrows': len(t),
+                             'date_unit': 'days since 1970-01-01'})
+        header = header.ljust(64*((len(header)//64) + 1) - 1) + '\n'
+        with open(path, 'wb') as f:
+            f.write(header.encode('utf-8'))
+            values.tofile(f)
+    else:
+        raise ValueError('Unknown output format ' + str(output_format))
+    return
+
+
+def _convert_columns(names, values):
+    """Convert the values of the rows of a table to one array per column."""
+    # Construct output dictionary, converting each column at once
+    ncols = len(names)
+    output = dict()
+    for i, k in enumerate(names):
+        if k == 'date':
+            output[k] = np.array(values[i::ncols], dtype='datetime64[D]')
+        else:
+            output[k] = np.array(values[i::ncols], dtype=float)
+
+    return output
+
+
+def _load_meteo_index(path):
+    """Load the saved date index of a meteorological data file.
+
+    Returns None if the index does not exist, cannot be read or does not
+    match the size and modification time of the file.
+    """
+    stat = os.stat(path)
+    try:
+        with np.load(path + '.idx') as data:
+            index = {k: data[k] for k in data.files}
+    except (OSError, ValueError):
+        return None
+    if int(index['size']) != stat.st_size or \
+            int(index['mtime']) != stat.st_mtime_ns:
+        return None
+    index['sorted'] = bool(index['sorted'])
+    return index
+
+
+def _meteo_columns(names, text, path):
+    """Convert the rows read from a meteorological data file to arrays.
+
+    The values are split on white space and each column is converted at
+    once. If the text contains comments ('#'), if the number of values does
+    not match the number of rows and columns (e.g., blank or short rows) or
+    if the conversion fails, the text is parsed with numpy.genfromtxt
+    instead, which skips comments and blank lines and raises a ValueError
+    for malformed rows.
+    """
+    values = text.split()
+    stripped = text.strip()
+    nrows = stripped.count('\n') + 1 if stripped else 0
+    if '#' not in text and len(values) == nrows*len(names):
+        try:
+            return _convert_columns(names, values)
+        except ValueError:
+            # misaligned columns, reported by genfromtxt below
+            pass
+
+    try:
+        with warnings.catch_warnings():
+            # text without rows (e.g., only comments)
+            warnings.simplefilter('ignore', UserWarning)
+            rows = np.genfromtxt(io.StringIO(text), dtype=str, comments='#',
+                                 ndmin=2)
+    except ValueError as e:
+        raise ValueError('Malformed meteorological data file ' + path + ': ' +
+                         str(e))
+    if rows.size > 0 and rows.shape[1] != len(names):
+        raise ValueError('Missing values in ' + path)
+    return _convert_columns(names, rows.ravel().tolist())
+
+
+def _write_text_rows(f, t, tepi, thyp, precision=None, block_size=8192):
+    """Write rows of simulation results to an open text file.
+
+    The rows are formatted by blocks of block_size rows, from the numeric
+    arrays, so that the whole table of strings is never held in memory.
+    """
+    if precision is None:
+        row_format = '%s %r %r\n'
+    else:
+        row_format = '%%s %%.%df %%.%df\n' % (precision, precision)
+    for i in range(0, len(t), block_size):
+        rows = zip(np.asarray(t[i:i+block_size]).astype(str).tolist(),
+                   np.asarray(tepi[i:i+block_size], dtype=float).tolist(),
+                   np.asarray(thyp[i:i+block_size], dtype=float).tolist())
+        f.write(''.join([row_format % row for row in rows]))
@@ -0,0 +1,599 @@
+"""Numerical kernels of the OKP lake model.
+
+This module contains the low-level numerical kernels used to solve the
+recursive equations of the OKP model. Each kernel is available in several
+implementations, or backends:
+
+    - 'python': reference implementation written as a loop over time steps.
+    - 'numpy': vectorized implementation based on NumPy array operations.
+    - 'numba': loop compiled with Numba. It is only available if the package
+      numba is installed.
+
+The backend can be chosen with the argument backend of the kernels or with
+the environment variable OKPLM_BACKEND. By default ('auto'), the backend
+'numba' is used if numba is installed and 'numpy' otherwise.
+
+The included functions are:
+
+    - exponential_smoothing: apply a first-order recursive (exponential)
+      filter.
+    - get_backend: return the name of the backend to use.
+    - hypolimnion_recursion: solve the recursion of hypolimnion temperature.
+    - overturn: compare epilimnion and hypolimnion densities.
+    - water_density: calculate water density.
+
+"""
+# Copyright 2020-2022 Segula Technologies - Office Français de la Biodiversité.
+#
+# This file is part of the Python package "okplm".
+#
+# The package "okplm" is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# The package "okplm" is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with "okplm".  If not, see <https://www.gnu.org/licenses/>.
+
+
+import os
+import warnings
+
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# Available implementations of the kernels
+BACKENDS = ('python', 'numpy', 'numba')
+
+# Weight below which the contribution of the state at the start of a block to
+# the end of the block is neglected in the block scan
+_SCAN_TOL = 1e-32
+
+
+def exponential_smoothing(x, alpha, backend=None, y_prev=None):
+    """Apply a first-order recursive (exponential) filter.
+
+    The filtered series y is defined as:
+
+        :math:`y_0 = x_0`
+
+        :math:`y_i = \\alpha x_i + (1 - \\alpha) y_{i-1}`
+
+    If the value of the filtered series before the first time step (y_prev)
+    is given, the recursion is also applied to the first time step, so that a
+    long series can be filtered by chunks.
+
+    Args:
+        x: array of input data. The filter is applied along the last axis, so
+            that several series (e.g., one per lake) can be filtered at once.
+        alpha: smoothing coefficient [0 - 1]. It can be a scalar or an array
+            with one value per series (shape x.shape[:-1]).
+        backend: implementation to use; 'python' for the reference loop over
+            time steps, 'numpy' for the vectorized block scan, 'numba' for the
+            compiled loop or 'auto'. If None, the value of the environment
+            variable OKPLM_BACKEND is used.
+        y_prev: value of the filtered series before the first time step
+            (optional). It can be a scalar or an array with one value per
+            series.
+
+    Returns:
+        An array of the same shape of x with the filtered data.
+    """
+    x = np.asarray(x, dtype=float)
+    alpha = np.asarray(alpha, dtype=float)
+    if y_prev is not None:
+        y_prev = np.broadcast_to(np.asarray(y_prev, dtype=float),
+                                 x.shape[:-1])
+    backend = get_backend(backend)
+    if backend == 'python':
+        return _smoothing_loop(x, alpha, y_prev)
+    elif backend == 'numpy':
+        return _smoothing_scan(x, alpha, y_prev)
+    else:
+        x2, alpha2 = _as_series(x, alpha)
+        if y_prev is None:
+            y = _smoothing_numba(x2, alpha2, np.zeros(len(x2)), False)
+        else:
+            y = _smoothing_numba(x2, alpha2, _as_series(x, y_prev)[1], True)
+        return y.reshape(x.shape)
+
+
+def get_backend(backend=None):
+    """Return the name of the backend to use.
+
+    Args:
+        backend: name of the backend ('python', 'numpy', 'numba' or 'auto').
+            If None, the value of the environment variable OKPLM_BACKEND is
+            used, or 'auto' if it is not defined.
+
+    Returns:
+        The name of the backend. The value 'auto' is resolved to 'numba' if
+        numba is installed and to 'numpy' otherwise. If 'numba' is requested
+        but numba is not installed, 'numpy' is returned with a
+        RuntimeWarning.
+    """
+    if backend is None:
+        backend = os.environ.get('OKPLM_BACKEND', 'auto')
+    backend = backend.lower()
+    if backend == 'auto':
+        backend = 'numpy' if numba is None else 'numba'
+    elif backend not in BACKENDS:
+        raise ValueError('Unknown backend ' + str(backend))
+    elif backend == 'numba' and numba is None:
+        warnings.warn('Package numba not installed. Using backend numpy ' +
+                      'instead.', RuntimeWarning)
+        backend = 'numpy'
+    return backend
+
+
+def hypolimnion_recursion(tepi, beta, d, a, e, backend=None, state=None,
+                          return_state=False):
+    """Solve the recursion of hypolimnion temperature.
+
+    The hypolimnion temperature is calculated from fet, the exponentially
+    smoothed function of epilimnion temperature, as:
+
+        :math:`T_{hyp,i} = T_{hyp,i-1} + E(fet_i - fet_{i-1})`
+
+    starting from :math:`T_{hyp,0} = DA + E fet_0`. When the epilimnion is
+    denser than the hypolimnion (overturn), the hypolimnion temperature takes
+    the value of the epilimnion temperature. Hypolimnion temperature is never
+    lower than 4 ºC.
+
+    Args:
+        tepi: array of epilimnion temperature (ºC). The recursion is solved
+            along the last axis, so that several series can be processed at
+            once.
+        beta: smoothing coefficient of epilimnion temperature [0 - 1], already
+            converted to the periodicity of tepi.
+        d: value of the parameter D.
+        a: value of the parameter A.
+        e: value of the parameter E.
+        backend: implementation to use ('python', 'numpy', 'numba' or
+            'auto'). If None, the value of the environment variable
+            OKPLM_BACKEND is used.
+        state: tuple (fet, thyp_prov, thyp) with the values of fet, the
+            provisional hypolimnion temperature and the hypolimnion
+            temperature before the first time step (optional). If given, the
+            recursion continues from this state, so that a long series can be
+            processed by chunks.
+        return_state: if True, the state after the last time step is also
+            returned.
+
+    The parameters beta, d, a and e, and the values of state, can be scalars
+    or arrays with one value per series (shape tepi.shape[:-1]).
+
+    Returns:
+        An array of the same shape of tepi with the hypolimnion temperature
+        (ºC). If return_state is True, a tuple (thyp, state) is returned
+        instead, where state is the tuple (fet, thyp_prov, thyp) after the
+        last time step.
+
+    With the backend 'numpy', single series are solved with a segmented scan
+    (see _hypolimnion_scan), unless they contain non-finite values, while
+    several series are solved with a loop over time steps updating all the
+    series at once.
+    """
+    tepi = np.asarray(tepi, dtype=float)
+    backend = get_backend(backend)
+    nmes = tepi.shape[-1]
+    if state is not None:
+        state = tuple(np.broadcast_to(np.asarray(v, dtype=float),
+                                      tepi.shape[:-1]) for v in state)
+
+    if backend == 'numba':
+        tepi2, beta2 = _as_series(tepi, beta)
+        da2 = _as_series(tepi, np.multiply(d, a))[1]
+        e2 = _as_series(tepi, e)[1]
+        state2 = np.zeros((3, tepi2.shape[0]))
+        if state is not None:
+            for k in range(3):
+                state2[k] = _as_series(tepi, state[k])[1]
+        thyp, state2 = _hypolimnion_numba(tepi2, beta2, da2, e2, state2,
+                                          state is not None)
+        thyp = thyp.reshape(tepi.shape)
+        if nmes > 0:
+            state = tuple(v.reshape(tepi.shape[:-1]) for v in state2)
+    else:
+        # Calculate fet, the exponentially smoothed function of tepi, and the
+        # provisional hypolimnion temperature
+        fet = exponential_smoothing(tepi, beta, backend=backend,
+                                    y_prev=None if state is None else state[0])
+        thyp_prov = np.multiply(d, a)[..., None] + \
+            np.asarray(e)[..., None]*fet
+
+        # Calculate hypolimnion temperature
+        prev = None if state is None else state[1:]
+        if tepi.ndim == 1 and (backend == 'python' or
+                               not np.isfinite(thyp_prov).all() or
+                               not np.isfinite(tepi).all()):
+            # the scan does not carry missing values (nan) as the loop
+            thyp = _hypolimnion_loop(tepi, thyp_prov, prev)
+        elif tepi.ndim == 1:
+            thyp = _hypolimnion_scan(tepi, thyp_prov, prev)
+        else:
+            thyp = _hypolimnion_loop_series(tepi, thyp_prov, prev)
+        if nmes > 0:
+            state = (fet[..., -1], thyp_prov[..., -1], thyp[..., -1])
+
+    if return_state:
+        return thyp, state
+    return thyp
+
+
+def overturn(tepi, thyp):
+    """Return whether the epilimnion is at least as dense as the hypolimnion.
+
+    Since water density decreases with the distance to the temperature of
+    maximum density (4 ºC), the comparison of the densities given by
+    water_density() is replaced by the equivalent and cheaper comparison of
+    the distances to 4 ºC.
+
+    Args:
+        tepi: epilimnion temperature (ºC); a scalar or an array.
+        thyp: hypolimnion temperature (ºC); a scalar or an array.
+
+    Returns:
+        A boolean (or boolean array) that is True where the epilimnion
+        density is greater than or equal to the hypolimnion density.
+    """
+    return np.abs(np.subtract(tepi, 4)) <= np.abs(np.subtract(thyp, 4))
+
+
+def water_density(temp):
+    """Calculate the water density as a function of temperature.
+
+    Args:
+        temp: water temperature (ºC); a scalar, a sequence or an array of any
+            shape.
+
+    Returns:
+        The water density (kg/m\\ :sup:`3`\\ ) calculated using the formula by
+        Markofsky & Harleman (1971), with the same shape of temp.
+
+    References:
+        * Markofsky, M. and Harleman, D. R. F. (1971) *A predictive model for
+          thermal stratification and water quality in reservoirs.*
+          Environmental Protection Agency.
+    """
+    # Assign coefficient values
+    dens_0 = 1000  # kg/m**3
+    t0 = 4  # ºC
+    alpha = 6.63e-6  # C**-2
+
+    # Calculate density
+    dens = dens_0*(1 - alpha*(np.asarray(temp, dtype=float) - t0)**2)
+
+    return dens
+
+
+def _as_series(x, par):
+    """Reshape data to 2-D (series x time) and parameters to 1-D arrays."""
+    nmes = x.shape[-1]
+    x2 = np.ascontiguousarray(x.reshape(int(np.prod(x.shape[:-1])), nmes))
+    par2 = np.broadcast_to(np.asarray(par, dtype=float), x.shape[:-1])
+    return x2, np.ascontiguousarray(par2.reshape(-1))
+
+
+def _hypolimnion_loop(tepi, thyp_prov, prev=None):
+    """Solve the hypolimnion recursion of one series with a loop.
+
+    prev is the tuple (thyp_prov, thyp) before the first time step, if any.
+    """
+    nmes = len(tepi)
+    thyp = np.zeros(nmes)
+    for i in range(nmes):
+        if i == 0 and prev is None:
+            thyp[i] = thyp_prov[i]
+        elif i == 0:
+            dtemp = thyp_prov[i] - prev[0]
+            thyp[i] = prev[1] + dtemp
+        else:
+            dtemp = thyp_prov[i] - thyp_prov[i-1]
+            thyp[i] = thyp[i-1] + dtemp
+
+        # epilimnion denser than hypolimnion
+        if overturn(tepi[i], thyp[i]):
+            thyp[i] = tepi[i]
+        if thyp[i] < 4:
+            thyp[i] = 4
+
+    return thyp
+
+
+def _hypolimnion_scan(tepi, thyp_prov, prev=None):
+    """Solve the hypolimnion recursion of one series with a segmented scan.
+
+    Between two resets (overturn or 4 ºC floor), the hypolimnion temperature
+    is the provisional temperature plus a constant offset o:
+
+        :math:`T_{hyp,i} = T_{hyp,prov,i} + o`
+
+    so that each segment is obtained at once from thyp_prov. At time step k,
+    there is no reset if :math:`4 \\leq T_{hyp,prov,k} + o < 4 + |T_{epi,k} -
+    4|`, i.e., if o lies in the interval [lo_k, hi_k). After a reset, the
+    hypolimnion temperature takes one of two values, max(tepi_k, 4) or 4,
+    which do not depend on the previous state. For each possible reset (time
+    step, value), the next reset is found with a binary search on sparse
+    tables of the running maximum of lo and minimum of hi, and the chain of
+    resets starting from the first time step is followed by pointer doubling.
+    The cost is O(n log n) array operations, without a loop over time steps.
+
+    prev is the tuple (thyp_prov, thyp) before the first time step, if any,
+    which defines the offset before the first reset (0 otherwise).
+    """
+    nmes = len(tepi)
+    if nmes == 0:
+        return np.zeros(0)
+    off_0 = 0. if prev is None else float(prev[1] - prev[0])
+    dist_e = np.abs(tepi - 4)
+    lo = 4 - thyp_prov
+    hi = lo + dist_e
+
+    # Sparse tables of the maximum of lo and minimum of hi over windows of
+    # 2**p time steps starting at each time step (+/- inf past the end)
+    nlev = int(np.log2(nmes)) + 1
+    lo_max = [lo]
+    hi_min = [hi]
+    for p in range(1, nlev):
+        h = 2**(p - 1)
+        lo_p = np.full(nmes, np.inf)
+        hi_p = np.full(nmes, -np.inf)
+        lo_p[:nmes - h] = np.maximum(lo_max[-1][:nmes - h], lo_max[-1][h:])
+        hi_p[:nmes - h] = np.minimum(hi_min[-1][:nmes - h], hi_min[-1][h:])
+        lo_max.append(lo_p)
+        hi_min.append(hi_p)
+
+    def next_reset(o, start):
+        # first time step k >= start with o out of [lo_k, hi_k) (or nmes)
+        pos = start
+        for p in reversed(range(nlev)):
+            k = np.minimum(pos, nmes - 1)
+            ok = (pos < nmes) & (lo_max[p][k] <= o) & (hi_min[p][k] > o)
+            pos = np.where(ok, pos + 2**p, pos)
+        return pos
+
+    def reset_node(o, k):
+        # node (2*k + b) of the reset at k; b = 0 if the hypolimnion takes
+        # the value max(tepi_k, 4), b = 1 if it takes the value 4
+        k2 = np.minimum(k, nmes - 1)
+        b = np.logical_and(o < hi[k2], o > lo[k2] - dist_e[k2])
+        return np.where(k < nmes, 2*k + b, 2*nmes)
+
+    # Hypolimnion temperature and offset after each possible reset
+    val = np.empty((nmes, 2))
+    val[:, 0] = np.maximum(tepi, 4)
+    val[:, 1] = 4
+    val = val.ravel()
+    off = val - np.repeat(thyp_prov, 2)
+
+    # Next reset after each possible reset, and first reset
+    step = np.repeat(np.arange(nmes), 2)
+    succ = np.append(reset_node(off, next_reset(off, step + 1)), 2*nmes)
+    first = reset_node(off_0, next_reset(np.full(1, off_0),
+                                         np.zeros(1, dtype=int)))
+
+    # Follow the chain of resets: the n-th reset is succ^n(first)
+    nth = np.arange(nmes)
+    node = np.repeat(first, nmes)
+    jump = succ
+    p = 0
+    while 2**p < nmes:
+        node = np.where((nth >> p) & 1, jump[node], node)
+        jump = jump[jump]
+        p += 1
+    node = node[node < 2*nmes]
+    if len(node) == 0:
+        return thyp_prov + off_0
+
+    # Hypolimnion temperature
+    ind_reset = node//2
+    seg = np.full(nmes, -1)
+    seg[ind_reset] = np.arange(len(node))
+    seg = np.maximum.accumulate(seg)
+    thyp = thyp_prov + np.where(seg >= 0, off[node][seg], off_0)
+    thyp[ind_reset] = val[node]
+
+    return thyp
+
+
+def _hypolimnion_loop_series(tepi, thyp_prov, prev=None):
+    """Solve the hypolimnion recursion of several series with a loop.
+
+    Each iteration updates all the series at once. The overturn test uses the
+    distance of epilimnion temperature to 4 ºC, computed once for all time
+    steps (see overturn). prev is the tuple (thyp_prov, thyp) before the first
+    time step, if any.
+    """
+    shape = tepi.shape
+    nmes = shape[-1]
+    if nmes == 0:
+        return np.zeros(shape)
+
+    # Data arranged as (time x series), so that each time step is contiguous
+    tepi_t = np.ascontiguousarray(tepi.reshape(-1, nmes).T)
+    thyp_prov_t = np.ascontiguousarray(
+            np.broadcast_to(thyp_prov, shape).reshape(-1, nmes).T)
+    dist_e = np.abs(tepi_t - 4)
+    dtemp = np.diff(thyp_prov_t, axis=0)
+
+    thyp_t = np.empty(tepi_t.shape)
+    if prev is None:
+        thyp_i = thyp_prov_t[0].copy()
+    else:
+        thyp_i = prev[1].reshape(-1) + \
+            (thyp_prov_t[0] - prev[0].reshape(-1))
+    for i in range(nmes):
+        if i > 0:
+            thyp_i += dtemp[i - 1]
+        np.copyto(thyp_i, tepi_t[i],
+                  where=dist_e[i] <= np.abs(thyp_i - 4))
+        np.maximum(thyp_i, 4, out=thyp_i)
+        thyp_t[i] = thyp_i
+
+    return thyp_t.T.reshape(shape)
+
+
+def _smoothing_loop(x, alpha, y_prev=None):
+    """Apply the exponential filter with a loop over time steps."""
+    nmes = x.shape[-1]
+    y = np.zeros(x.shape)
+    if nmes == 0:
+        return y
+    if y_prev is None:
+        y[..., 0] = x[..., 0]
+    else:
+        y[..., 0] = alpha*x[..., 0] + (1 - alpha)*y_prev
+    for i in np.arange(1, nmes):
+        y[..., i] = alpha*x[..., i] + (1 - alpha)*y[..., i - 1]
+    return y
+
+
+def _smoothing_scan(x, alpha, y_prev=None):
+    """Apply the exponential filter with a vectorized block scan.
+
+    The series is split in blocks of length L. Inside each block, the response
+    to the block inputs starting from a null state is obtained with a
+    cumulative sum of the inputs scaled by powers of (1 - alpha):
+
+        :math:`z_i = r^i \\sum_{j \\leq i} \\alpha x_j r^{-j}`, with
+        :math:`r = 1 - \\alpha`
+
+    and the state at the end of the previous block is added with weight
+    :math:`r^{i+1}`. L is chosen so that :math:`r^L` is negligible
+    (< _SCAN_TOL), so that the state at the end of each block depends only on
+    the inputs of that block, and all blocks are computed at once. L is
+    rounded up to a power of two, so that series with similar values of alpha
+    share the same block length.
+
+    Series with non-finite values (e.g., missing data) are filtered with
+    _smoothing_loop instead, since a nan must be carried to all the following
+    time steps, while the blocks after it only see a truncated state.
+    """
+    shape = x.shape
+    nmes = shape[-1]
+    if nmes == 0:
+        return np.zeros(shape)
+    x2 = x.reshape(-1, nmes)
+    nser = x2.shape[0]
+    r = 1 - np.broadcast_to(alpha, shape[:-1]).reshape(nser)
+
+    # Block length for each series (at least 2, so that the state before the
+    # first time step is used even for one time step)
+    lmax = max(nmes, 2)
+    blen = np.full(nser, lmax)
+    ind = np.logical_and(r > 0, r < 1)
+    lmin = np.ceil(np.log(_SCAN_TOL)/np.log(r[ind]))
+    blen[ind] = np.maximum(np.minimum(2**np.ceil(np.log2(lmin)), lmax), 2)
+    blen[r <= 0] = 1
+
+    # Series with non-finite values, filtered with the loop
+    if y_prev is not None:
+        y_prev = y_prev.reshape(nser)
+    finite = np.isfinite(x2).all(axis=1)
+    if y_prev is not None:
+        finite &= np.isfinite(y_prev)
+
+    y = np.empty((nser, nmes))
+    if not finite.all():
+        rows = np.flatnonzero(~finite)
+        y[rows] = _smoothing_loop(x2[rows], 1 - r[rows],
+                                  None if y_prev is None else y_prev[rows])
+    for L in np.unique(blen[finite]):
+        rows = np.flatnonzero((blen == L) & finite)
+        rr = r[rows][:, None, None]
+        if L == 1:
+            # (1 - alpha) is negligible: the filter returns the input data
+            y[rows] = x2[rows]
+            continue
+        nblock = -(-nmes//L)
+        xb = np.zeros((len(rows), nblock*L))
+        xb[:, :nmes] = x2[rows]
+        xb = xb.reshape(len(rows), nblock, L)
+
+        # Response to the inputs of each block from a null state
+        i = np.arange(L)
+        xb *= (1 - rr)*rr**(-i)
+        z = np.cumsum(xb, axis=-1, out=xb)
+        z *= rr**i
+
+        # State at the end of the previous block
+        carry = np.empty((len(rows), nblock, 1))
+        if y_prev is None:
+            carry[:, 0, 0] = x2[rows, 0]
+        else:
+            carry[:, 0, 0] = y_prev[rows]
+        carry[:, 1:, 0] = z[:, :-1, -1]
+
+        z += rr**(i + 1)*carry
+        y[rows] = z.reshape(len(rows), nblock*L)[:, :nmes]
+    if y_prev is None:
+        y[:, 0] = x2[:, 0]
+
+    return y.reshape(shape)
+
+
+if numba is not None:
+    # Kernels compiled with numba. They are compiled the first time they are
+    # called and the compiled code is cached on disk.
+    @numba.njit(cache=True)
+    def _smoothing_numba(x, alpha, y_prev, has_prev):
+        """Apply the exponential filter to each row of x (compiled loop)."""
+        nser, nmes = x.shape
+        y = np.empty((nser, nmes))
+        if nmes == 0:
+            return y
+        for k in range(nser):
+            if has_prev:
+                y[k, 0] = alpha[k]*x[k, 0] + (1 - alpha[k])*y_prev[k]
+            else:
+                y[k, 0] = x[k, 0]
+            for i in range(1, nmes):
+                y[k, i] = alpha[k]*x[k, i] + (1 - alpha[k])*y[k, i - 1]
+        return y
+
+    @numba.njit(cache=True)
+    def _hypolimnion_numba(tepi, beta, da, e, state, has_state):
+        """Solve the hypolimnion recursion for each row of tepi (compiled).
+
+        state is an array (3 x series) with the values of fet, thyp_prov and
+        thyp before the first time step (used if has_state is True). The
+        state after the last time step is returned with thyp.
+        """
+        nser, nmes = tepi.shape
+        thyp = np.empty((nser, nmes))
+        state_out = state.copy()
+        for k in range(nser):
+            fet = state[0, k]
+            thyp_prov = state[1, k]
+            thyp_i = state[2, k]
+            for i in range(nmes):
+                if i == 0 and not has_state:
+                    fet = tepi[k, i]
+                    thyp_prov = da[k] + e[k]*fet
+                    thyp_i = thyp_prov
+                else:
+                    fet = beta[k]*tepi[k, i] + (1 - beta[k])*fet
+                    thyp_prov_i = da[k] + e[k]*fet
+                    thyp_i = thyp_i + (thyp_prov_i - thyp_prov)
+                    thyp_prov = thyp_prov_i
+                thyp[k, i] = thyp_i
+                # epilimnion denser than hypolimnion (see overturn)
+                if abs(tepi[k, i] - 4) <= abs(thyp[k, i] - 4):
+                    thyp[k, i] = tepi[k, i]
+                if thyp[k, i] < 4:
+                    thyp[k, i] = 4
+                thyp_i = thyp[k, i]
+            state_out[0, k] = fet
+            state_out[1, k] = thyp_prov
+            state_out[2, k] = thyp_i
+        return thyp, state_out
@@ -6,11 +6,27 @@ temperature corresponding to the OKP model, described in Prats & Danis (2019).
 The included functions are:
 
     - calc_epilimnion_temperature: calculate epilimnion temperature.
+    - calc_epilimnion_temperature_batch: calculate epilimnion temperature for
+      several lakes.
     - calc_hypolimnion_temperature: calculate hypolimnion temperature.
+    - calc_hypolimnion_temperature_batch: calculate hypolimnion temperature
+      for several lakes.
+    - calc_sinusoidal: calculate a sinusoidal function at regular time steps.
     - fit_sinusoidal: fit a sinusoidal function.
+    - fit_sinusoidal_batch: fit a sinusoidal function to series at regular
+      time steps.
     - main: parse command line arguments and run the OKP model.
     - run_okp: run the OKP model.
-    - water_density: calculate water density.
+    - run_okp_arrays: run the OKP model on arrays of data.
+    - sinusoidal_basis: cached sinusoidal basis for regular time steps.
+
+The numerical kernels used to solve the recursions of the model are defined in
+the module kernels.
+
+The simulation functions can also return the Jacobians of epilimnion and
+hypolimnion temperature with respect to the parameters listed in
+JACOBIAN_PARAMETERS, propagated along the recursions of the model in the same
+run (forward-mode differentiation), e.g., for gradient-based calibration.
 
 References:
     * Prats, J.; Danis, P.-A. (2019) An epilimnion and hypolimnion temperature
@@ -40,116 +56,258 @@ References:
 
 import argparse
 import os
-from datetime import datetime
+from functools import lru_cache
 
 import numpy as np
 
 import okplm
+from okplm.kernels import exponential_smoothing, hypolimnion_recursion
+from okplm.kernels import overturn
+from okplm.kernels import water_density  # defined here in former versions
+from okplm.parameters import OKPParameters, _periods_per_year
+
+# Parameters of the Jacobians returned by the simulation functions
+JACOBIAN_PARAMETERS = ('A', 'B', 'C', 'D', 'E', 'ALPHA', 'BETA')
 
 
-def calc_epilimnion_temperature(tair, sr, par_vals, periodicity='daily'):
+def calc_epilimnion_temperature(tair, sr, par_vals, periodicity='daily',
+                                backend=None, return_jacobian=False):
     """Calculate epilimnion temperature.
 
     Args:
         tair: daily air temperature (ºC).
         sr: daily solar radiation (W/m\\ :sup:`2`\\ ).
-        par_vals: a dictionary with values for the parameters ALPHA, A,
-            B, C, at_factor and sw_factor.
+        par_vals: a dictionary or an OKPParameters object (see the module
+            parameters) with values for the parameters ALPHA, A, B, C,
+            at_factor, sw_factor and mat. It is not modified.
         periodicity: periodicity of the input meteorological data and of the
             simulation; it can take the values 'daily', 'weekly', 'monthly'.
+        backend: implementation of the model kernels ('python', 'numpy',
+            'numba' or 'auto'; see the module kernels). If None, the value of
+            the environment variable OKPLM_BACKEND is used.
+        return_jacobian: if True, the derivatives of epilimnion temperature
+            with respect to the parameters are also returned.
 
     Returns:
-        The daily simulated epilimnion temperature in degrees C.
+        The daily simulated epilimnion temperature in degrees C. If
+        return_jacobian is True, a tuple (tepi, jacobian) is returned
+        instead, where jacobian is a dictionary with the derivatives of tepi
+        with respect to each parameter in JACOBIAN_PARAMETERS (arrays of the
+        same shape of tepi, equal to 0 where tepi is clipped at 0 ºC).
     """
     # Convert units of parameters ALPHA according to periodicity
-    if periodicity == 'daily':
-        nper_yr = 365.25  # days
-    elif periodicity == 'weekly':
-        nper_yr = 52  # weeks
-    elif periodicity == 'monthly':
-        nper_yr = 12  # months
-    c = 365.25/nper_yr
-    par_vals['ALPHA'] = par_vals['ALPHA']*c
-    if par_vals['ALPHA'] > 1:
-        par_vals['ALPHA'] = 1
+    nper_yr = _periods_per_year(periodicity)
+    alpha = _converted_rate(par_vals, 'ALPHA', periodicity)
 
     # Calculate ftair, the exponentially smoothed function of tair
     tair2 = tair*par_vals['at_factor'] - par_vals['mat']
     nmes = len(tair)
-    ftair = np.zeros(nmes)
-    ftair[0] = tair2[0]
-    for i in np.arange(1, nmes):
-        ftair[i] = par_vals['ALPHA']*tair2[i] + \
-            (1 - par_vals['ALPHA'])*ftair[i - 1]
+    ftair = exponential_smoothing(tair2, alpha, backend=backend)
 
     # Calculate fsr, a sinusoidal function of solar radiation variability
-    t = np.arange(nmes)
-    m_sr, a_sr, ph_sr = fit_sinusoidal(t, sr*par_vals['sw_factor'],
-                                       period=nper_yr)
-    fsr = m_sr + a_sr*np.sin(2*np.pi*t/nper_yr + ph_sr)
+    m_sr, a_sr, ph_sr = fit_sinusoidal_batch(sr*par_vals['sw_factor'],
+                                             period=nper_yr)
+    fsr = calc_sinusoidal(m_sr, a_sr, ph_sr, nmes, period=nper_yr)
 
     # Calculate epilimnion temperature tepi
     tepi = par_vals['A'] + par_vals['B']*ftair + par_vals['C']*fsr
     ind = np.less_equal(tepi, 0)
     tepi[ind] = 0
 
+    if return_jacobian:
+        return tepi, _epilimnion_jacobian(
+                tair2, ftair, fsr, tepi, alpha, 365.25/nper_yr,
+                par_vals['B'], backend)
     return tepi
 
 
-def calc_hypolimnion_temperature(tepi, par_vals, periodicity='daily'):
+def calc_epilimnion_temperature_batch(tair, sr, par_vals, periodicity='daily',
+                                      backend=None, return_jacobian=False):
+    """Calculate epilimnion temperature for several lakes at once.
+
+    Args:
+        tair: 2-D array of air temperature (ºC) with one row per lake and one
+            column per time step.
+        sr: 2-D array of solar radiation (W/m\\ :sup:`2`\\ ), with the same
+            shape of tair.
+        par_vals: a dictionary with values for the parameters ALPHA, A, B, C,
+            at_factor, sw_factor and mat. Each value can be an array with one
+            value per lake or a scalar common to all the lakes. The
+            dictionary is not modified.
+        periodicity: periodicity of the input meteorological data and of the
+            simulation; it can take the values 'daily', 'weekly', 'monthly'.
+        backend: implementation of the model kernels ('python', 'numpy',
+            'numba' or 'auto'; see the module kernels). If None, the value of
+            the environment variable OKPLM_BACKEND is used.
+        return_jacobian: if True, the derivatives of epilimnion temperature
+            with respect to the parameters are also returned.
+
+    Returns:
+        A 2-D array (lakes x time steps) of simulated epilimnion temperature
+        in degrees C. If return_jacobian is True, a tuple (tepi, jacobian) is
+        returned instead, as in calc_epilimnion_temperature.
+    """
+    tair = np.atleast_2d(np.asarray(tair, dtype=float))
+    sr = np.atleast_2d(np.asarray(sr, dtype=float))
+    nlakes, nmes = tair.shape
+
+    # Convert units of parameters ALPHA according to periodicity
+    nper_yr = _periods_per_year(periodicity)
+    c = 365.25/nper_yr
+    alpha = np.minimum(_lake_column(par_vals, 'ALPHA', nlakes)*c, 1)
+
+    # Calculate ftair, the exponentially smoothed function of tair
+    tair2 = tair*_lake_column(par_vals, 'at_factor', nlakes) - \
+        _lake_column(par_vals, 'mat', nlakes)
+    ftair = exponential_smoothing(tair2, alpha[:, 0], backend=backend)
+
+    # Calculate fsr, a sinusoidal function of solar radiation variability
+    # (fitted for all the lakes at once with the same sinusoidal basis)
+    m_sr, a_sr, ph_sr = fit_sinusoidal_batch(
+            sr*_lake_column(par_vals, 'sw_factor', nlakes), period=nper_yr)
+    fsr = calc_sinusoidal(m_sr, a_sr, ph_sr, nmes, period=nper_yr)
+
+    # Calculate epilimnion temperature tepi
+    tepi = _lake_column(par_vals, 'A', nlakes) + \
+        _lake_column(par_vals, 'B', nlakes)*ftair + \
+        _lake_column(par_vals, 'C', nlakes)*fsr
+    tepi[np.less_equal(tepi, 0)] = 0
+
+    if return_jacobian:
+        return tepi, _epilimnion_jacobian(
+                tair2, ftair, fsr, tepi, alpha[:, 0], c,
+                _lake_column(par_vals, 'B', nlakes), backend)
+    return tepi
+
+
+def calc_hypolimnion_temperature(tepi, par_vals, periodicity='daily',
+                                 backend=None, return_jacobian=False,
+                                 tepi_jacobian=None):
     """Calculate hypolimnion temperature.
 
     Args:
         tepi: daily epilimnion temperature (ºC).
-        par_vals: a dictionary with values for the parameters BETA, A, D and E.
+        par_vals: a dictionary or an OKPParameters object (see the module
+            parameters) with values for the parameters BETA, A, D and E. It
+            is not modified.
         periodicity: periodicity of the input epilimnion temperature data and
             of the simulation; it can take the values 'daily', 'weekly',
             'monthly'.
+        backend: implementation of the model kernels ('python', 'numpy',
+            'numba' or 'auto'; see the module kernels). If None, the value of
+            the environment variable OKPLM_BACKEND is used.
+        return_jacobian: if True, the derivatives of hypolimnion temperature
+            with respect to the parameters are also returned.
+        tepi_jacobian: dictionary with the derivatives of tepi with respect
+            to the parameters, as returned by calc_epilimnion_temperature
+            (optional). If None, tepi is considered independent of the
+            parameters.
 
     Returns:
-        The daily simulated hypolimnion temperature in ºC.
+        The daily simulated hypolimnion temperature in ºC. If return_jacobian
+        is True, a tuple (thyp, jacobian) is returned instead, where jacobian
+        is a dictionary with the derivatives of thyp with respect to each
+        parameter in JACOBIAN_PARAMETERS (arrays of the same shape of thyp).
     """
     # Convert units of parameters BETA according to periodicity
-    if periodicity == 'daily':
-        nper_yr = 365.25  # days
-    elif periodicity == 'weekly':
-        nper_yr = 52  # weeks
-    elif periodicity == 'monthly':
-        nper_yr = 12  # months
-    c = 365.25/nper_yr
-    par_vals['BETA'] = par_vals['BETA']*c
-    if par_vals['BETA'] > 1:
-        par_vals['BETA'] = 1
+    beta = _converted_rate(par_vals, 'BETA', periodicity)
 
     # Calculate hypolimnion temperature
-    nmes = len(tepi)
-    fet = np.zeros(nmes)
-    thyp = np.zeros(nmes)
-    thyp_prov = np.zeros(nmes)
-    for i in range(nmes):
-        if i == 0:
-            fet[i] = tepi[i]
-            thyp_prov[i] = par_vals['D']*par_vals['A'] + par_vals['E']*fet[i]
-            thyp[i] = thyp_prov[i]
-        else:
-            fet[i] = par_vals['BETA']*(tepi[i]) + \
-                (1 - par_vals['BETA'])*fet[i-1]
-            thyp_prov[i] = par_vals['D']*par_vals['A'] + par_vals['E']*fet[i]
-            dtemp = thyp_prov[i] - thyp_prov[i-1]
-            thyp[i] = thyp[i-1] + dtemp
-
-        # epilimnion density in [kg/m^3]
-        dens_e = water_density(tepi[i])
-        # hypolimnion density in [kg/m^3]
-        dens_h = water_density(thyp[i])
-        if dens_e >= dens_h:
-            thyp[i] = tepi[i]
-        if thyp[i] < 4:
-            thyp[i] = 4
+    thyp = hypolimnion_recursion(tepi, beta, par_vals['D'],
+                                 par_vals['A'], par_vals['E'],
+                                 backend=backend)
+
+    if return_jacobian:
+        return thyp, _hypolimnion_jacobian(
+                np.asarray(tepi, dtype=float), thyp, tepi_jacobian, beta,
+                365.25/_periods_per_year(periodicity), par_vals['D'],
+                par_vals['A'], par_vals['E'], backend)
+    return thyp
+
+
+def calc_hypolimnion_temperature_batch(tepi, par_vals, periodicity='daily',
+                                       backend=None, return_jacobian=False,
+                                       tepi_jacobian=None):
+    """Calculate hypolimnion temperature for several lakes at once.
+
+    With the backends 'python' and 'numpy', the recursion in time is solved
+    with one iteration per time step, each iteration updating all the lakes at
+    once.
+
+    Args:
+        tepi: 2-D array of epilimnion temperature (ºC) with one row per lake
+            and one column per time step.
+        par_vals: a dictionary with values for the parameters BETA, A, D and
+            E. Each value can be an array with one value per lake or a scalar
+            common to all the lakes. The dictionary is not modified.
+        periodicity: periodicity of the input epilimnion temperature data and
+            of the simulation; it can take the values 'daily', 'weekly',
+            'monthly'.
+        backend: implementation of the model kernels ('python', 'numpy',
+            'numba' or 'auto'; see the module kernels). If None, the value of
+            the environment variable OKPLM_BACKEND is used.
+        return_jacobian: if True, the derivatives of hypolimnion temperature
+            with respect to the parameters are also returned.
+        tepi_jacobian: dictionary with the derivatives of tepi with respect
+            to the parameters, as returned by
+            calc_epilimnion_temperature_batch (optional). If None, tepi is
+            considered independent of the parameters.
+
+    Returns:
+        A 2-D array (lakes x time steps) of simulated hypolimnion temperature
+        in ºC. If return_jacobian is True, a tuple (thyp, jacobian) is
+        returned instead, as in calc_hypolimnion_temperature.
+    """
+    tepi = np.atleast_2d(np.asarray(tepi, dtype=float))
+    nlakes, nmes = tepi.shape
 
+    # Convert units of parameters BETA according to periodicity
+    c = 365.25/_periods_per_year(periodicity)
+    beta = np.minimum(_lake_column(par_vals, 'BETA', nlakes)*c, 1)
+
+    # Calculate hypolimnion temperature
+    thyp = hypolimnion_recursion(tepi, beta[:, 0],
+                                 _lake_column(par_vals, 'D', nlakes)[:, 0],
+                                 _lake_column(par_vals, 'A', nlakes)[:, 0],
+                                 _lake_column(par_vals, 'E', nlakes)[:, 0],
+                                 backend=backend)
+
+    if return_jacobian:
+        return thyp, _hypolimnion_jacobian(
+                tepi, thyp, tepi_jacobian, beta[:, 0], c,
+                _lake_column(par_vals, 'D', nlakes),
+                _lake_column(par_vals, 'A', nlakes),
+                _lake_column(par_vals, 'E', nlakes), backend)
     return thyp
 
 
+def calc_sinusoidal(m, a, ph, length, period):
+    """Calculate a sinusoidal function at regular time steps.
+
+    This function calculates :math:`y = m + a\\sin(2\\pi t/period + ph)`
+    for t = 0, 1, ..., length - 1, as a linear combination of the rows of the
+    cached sinusoidal basis (see sinusoidal_basis).
+
+    Args:
+        m: mean value of the sinusoidal function.
+        a: amplitude of the sinusoidal function.
+        ph: phase of the sinusoidal function.
+        length: number of time steps.
+        period: length of the period in time steps.
+
+    The coefficients m, a and ph can be scalars or arrays of the same shape
+    (e.g., one value per lake).
+
+    Returns:
+        An array of shape m.shape + (length,) with the values of the
+        sinusoidal function.
+    """
+    # m + a*sin(w*t + ph) = m + a*sin(ph)*cos(w*t) + a*cos(ph)*sin(w*t)
+    coef = np.stack(np.broadcast_arrays(m, a*np.sin(ph), a*np.cos(ph)),
+                    axis=-1)
+    return coef @ sinusoidal_basis(length, period)
+
+
 def fit_sinusoidal(x, y, period):
     """Fit a sinusoidal function to data.
 
@@ -159,18 +317,59 @@ def fit_sinusoidal(x, y, period):
 
     Args:
         x: array of time data.
-        y: array of response data.
+        y: array of response data. If y has more than one dimension, the
+            function is fitted along the last axis (e.g., one fit per lake).
         period: length of the period in time units.
 
+    Returns:
+        A tuple (m, a, ph) of the three coefficients of a sinusoidal function
+        providing the mean value (m), the amplitude of the sinusoidal
+        function (a), and the phase of the sinusoidal function (ph).
+
+    For data at regular time steps (x = 0, 1, 2...), fit_sinusoidal_batch
+    gives the same result using a cached sinusoidal basis.
+    """
+    # Calculate Fourier coefficients for the main frequency
+    a0 = np.mean(y, axis=-1)
+    a1 = 2*np.mean(y*np.cos(2*np.pi*x/period), axis=-1)
+    b1 = 2*np.mean(y*np.sin(2*np.pi*x/period), axis=-1)
+
+    # Calculate coefficients of the sinusoidal function
+    m = a0
+    a = np.sqrt(a1**2 + b1**2)
+    ph = np.arctan2(a1, b1)
+
+    return m, a, ph
+
+
+def fit_sinusoidal_batch(y, period):
+    """Fit a sinusoidal function to data at regular time steps.
+
+    This function fits a sinusoidal function of the form:
+
+        :math:`y = m + a\\sin(2\\pi t/period + ph)`
+
+    with t = 0, 1, 2... as fit_sinusoidal, but the Fourier coefficients of all
+    the series are computed with a single matrix product with the cached
+    sinusoidal basis (see sinusoidal_basis), so that the basis is not
+    computed again for each series.
+
+    Args:
+        y: array of response data. If y has more than one dimension (e.g.,
+            lakes x time steps), the function is fitted along the last axis.
+        period: length of the period in time steps.
+
     Returns:
         A tuple (m, a, ph) of the three coefficients of a sinusoidal function
         providing the mean value (m), the amplitude of the sinusoidal
         function (a), and the phase of the sinusoidal function (ph).
     """
     # Calculate Fourier coefficients for the main frequency
-    a0 = np.mean(y)
-    a1 = 2*np.mean(y*np.cos(2*np.pi*x/period))
-    b1 = 2*np.mean(y*np.sin(2*np.pi*x/period))
+    y = np.asarray(y)
+    coef = (y @ sinusoidal_basis(y.shape[-1], period).T)/y.shape[-1]
+    a0 = coef[..., 0]
+    a1 = 2*coef[..., 1]
+    b1 = 2*coef[..., 2]
 
     # Calculate coefficients of the sinusoidal function
     m = a0
@@ -182,7 +381,10 @@ def fit_sinusoidal(x, y, period):
 
 def run_okp(output_file, meteo_file, par_file, lake_file=None, start_date=None,
             end_date=None, periodicity='daily', output_periodicity=None,
-            validation_data_file=None, validation_res_file=None):
+            validation_data_file=None, validation_res_file=None,
+            backend=None, cache_dir=None, chunk_size=None,
+            incremental=False, output_format='text', precision=None,
+            meteo_index=False):
     """Run the OKP model.
 
     Args:
@@ -207,12 +409,44 @@ def run_okp(output_file, meteo_file, par_file, lake_file=None, start_date=None,
         validation_res_file: path of the file where validation results will be
             written. It requires the definition of a valid
             validation_data_file.
+        backend: implementation of the model kernels ('python', 'numpy',
+            'numba' or 'auto'; see the module kernels). If None, the value of
+            the environment variable OKPLM_BACKEND is used.
+        cache_dir: path of the folder used to cache the parsed meteorological
+            data (see the module cache). If None, the value of the environment
+            variable OKPLM_CACHE_DIR is used; if it is not defined either, the
+            cache is not used.
+        chunk_size: if defined, the meteorological data are read and the
+            model is simulated by chunks of chunk_size time steps, so that
+            long simulations do not need to hold all the data in memory (see
+            the module streaming). Output periodicity and validation are not
+            implemented for simulations by chunks.
+        incremental: if True, only the rows appended to meteo_file since the
+            last incremental run are simulated, starting from the state saved
+            next to par_file, and the results are appended to output_file
+            (see streaming.run_okp_incremental). The first run simulates the
+            whole file. Dates, output periodicity and validation are not
+            implemented for incremental simulations.
+        output_format: format of the output file: 'text' (default), 'npy',
+            'npz' or 'raw' (see the module input_output). Simulations by
+            chunks and incremental simulations only write text files.
+        precision: number of decimals of the temperature values written to
+            text output files. If None, the shortest representation that
+            gives back the same values is used.
+        meteo_index: if True and start_date or end_date are defined, only the
+            rows of the simulation period are read from meteo_file, using a
+            date index saved next to it (see input_output.read_meteo_range).
+            The index is built at the first use and whenever meteo_file is
+            modified.
 
     Returns:
-        A text file named output_file is written. If the par_file does not
-        exist, it is also created by this function. If validation data is
-        provided, the file validation_res_file containing information on error
-        statistics is created too.
+        The number of simulated time steps, at the periodicity of the
+        simulation (for incremental simulations, the number of time steps
+        appended). An output file named
+        output_file is written. If the par_file does not exist, it is also
+        created by this function. If validation data is provided, the file
+        validation_res_file containing information on error statistics is
+        created too.
     """
     # Allow tilde expansion
     output_file = os.path.expanduser(output_file)
@@ -225,156 +459,380 @@ def run_okp(output_file, meteo_file, par_file, lake_file=None, start_date=None,
     if validation_res_file is not None:
         validation_res_file = os.path.expanduser(validation_res_file)
 
+    # Incremental simulation
+    if incremental:
+        if any([start_date is not None, end_date is not None]):
+            print('Start and end dates not implemented for incremental ' +
+                  'simulations. Ignoring start_date and end_date.')
+        if output_periodicity not in [None, 'daily']:
+            print('Variable output periodicity not implemented for ' +
+                  'incremental simulations. Ignoring output_periodicity.')
+        if validation_data_file is not None:
+            print('Validation not implemented for incremental simulations. ' +
+                  'Ignoring validation.')
+        if output_format != 'text':
+            print('Binary output formats not implemented for incremental ' +
+                  'simulations. Ignoring output_format.')
+        return okplm.run_okp_incremental(output_file, meteo_file, par_file,
+                                         lake_file=lake_file,
+                                         periodicity=periodicity,
+                                         backend=backend, precision=precision)
+
+    # Simulation by chunks
+    if chunk_size is not None:
+        if output_periodicity not in [None, 'daily']:
+            print('Variable output periodicity not implemented for ' +
+                  'simulations by chunks. Ignoring output_periodicity.')
+        if validation_data_file is not None:
+            print('Validation not implemented for simulations by chunks. ' +
+                  'Ignoring validation.')
+        if output_format != 'text':
+            print('Binary output formats not implemented for simulations ' +
+                  'by chunks. Ignoring output_format.')
+        # the climatology is computed over the simulation period
+        climatology = okplm.run_okp_streaming(
+                output_file, meteo_file, par_file, lake_file=lake_file,
+                start_date=start_date, end_date=end_date,
+                periodicity=periodicity, chunk_size=chunk_size,
+                backend=backend, precision=precision)
+        return climatology['n']
+
     # Read meteorological data
-    meteo = np.genfromtxt(meteo_file, names=True, encoding='utf-8', dtype=None)
-    t = [datetime.strptime(i, '%Y-%m-%d') for i in meteo['date']]
+    if meteo_index and any([start_date is not None, end_date is not None]):
+        meteo = okplm.read_meteo_range(meteo_file, start_date, end_date)
+    else:
+        meteo = okplm.read_meteo_cached(meteo_file, cache_dir=cache_dir)
+
+    # Read parameter values or lake data
+    if os.path.exists(par_file):
+        par_vals = okplm.read_dict(par_file)
+        lake_data = None
+    else:
+        par_vals = None
+        lake_data = okplm.read_dict(lake_file)
+
+    # Read validation data
+    if validation_data_file is not None:
+        v_data = np.genfromtxt(validation_data_file, names=True,
+                               encoding='utf-8', dtype=None)
+        obs_data = {k: v_data[k] for k in v_data.dtype.names}
+    else:
+        obs_data = None
 
-    # Filter meteorological data according to date range
+    # Simulation
+    res = run_okp_arrays(meteo['date'], meteo['tair'], meteo['sr'],
+                         par_vals=par_vals, lake_data=lake_data,
+                         start_date=start_date, end_date=end_date,
+                         periodicity=periodicity,
+                         output_periodicity=output_periodicity,
+                         obs_data=obs_data, backend=backend)
+
+    # Write estimated parameter values to file
+    if par_vals is None:
+        okplm.write_dict(res['par_vals'], par_file)
+
+    # Write simulation results to file
+    okplm.write_output(output_file, res['date'], res['tepi'], res['thyp'],
+                       output_format=output_format, precision=precision)
+
+    # Write validation results to file
+    if res['validation'] is not None:
+        with open(validation_res_file, 'wt') as f:
+            f.write('n sd r me mae rmse' + os.linesep)
+            for k in ['tepi', 'thyp']:
+                f.write('%d %.3f %.3f %.3f %.3f %.3f' % res['validation'][k] +
+                        os.linesep)
+    return res['n']
+
+
+def run_okp_arrays(date, tair, sr, par_vals=None, lake_data=None,
+                   start_date=None, end_date=None, periodicity='daily',
+                   output_periodicity=None, obs_data=None, backend=None):
+    """Run the OKP model on arrays of data, without reading or writing files.
+
+    Args:
+        date: array of dates of the meteorological data
+            (numpy.datetime64[D] or strings in the format 'YYYY-mm-dd'). If
+            the dates are not sorted, the data of the simulation period are
+            copied instead of being views of the input arrays.
+        tair: array of air temperature (ºC).
+        sr: array of solar radiation (W/m\\ :sup:`2`\\ ).
+        par_vals: a dictionary or an OKPParameters object with the parameter
+            values. If None, parameter values are estimated from lake_data.
+        lake_data: a dictionary with the lake characteristics (see
+            parameter_functions.estimate_parameters). It is only necessary if
+            par_vals is None.
+        start_date: date of start of the simulation in the format 'YYYY-mm-dd'.
+        end_date: date of end of the simulation in the format 'YYYY-mm-dd'.
+        periodicity: periodicity of the input meteorological data and of the
+            simulation; it can take the values 'daily', 'weekly', 'monthly'.
+        output_periodicity: periodicity of the output data (only implemented
+            for daily simulations); it can take the values 'daily', 'weekly',
+            'monthly'.
+        obs_data: a dictionary with an array of dates ('date') and arrays of
+            observed epilimnion ('tepi') and/or hypolimnion ('thyp')
+            temperature, to calculate error statistics. If None, error
+            statistics are not calculated. Validation is only implemented for
+            'daily' simulations.
+        backend: implementation of the model kernels ('python', 'numpy',
+            'numba' or 'auto'; see the module kernels). If None, the value of
+            the environment variable OKPLM_BACKEND is used.
+
+    Returns:
+        A dictionary with the arrays of dates ('date'), epilimnion ('tepi')
+        and hypolimnion ('thyp') temperature at the output periodicity, the
+        number of simulated time steps ('n', at the periodicity of the
+        simulation), the parameter values used ('par_vals', estimated if
+        par_vals is None) and the error statistics ('validation', a
+        dictionary with a tuple (n, sd, r, me, mae, rmse) for 'tepi' and
+        'thyp', or None if obs_data is not provided).
+    """
+    t = np.asarray(date, dtype='datetime64[D]')
+    tair = np.asarray(tair, dtype=float)
+    sr = np.asarray(sr, dtype=float)
+
+    # Filter meteorological data according to date range (if the dates are
+    # sorted, the selected data are views of the input arrays)
     if any([start_date is not None, end_date is not None]):
+        is_sorted = not np.any(t[1:] < t[:-1])
+        t_min, t_max = (t[0], t[-1]) if is_sorted else (t.min(), t.max())
+        t_start = t_min
         if start_date is not None:
-            t_start = datetime.strptime(start_date, '%Y-%m-%d')
-            if t_start < np.min(t):
-                t_start = np.min(t)
+            t_start = np.datetime64(start_date, 'D')
+            if t_start < t_min:
                 print('Start date of simulations before start of ' +
                       'meteorological data. Using start date of ' +
                       'meteorological data instead.')
-        else:
-            t_start = np.min(t)
+        t_end = t_max
         if end_date is not None:
-            t_end = datetime.strptime(end_date, '%Y-%m-%d')
-            if t_end > np.max(t):
-                t_end = np.max(t)
+            t_end = np.datetime64(end_date, 'D')
+            if t_end > t_max:
                 print('End date of simulations after end of ' +
                       'meteorological data. Using end date of ' +
                       'meteorological data instead.')
+        if is_sorted:
+            ind = okplm.daterange_slice(t, t_start, t_end)
         else:
-            t_end = np.max(t)
-        ind = okplm.select_daterange(t, t_start, t_end)
-        meteo = meteo[ind]
-        t = np.array(t)[ind]
-
-    # If par_file is not provided, estimate parameter values
-    if not os.path.exists(par_file):
-        # Read lake data
-        lake_data = okplm.read_dict(lake_file)
+            ind = okplm.select_daterange(t, t_start, t_end)
+        t, tair, sr = t[ind], tair[ind], sr[ind]
 
-        # Create dictionary with all parameter constants
-        par_cts = {'ALPHA1': okplm.ALPHA1, 'ALPHA2': okplm.ALPHA2,
-                   'ALPHA3': okplm.ALPHA3, 'ALPHA4': okplm.ALPHA4,
-                   'BETA1': okplm.BETA1, 'BETA2': okplm.BETA2,
-                   'BETA3': okplm.BETA3,
-                   'A1': okplm.A1, 'A2': okplm.A2, 'A3': okplm.A3,
-                   'A4': okplm.A4,
-                   'B1': okplm.B1, 'B2': okplm.B2,
-                   'C1': okplm.C1, 'C2': okplm.C2,
-                   'D': okplm.D}
-        if lake_data['type'] == 'R':
-            # Reservoirs (submerged outlet)
-            par_cts.update({'E1': okplm.E1_RES, 'E2': okplm.E2_RES,
-                            'E3': okplm.E3_RES})
-        elif lake_data['type'] == 'L':
-            # Lakes (surface outlet)
-            par_cts.update({'E1': okplm.E1_LAKE, 'E2': okplm.E2_LAKE,
-                            'E3': okplm.E3_LAKE})
-
-        # Estimate parameter values
-        pars = okplm.estimate_parameters(var_vals=lake_data, par_cts=par_cts)
-
-        # Calculate mean air temperature (mat)
-        pars['mat'] = np.mean(meteo['tair'])
-
-        # Write parameter values to file
-        okplm.write_dict(pars, par_file)
-    else:
-        # Read parameter values
-        pars = okplm.read_dict(par_file)
+    # If par_vals is not provided, estimate parameter values
+    if par_vals is None:
+        # Estimate parameter values from lake data and mean air temperature
+        if lake_data is None:
+            raise ValueError('One of par_vals or lake_data is necessary')
+        par_vals = _estimate_lake_parameters(lake_data, np.mean(tair))
+    pars = OKPParameters(par_vals, periodicity)
 
     # Simulate epilimnion temperature
-    tepi_sim = calc_epilimnion_temperature(tair=meteo['tair'],
-                                           sr=meteo['sr'], par_vals=pars,
-                                           periodicity=periodicity)
+    tepi_sim = calc_epilimnion_temperature(tair=tair, sr=sr, par_vals=pars,
+                                           periodicity=periodicity,
+                                           backend=backend)
 
     # Simulate hypolimnion temperature
     thyp_sim = calc_hypolimnion_temperature(tepi=tepi_sim, par_vals=pars,
-                                            periodicity=periodicity)
+                                            periodicity=periodicity,
+                                            backend=backend)
 
-    # Write simulation results to file
+    # Aggregate simulation results to the output periodicity
     if periodicity != 'daily' and output_periodicity is not None:
         output_periodicity = None
         print('Variable output periodicity only implemented for daily ' +
               'simulations. Ignoring output_periodicity.')
-    if output_periodicity is None:
-        temp_sim = np.vstack([meteo['date'], tepi_sim, thyp_sim])
-    elif output_periodicity == 'daily':
-        temp_sim = np.vstack([meteo['date'], tepi_sim, thyp_sim])
+    if output_periodicity in [None, 'daily']:
+        t_p, tepi_p, thyp_p = t, tepi_sim, thyp_sim
     else:
+        temp_sim = np.vstack([tepi_sim, thyp_sim])
         if output_periodicity == 'weekly':
-            tepi_p = okplm.weekly_f(t, tepi_sim, np.mean, 'daily')
-            thyp_p = okplm.weekly_f(t, thyp_sim, np.mean, 'daily')
+            t_p, temp_p = okplm.weekly_f(t, temp_sim, np.mean, 'daily')
         elif output_periodicity == 'monthly':
-            tepi_p = okplm.monthly_f(t, tepi_sim, np.mean, 'daily')
-            thyp_p = okplm.monthly_f(t, thyp_sim, np.mean, 'daily')
-        t_vec = [d.strftime('%Y-%m-%d') for d in tepi_p[0]]
-        temp_sim = np.vstack([t_vec, tepi_p[1], thyp_p[1]])
-    np.savetxt(output_file, temp_sim.T, fmt='%s %s %s',
-               header='date tepi thyp', comments='')
+            t_p, temp_p = okplm.monthly_f(t, temp_sim, np.mean, 'daily')
+        tepi_p, thyp_p = temp_p
 
     # Validation
-    if validation_data_file is not None:
+    validation = None
+    if obs_data is not None:
         # check periodicity is daily
         if periodicity in ['weekly', 'monthly']:
             print('Validation implemented only for daily simulations. ' +
                   'Ignoring validation.')
         else:
-            # read validation data
-            v_data = np.genfromtxt(validation_data_file, names=True,
-                                   encoding='utf-8', dtype=None)
-            # epilimnion temperature validation
-            if 'tepi' in v_data.dtype.names:
-                tepi_validation = okplm.error_statistics(
-                        meteo['date'], tepi_sim, v_data['date'],
-                        v_data['tepi'])
-            else:
-                tepi_validation = tuple([0] + [np.nan]*5)
-            if 'thyp' in v_data.dtype.names:
-                thyp_validation = okplm.error_statistics(
-                        meteo['date'], thyp_sim, v_data['date'],
-                        v_data['thyp'])
-            else:
-                thyp_validation = tuple([0] + [np.nan]*5)
-            with open(validation_res_file, 'wt') as f:
-                f.write('n sd r me mae rmse' + os.linesep)
-                f.write('%d %.3f %.3f %.3f %.3f %.3f' % tepi_validation +
-                        os.linesep)
-                f.write('%d %.3f %.3f %.3f %.3f %.3f' % thyp_validation +
-                        os.linesep)
-    return
+            t_obs = np.asarray(obs_data['date'], dtype='datetime64[D]')
+            validation = dict()
+            for k, v_sim in [('tepi', tepi_sim), ('thyp', thyp_sim)]:
+                if k in obs_data:
+                    validation[k] = okplm.error_statistics(t, v_sim, t_obs,
+                                                           obs_data[k])
+                else:
+                    validation[k] = tuple([0] + [np.nan]*5)
+
+    return {'date': t_p, 'tepi': tepi_p, 'thyp': thyp_p, 'n': len(t),
+            'par_vals': par_vals, 'validation': validation}
+
 
+def sinusoidal_basis(length, period, dtype=float):
+    """Return the sinusoidal basis for regular time steps.
 
-def water_density(temp):
-    """Calculate the water density as a function of temperature.
+    The basis is cached (with a least recently used policy), so that series
+    with the same number of time steps and period share it.
 
     Args:
-        temp: water temperature (ºC).
+        length: number of time steps.
+        period: length of the period in time steps.
+        dtype: data type of the basis (e.g., numpy.float32 to save memory).
 
     Returns:
-        The water density (kg/m\\ :sup:`3`\\ ) calculated using the formula by
-        Markofsky & Harleman (1971).
+        A read-only array of shape (3, length) whose rows are 1,
+        :math:`\\cos(2\\pi t/period)` and :math:`\\sin(2\\pi t/period)` for
+        t = 0, 1, ..., length - 1.
+    """
+    return _sinusoidal_basis(int(length), float(period), np.dtype(dtype).str)
+
+
+@lru_cache(maxsize=16)
+def _sinusoidal_basis(length, period, dtype):
+    """Compute the sinusoidal basis (cached, see sinusoidal_basis)."""
+    w = 2*np.pi*np.arange(length)/period
+    basis = np.stack([np.ones(length), np.cos(w), np.sin(w)]).astype(dtype)
+    basis.setflags(write=False)
+    return basis
+
+
+def _converted_rate(par_vals, key, periodicity):
+    """Return ALPHA or BETA converted to the periodicity (at most 1)."""
+    if isinstance(par_vals, OKPParameters) and \
+            par_vals.periodicity == periodicity:
+        return par_vals.alpha if key == 'ALPHA' else par_vals.beta
+    return min(par_vals[key]*365.25/_periods_per_year(periodicity), 1)
+
+
+def _estimate_lake_parameters(lake_data, mat):
+    """Estimate parameter values from lake data.
+
+    Args:
+        lake_data: a dictionary with the lake data, or the path of the lake
+            data file.
+        mat: mean air temperature (ºC) of the simulation period.
 
-    References:
-        * Markofsky, M. and Harleman, D. R. F. (1971) *A predictive model for
-          thermal stratification and water quality in reservoirs.*
-          Environmental Protection Agency.
+    Returns:
+        A dictionary with the parameter values, including mat.
     """
-    # Assign coefficient values
-    dens_0 = 1000  # kg/m**3
-    t0 = 4  # ºC
-    alpha = 6.63e-6  # C**-2
+    # Read lake data
+    if not isinstance(lake_data, dict):
+        lake_data = okplm.read_dict(lake_data)
+
+    # Estimate parameter values with the constants for the type of water
+    # body (lake or reservoir)
+    pars = okplm.estimate_parameters(
+            var_vals=lake_data,
+            par_cts=okplm.lake_type_constants(lake_data['type']))
+
+    # Mean air temperature (mat)
+    pars['mat'] = mat
+
+    return pars
+
 
-    # Calculate density
-    dens = dens_0*(1 - alpha*(temp - t0)**2)
+def _epilimnion_jacobian(x, ftair, fsr, tepi, alpha, c, b, backend):
+    """Return the derivatives of epilimnion temperature.
 
-    return dens
+    x is the corrected air temperature smoothed into ftair with the rate
+    alpha (ALPHA converted with the factor c), and b the value of B (scalars,
+    or arrays with one value per row of x, as columns). The derivatives are
+    0 where epilimnion temperature is clipped at 0 ºC.
+    """
+    positive = np.greater(tepi, 0).astype(float)
+    dalpha = _rate_derivative(alpha, c)
+    zero = np.zeros_like(tepi)
+    return {'A': positive, 'B': positive*ftair, 'C': positive*fsr,
+            'D': zero, 'E': zero.copy(), 'BETA': zero.copy(),
+            'ALPHA': positive*b*dalpha*_smoothing_derivative(
+                x, ftair, alpha, backend)}
+
+
+def _hypolimnion_jacobian(tepi, thyp, tepi_jacobian, beta, c, d, a, e,
+                          backend):
+    """Return the derivatives of hypolimnion temperature.
+
+    The derivatives of fet and of the provisional hypolimnion temperature are
+    propagated along the recursion, and the derivatives of thyp follow those
+    of the provisional temperature between two resets of thyp: after an
+    overturn, they take the derivatives of tepi, and at the 4 ºC floor they
+    are 0. beta is BETA converted with the factor c, and d, a, e are the
+    values of D, A and E (scalars, or arrays with one value per row of tepi,
+    as columns).
+    """
+    nmes = tepi.shape[-1]
+    fet = exponential_smoothing(tepi, beta, backend=backend)
+    thyp_prov = d*a + e*fet
+
+    # Derivatives of the provisional hypolimnion temperature
+    dprov = dict()
+    for k in JACOBIAN_PARAMETERS:
+        if tepi_jacobian is None or not np.any(tepi_jacobian[k]):
+            dprov[k] = np.zeros_like(tepi)
+        else:
+            dprov[k] = e*exponential_smoothing(tepi_jacobian[k], beta,
+                                               backend=backend)
+    dprov['A'] += d
+    dprov['D'] += a
+    dprov['E'] += fet
+    dprov['BETA'] += e*_rate_derivative(beta, c)*_smoothing_derivative(
+            tepi, fet, beta, backend)
+
+    # Resets of hypolimnion temperature: overturn or 4 ºC floor
+    thyp_prev = np.empty_like(thyp)
+    thyp_prev[..., 0] = thyp_prov[..., 0]
+    thyp_prev[..., 1:] = thyp[..., :-1] + np.diff(thyp_prov, axis=-1)
+    turn = overturn(tepi, thyp_prev)
+    floor = np.where(turn, tepi, thyp_prev) < 4
+    reset = turn | floor
+    last = np.maximum.accumulate(np.where(reset, np.arange(nmes), -1),
+                                 axis=-1)
+    before = last < 0
+    last[before] = 0
+
+    jacobian = dict()
+    for k in JACOBIAN_PARAMETERS:
+        if tepi_jacobian is None:
+            dtepi = 0
+        else:
+            dtepi = tepi_jacobian[k]
+        # offset between thyp and thyp_prov, constant between resets
+        offset = np.where(floor, 0, dtepi) - dprov[k]
+        offset = np.take_along_axis(offset, last, axis=-1)
+        offset[before] = 0
+        jacobian[k] = dprov[k] + offset
+    return jacobian
+
+
+def _lake_column(par_vals, key, nlakes):
+    """Return the values of a parameter as a column vector (lakes x 1)."""
+    return np.broadcast_to(np.asarray(par_vals[key], dtype=float),
+                           (nlakes,)).reshape(nlakes, 1)
+
+
+def _rate_derivative(rate, c):
+    """Return the derivative of ALPHA or BETA converted with the factor c."""
+    rate = np.asarray(rate, dtype=float)
+    return np.where(rate < 1, c, 0.)[..., None]
+
+
+def _smoothing_derivative(x, y, alpha, backend):
+    """Return the derivative of the exponential smoothing y of x wrt alpha.
+
+    The derivative g follows :math:`g_i = (1 - \\alpha) g_{i-1} + x_i -
+    y_{i-1}`, starting from :math:`g_0 = 0`, i.e., g is the exponential
+    smoothing of :math:`(x_i - y_{i-1})/\\alpha`.
+    """
+    v = np.zeros_like(y)
+    v[..., 1:] = x[..., 1:] - y[..., :-1]
+    alpha = np.asarray(alpha, dtype=float)
+    a = alpha[..., None]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(a > 0,
+                        exponential_smoothing(v, alpha, backend=backend)/a,
+                        np.cumsum(v, axis=-1))
 
 
 def main():
@@ -416,6 +874,25 @@ def main():
                         help='weekly output (weekly average)')
     group2.add_argument('--monthly_output', action='store_true',
                         help='monthly output (monthly average)')
+    parser.add_argument('--cache_dir', help='folder used to cache the ' +
+                        'parsed meteorological data')
+    parser.add_argument('--backend', choices=['auto', 'python', 'numpy',
+                                              'numba'],
+                        help='implementation of the model kernels (default: ' +
+                        'environment variable OKPLM_BACKEND or auto)')
+    parser.add_argument('--chunk_size', type=int, help='simulate by chunks ' +
+                        'of CHUNK_SIZE time steps to limit memory use')
+    parser.add_argument('--incremental', action='store_true',
+                        help='simulate only the meteorological data ' +
+                        'appended since the last incremental run')
+    parser.add_argument('--output_format', default='text',
+                        choices=okplm.input_output.OUTPUT_FORMATS,
+                        help='format of the output file (default: text)')
+    parser.add_argument('--precision', type=int, help='number of decimals ' +
+                        'of the temperature values in text output files')
+    parser.add_argument('--meteo_index', action='store_true',
+                        help='read only the rows of the simulation period ' +
+                        'using a date index of the meteorological data file')
 
     # parse arguments
     args = parser.parse_args()
@@ -482,7 +959,11 @@ def main():
     run_okp(output_file=output_file, meteo_file=meteo_file, par_file=par_file,
             lake_file=lake_file, start_date=args.start, end_date=args.end,
             periodicity=periodicity, output_periodicity=output_periodicity,
-            validation_data_file=obs_data, validation_res_file=val_results)
+            validation_data_file=obs_data, validation_res_file=val_results,
+            backend=args.backend, cache_dir=args.cache_dir,
+            chunk_size=args.chunk_size, incremental=args.incremental,
+            output_format=args.output_format, precision=args.precision,
+            meteo_index=args.meteo_index)
     print('Output written to ' + output_file)
 
     return
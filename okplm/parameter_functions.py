@@ -4,6 +4,11 @@ This module contains the definition of the functions used to estimate the
 value of the parameters used by the OKP lake model. These equations were
 derived in Prats & Danis (2019).
 
+All the functions accept either scalar values, for one water body, or arrays
+(e.g., the columns of a table or a structured array), for many water bodies at
+once. In the second case, the parameter values are returned as arrays with one
+value per water body.
+
 The functions included in this module are:
 
     - estimate_par_a: estimate parameter A.
@@ -13,6 +18,7 @@ The functions included in this module are:
     - estimate_par_c: estimate parameter C.
     - estimate_par_e: estimate parameter E.
     - estimate_parameters: estimate OKP parameter values.
+    - lake_type_constants: parameter constants for the type of water body.
 
 References:
     * Prats, J.; Danis, P.-A. (2019) An epilimnion and hypolimnion temperature
@@ -39,23 +45,34 @@ References:
 # along with "okplm".  If not, see <https://www.gnu.org/licenses/>.
 
 
+import numpy as np
 from numpy import exp, log
 
+from okplm import parameter_constants
+
 
-def estimate_parameters(var_vals, par_cts):
+def estimate_parameters(var_vals, par_cts=None):
     """Estimate the OKP parameter values.
 
     Args:
         var_vals: a dictionary indicating the value of the independent
             variables 'latitude' (degrees North), 'altitude' (m), 'zmax' (m),
-            'surface' (m\\ :sup:`2`\\ ), 'volume' (m\\ :sup:`3`\\).
+            'surface' (m\\ :sup:`2`\\ ), 'volume' (m\\ :sup:`3`\\). The
+            values can be scalars or arrays with one value per water body,
+            and var_vals can also be a structured array with these fields. It
+            is not modified.
         par_cts: a dictionary indicating the value of the parameter constants
             'ALPHA1'-'ALPHA4', 'BETA1'-'BETA3', 'A1'-'A4', 'B1'-'B2',
-            'C1'-'C2', 'D', 'E1'-'E3'.
+            'C1'-'C2', 'D', 'E1'-'E3'. The values can be scalars or arrays
+            with one value per water body. If None, the default constants
+            for the type of each water body given by var_vals['type'] are
+            used (see lake_type_constants).
 
     Returns:
         A dictionary of the OKP model parameter values according to Eq. (21,
-        23-25, 27-28) in Prats & Danis (2019, p. 6-10).
+        23-25, 27-28) in Prats & Danis (2019, p. 6-10). If var_vals contains
+        arrays, each parameter value is an array with one value per water
+        body.
 
     Example:
         .. code:: python
@@ -75,6 +92,8 @@ def estimate_parameters(var_vals, par_cts):
                        'E1': 0.10, 'E2': 2.0, 'E3': -1.8}
             pars = estimate_parameters(var_vals=var_vals, par_cts=par_cts)
     """
+    if par_cts is None:
+        par_cts = lake_type_constants(var_vals['type'])
     pars = {'A': estimate_par_a(var_vals, par_cts),
             'B': estimate_par_b(var_vals, par_cts),
             'C': estimate_par_c(var_vals, par_cts),
@@ -83,6 +102,12 @@ def estimate_parameters(var_vals, par_cts):
             'ALPHA': estimate_par_alpha(var_vals, par_cts)}
     pars.update({'BETA': estimate_par_beta(pars['E'], par_cts)})
     pars.update({'at_factor': 1.0, 'sw_factor': 1.0})
+
+    # Columnar output for several water bodies
+    shape = np.broadcast(*[np.asarray(v) for v in pars.values()]).shape
+    if shape != ():
+        pars = {k: np.broadcast_to(v, shape).astype(float)
+                for k, v in pars.items()}
     return pars
 
 
@@ -114,9 +139,9 @@ def estimate_par_a(var_vals, par_cts):
     """
 
     a = par_cts['A1'] + \
-        par_cts['A2']*var_vals['latitude'] + \
-        par_cts['A3']*var_vals['altitude'] + \
-        par_cts['A4']*log(var_vals['surface'])
+        par_cts['A2']*_column(var_vals, 'latitude') + \
+        par_cts['A3']*_column(var_vals, 'altitude') + \
+        par_cts['A4']*log(_column(var_vals, 'surface'))
 
     return a
 
@@ -149,9 +174,9 @@ def estimate_par_alpha(var_vals, par_cts):
     """
 
     alpha = exp(par_cts['ALPHA1'] +
-                par_cts['ALPHA2']*var_vals['altitude'] +
-                par_cts['ALPHA3']*log(var_vals['surface']) +
-                par_cts['ALPHA4']*log(var_vals['volume']))
+                par_cts['ALPHA2']*_column(var_vals, 'altitude') +
+                par_cts['ALPHA3']*log(_column(var_vals, 'surface')) +
+                par_cts['ALPHA4']*log(_column(var_vals, 'volume')))
 
     return alpha
 
@@ -178,7 +203,7 @@ def estimate_par_b(var_vals, par_cts):
             b = estimate_par_b(var_vals=var_vals, par_cts=par_cts)
     """
 
-    b = par_cts['B1'] + par_cts['B2']*var_vals['zmax']
+    b = par_cts['B1'] + par_cts['B2']*_column(var_vals, 'zmax')
 
     return b
 
@@ -187,7 +212,7 @@ def estimate_par_beta(par_e, par_cts):
     """Estimate the parameter beta.
 
     Args:
-        par_e: value of the parameter E [0 - 1].
+        par_e: value of the parameter E [0 - 1], a scalar or an array.
         par_cts: a dictionary indicating the value of the parameter constants
             'BETA1' to 'BETA3'.
 
@@ -205,10 +230,10 @@ def estimate_par_beta(par_e, par_cts):
             beta = estimate_par_beta(par_e=par_e, par_cts=par_cts)
     """
 
-    if par_e > par_cts['BETA3']:
-        beta = par_cts['BETA1']
-    else:
-        beta = par_cts['BETA2']
+    beta = np.where(np.greater(par_e, par_cts['BETA3']), par_cts['BETA1'],
+                    par_cts['BETA2'])
+    if beta.ndim == 0:
+        beta = beta.item()
 
     return beta
 
@@ -235,7 +260,7 @@ def estimate_par_c(var_vals, par_cts):
             c = estimate_par_c(var_vals=var_vals, par_cts=par_cts)
     """
 
-    c = par_cts['C1'] + par_cts['C2']*var_vals['altitude']
+    c = par_cts['C1'] + par_cts['C2']*_column(var_vals, 'altitude')
 
     return c
 
@@ -264,10 +289,55 @@ def estimate_par_e(var_vals, par_cts):
             e = estimate_par_e(var_vals=var_vals, par_cts=par_cts)
     """
 
-    var_vals['zmean'] = var_vals['volume']/var_vals['surface']
+    # Mean depth (m)
+    zmean = _column(var_vals, 'volume')/_column(var_vals, 'surface')
 
     e = par_cts['E1'] + \
         (1 - par_cts['E1'])/(1 + exp(par_cts['E3']*(par_cts['E2'] -
-                             log(var_vals['zmean']))))
+                             log(zmean))))
 
     return e
+
+
+def lake_type_constants(lake_type):
+    """Return the parameter constants for the type of water body.
+
+    Args:
+        lake_type: type of water body, 'L' for natural lakes (surface outlet)
+            or 'R' for reservoirs (submerged outlet). It can be a string or
+            an array of strings with one value per water body.
+
+    Returns:
+        A dictionary with the parameter constants defined in the module
+        parameter_constants. The constants 'E1'-'E3' are those of natural
+        lakes or reservoirs according to lake_type (arrays with one value per
+        water body if lake_type is an array).
+
+    Example:
+        .. code:: python
+
+            par_cts = lake_type_constants(['L', 'R', 'L'])
+    """
+    lake_type = np.asarray(lake_type)
+    is_res = lake_type == 'R'
+    if not np.all(np.logical_or(is_res, lake_type == 'L')):
+        raise ValueError("Unknown type of water body (should be 'L' or 'R')")
+
+    par_cts = {k: getattr(parameter_constants, k)
+               for k in ['ALPHA1', 'ALPHA2', 'ALPHA3', 'ALPHA4',
+                         'BETA1', 'BETA2', 'BETA3',
+                         'A1', 'A2', 'A3', 'A4', 'B1', 'B2', 'C1', 'C2', 'D']}
+    for k in ['E1', 'E2', 'E3']:
+        e_cts = np.where(is_res, getattr(parameter_constants, k + '_RES'),
+                         getattr(parameter_constants, k + '_LAKE'))
+        par_cts[k] = e_cts.item() if e_cts.ndim == 0 else e_cts
+
+    return par_cts
+
+
+def _column(var_vals, key):
+    """Return the values of a variable as a float (or array of floats)."""
+    x = var_vals[key]
+    if np.ndim(x) == 0:
+        return float(x)
+    return np.asarray(x, dtype=float)
@@ -0,0 +1,159 @@
+"""Immutable parameter set of the OKP model.
+
+This module contains the class OKPParameters, an immutable and hashable set of
+parameter values of the OKP model for one water body. The coefficients ALPHA
+and BETA converted to the periodicity of the simulation are computed once,
+when the object is created. OKPParameters objects can be used wherever a
+dictionary of parameter values is accepted (e.g., okp_model.run_okp or the
+functions calc_epilimnion_temperature and calc_hypolimnion_temperature), they
+are never modified, so that they can be shared between simulations and
+threads, and they can be used as keys of dictionaries or caches.
+
+This module contains the following functions:
+
+    * as_parameters: convert parameter values to an OKPParameters object.
+
+"""
+# Copyright 2020-2022 Segula Technologies - Office Français de la Biodiversité.
+#
+# This file is part of the Python package "okplm".
+#
+# The package "okplm" is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# The package "okplm" is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with "okplm".  If not, see <https://www.gnu.org/licenses/>.
+
+
+# Names of the parameters
+PARAMETER_NAMES = ('A', 'B', 'C', 'D', 'E', 'ALPHA', 'BETA', 'at_factor',
+                   'sw_factor', 'mat')
+
+
+class OKPParameters(object):
+    """Immutable set of parameter values of the OKP model.
+
+    Args:
+        par_vals: a dictionary (or another OKPParameters object) with values
+            for the parameters A, B, C, D, E, ALPHA, BETA, at_factor,
+            sw_factor and mat. Other keys are ignored.
+        periodicity: periodicity of the simulation; it can take the values
+            'daily', 'weekly', 'monthly'.
+
+    The parameter values are available as attributes or with the syntax of
+    dictionaries (e.g., pars.ALPHA or pars['ALPHA']). The attributes alpha and
+    beta contain the values of ALPHA and BETA converted to the periodicity of
+    the simulation (at most 1), and nper_yr the number of time steps per
+    year.
+    """
+    __slots__ = PARAMETER_NAMES + ('periodicity', 'nper_yr', 'alpha', 'beta')
+
+    def __init__(self, par_vals, periodicity='daily'):
+        for k in PARAMETER_NAMES:
+            object.__setattr__(self, k, float(par_vals[k]))
+        object.__setattr__(self, 'periodicity', periodicity)
+
+        # Convert units of parameters ALPHA and BETA according to periodicity
+        nper_yr = _periods_per_year(periodicity)
+        c = 365.25/nper_yr
+        object.__setattr__(self, 'nper_yr', nper_yr)
+        object.__setattr__(self, 'alpha', min(self.ALPHA*c, 1))
+        object.__setattr__(self, 'beta', min(self.BETA*c, 1))
+
+    def __delattr__(self, name):
+        raise AttributeError('OKPParameters objects are immutable')
+
+    def __eq__(self, other):
+        if not isinstance(other, OKPParameters):
+            return NotImplemented
+        return self._key() == other._key()
+
+    def __getitem__(self, key):
+        if key not in PARAMETER_NAMES:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __hash__(self):
+        return hash(self._key())
+
+    def __reduce__(self):
+        return (OKPParameters, (self.as_dict(), self.periodicity))
+
+    def __repr__(self):
+        return 'OKPParameters(%r, periodicity=%r)' % (self.as_dict(),
+                                                       self.periodicity)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('OKPParameters objects are immutable')
+
+    def as_dict(self):
+        """Return a dictionary with the parameter values.
+
+        Returns:
+            A new dictionary with the values of the parameters A, B, C, D, E,
+            ALPHA, BETA, at_factor, sw_factor and mat (not converted to the
+            periodicity), e.g., to write them with input_output.write_dict.
+        """
+        return {k: getattr(self, k) for k in PARAMETER_NAMES}
+
+    def replace(self, periodicity=None, **kwargs):
+        """Return a copy with some values replaced.
+
+        Args:
+            periodicity: periodicity of the new object (the same if None).
+            **kwargs: new parameter values (e.g., ALPHA=0.1).
+
+        Returns:
+            A new OKPParameters object.
+        """
+        par_vals = self.as_dict()
+        for k, v in kwargs.items():
+            if k not in PARAMETER_NAMES:
+                raise KeyError(k)
+            par_vals[k] = v
+        if periodicity is None:
+            periodicity = self.periodicity
+        return OKPParameters(par_vals, periodicity)
+
+    def _key(self):
+        """Return the tuple of values identifying the object."""
+        return tuple(getattr(self, k) for k in PARAMETER_NAMES) + \
+            (self.periodicity,)
+
+
+def as_parameters(par_vals, periodicity='daily'):
+    """Convert parameter values to an OKPParameters object.
+
+    Args:
+        par_vals: a dictionary of parameter values or an OKPParameters object.
+        periodicity: periodicity of the simulation; it can take the values
+            'daily', 'weekly', 'monthly'.
+
+    Returns:
+        par_vals itself if it is an OKPParameters object with the given
+        periodicity, or a new OKPParameters object otherwise.
+    """
+    if isinstance(par_vals, OKPParameters) and \
+            par_vals.periodicity == periodicity:
+        return par_vals
+    return OKPParameters(par_vals, periodicity)
+
+
+def _periods_per_year(periodicity):
+    """Return the number of time steps per year for a given periodicity."""
+    if periodicity == 'daily':
+        nper_yr = 365.25  # days
+    elif periodicity == 'weekly':
+        nper_yr = 52  # weeks
+    elif periodicity == 'monthly':
+        nper_yr = 12  # months
+    else:
+        raise ValueError('Unknown periodicity ' + str(periodicity))
+    return nper_yr
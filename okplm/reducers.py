@@ -0,0 +1,218 @@
+"""Online statistics of ensembles of simulations.
+
+The classes in this module update summary statistics of an ensemble of
+simulated series (e.g., one value per lake and time step for each member) as
+blocks of members are simulated, so that only the summary arrays are held in
+memory and not the series of every member:
+
+    * EnsembleStatistics: running mean, variance, minimum, maximum and
+      approximate quantiles.
+    * P2Quantiles: approximate quantiles estimated with the P-square
+      algorithm of Jain & Chlamtac (1985), which only keeps five markers per
+      quantile and value.
+
+The mean and variance of the blocks are combined with the pairwise formulas
+of Chan et al. (1979), which are more accurate than running sums of values and
+squared values.
+
+References:
+    * Chan, T. F.; Golub, G. H.; LeVeque, R. J. (1979) Updating formulae and
+      a pairwise algorithm for computing sample variances. Technical Report
+      STAN-CS-79-773, Stanford University.
+    * Jain, R.; Chlamtac, I. (1985) The P2 algorithm for dynamic calculation
+      of quantiles and histograms without storing observations.
+      *Communications of the ACM*, 28, 1076-1085.
+
+"""
+# Copyright 2020-2022 Segula Technologies - Office Français de la Biodiversité.
+#
+# This file is part of the Python package "okplm".
+#
+# The package "okplm" is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# The package "okplm" is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with "okplm".  If not, see <https://www.gnu.org/licenses/>.
+
+
+import numpy as np
+
+
+class EnsembleStatistics(object):
+    """Online statistics of the members of an ensemble.
+
+    Args:
+        quantiles: sequence of probabilities [0 - 1] of the quantiles to
+            estimate (optional).
+
+    The statistics are computed for each value of the members (e.g., for
+    each lake and time step), over all the members given to update().
+    """
+    __slots__ = ('count', 'mean', 'm2', 'min', 'max', 'quantiles')
+
+    def __init__(self, quantiles=()):
+        self.count = 0
+        self.mean = None
+        self.m2 = None
+        self.min = None
+        self.max = None
+        self.quantiles = None
+        if quantiles is not None and len(quantiles) > 0:
+            self.quantiles = P2Quantiles(quantiles)
+
+    def result(self):
+        """Return the current values of the statistics.
+
+        Returns:
+            A dictionary with the number of members ('count') and arrays with
+            the mean ('mean'), standard deviation ('sd', of the population of
+            members), minimum ('min') and maximum ('max') of each value, and,
+            if quantiles were requested, an array with the approximate
+            quantiles ('quantiles', with one more leading dimension, one
+            quantile per row).
+        """
+        res = {'count': self.count, 'mean': self.mean, 'min': self.min,
+               'max': self.max, 'sd': None}
+        if self.count > 0:
+            res['sd'] = np.sqrt(self.m2/self.count)
+        if self.quantiles is not None:
+            res['quantiles'] = self.quantiles.result()
+        return res
+
+    def update(self, block):
+        """Update the statistics with a block of members.
+
+        Args:
+            block: array of values of the members, with one member per row
+                (members x ...).
+        """
+        block = np.asarray(block, dtype=float)
+        m = block.shape[0]
+        if m == 0:
+            return
+        mean_b = np.mean(block, axis=0)
+        m2_b = np.sum((block - mean_b)**2, axis=0)
+        if self.count == 0:
+            self.mean, self.m2 = mean_b, m2_b
+            self.min = np.min(block, axis=0)
+            self.max = np.max(block, axis=0)
+        else:
+            # Pairwise combination of the mean and the sum of squares
+            count = self.count + m
+            delta = mean_b - self.mean
+            self.mean = self.mean + delta*(m/count)
+            self.m2 = self.m2 + m2_b + delta**2*(self.count*m/count)
+            np.minimum(self.min, np.min(block, axis=0), out=self.min)
+            np.maximum(self.max, np.max(block, axis=0), out=self.max)
+        self.count += m
+        if self.quantiles is not None:
+            for x in block:
+                self.quantiles.update(x)
+
+
+class P2Quantiles(object):
+    """Approximate quantiles of a sequence of observations (P-square).
+
+    Args:
+        probs: sequence of probabilities [0 - 1] of the quantiles.
+
+    Each observation given to update() is an array (e.g., one value per lake
+    and time step), and the quantiles are estimated for each value. For each
+    quantile and value, the algorithm keeps the heights and positions of five
+    markers, at the minimum, the maximum, the quantile and halfway between
+    them. The heights are adjusted with a piecewise-parabolic interpolation
+    when the positions deviate from the desired positions. The quantiles of
+    less than five observations are exact.
+    """
+    __slots__ = ('probs', 'count', 'heights', 'positions', 'desired',
+                 'increments', 'initial')
+
+    def __init__(self, probs):
+        self.probs = np.asarray(probs, dtype=float).reshape(-1)
+        self.count = 0
+        self.heights = None
+        self.positions = None
+        p = self.probs[:, None]
+        self.increments = np.hstack([np.zeros_like(p), p/2, p, (1 + p)/2,
+                                     np.ones_like(p)])
+        self.desired = 1 + 4*self.increments
+        self.initial = []
+
+    def result(self):
+        """Return the current estimates of the quantiles.
+
+        Returns:
+            An array with one quantile per row (quantiles x shape of the
+            observations), or None if there are no observations.
+        """
+        if self.count == 0:
+            return None
+        if self.count < 5:
+            return np.quantile(np.stack(self.initial), self.probs, axis=0)
+        return self.heights[:, 2].copy()
+
+    def update(self, x):
+        """Update the quantiles with an observation.
+
+        Args:
+            x: array of observed values (the same shape for all the
+                observations).
+        """
+        x = np.asarray(x, dtype=float)
+        self.count += 1
+        if self.count <= 5:
+            # Initialization of the markers with the first five observations
+            self.initial.append(x)
+            if self.count == 5:
+                heights = np.sort(np.stack(self.initial), axis=0)
+                nq = len(self.probs)
+                self.heights = np.repeat(heights[None], nq, axis=0)
+                shape = (nq, 5) + (1,)*x.ndim
+                self.positions = np.broadcast_to(
+                        np.arange(1., 6.).reshape((1,) + shape[1:]),
+                        self.heights.shape).copy()
+                self.desired = np.broadcast_to(
+                        self.desired.reshape(shape),
+                        self.heights.shape).copy()
+                self.initial = []
+            return
+
+        q = self.heights
+        pos = self.positions
+
+        # Extreme markers, and positions of the markers above the
+        # observation
+        np.minimum(q[:, 0], x, out=q[:, 0])
+        np.maximum(q[:, 4], x, out=q[:, 4])
+        for i in range(1, 4):
+            pos[:, i] += x < q[:, i]
+        pos[:, 4] += 1
+        self.desired += self.increments.reshape(
+                self.increments.shape + (1,)*x.ndim)
+
+        # Adjustment of the heights of the middle markers
+        for i in range(1, 4):
+            d = self.desired[:, i] - pos[:, i]
+            up = (d >= 1) & (pos[:, i + 1] - pos[:, i] > 1)
+            down = (d <= -1) & (pos[:, i - 1] - pos[:, i] < -1)
+            move = up | down
+            if not move.any():
+                continue
+            d = np.where(up, 1., -1.)
+            n_prev, n_i, n_next = pos[:, i - 1], pos[:, i], pos[:, i + 1]
+            q_prev, q_i, q_next = q[:, i - 1], q[:, i], q[:, i + 1]
+            parabolic = q_i + d/(n_next - n_prev)*(
+                    (n_i - n_prev + d)*(q_next - q_i)/(n_next - n_i) +
+                    (n_next - n_i - d)*(q_i - q_prev)/(n_i - n_prev))
+            linear = np.where(up, q_i + (q_next - q_i)/(n_next - n_i),
+                              q_i - (q_prev - q_i)/(n_prev - n_i))
+            ok = (q_prev < parabolic) & (parabolic < q_next)
+            q[:, i] = np.where(move, np.where(ok, parabolic, linear), q_i)
+            pos[:, i] += np.where(move, d, 0)
@@ -0,0 +1,195 @@
+"""Stateful simulator of the OKP model.
+
+This module contains the class OKPModel, which holds the parameters of the OKP
+model for one water body, the coefficients derived from them for a given
+periodicity, and the current state of the model recursions. The model can be
+advanced one time step at a time (step) or by series of time steps (advance),
+and its state can be saved and restored (get_state, set_state), so that a
+simulation can be continued from a previous state without simulating the whole
+series of meteorological data again.
+
+The sinusoidal function of solar radiation (fsr) used by the model is fitted
+over the whole simulation period. For a simulation advanced step by step, its
+coefficients must be known in advance, e.g., computed over a reference
+period with streaming.calc_climatology.
+
+"""
+# Copyright 2020-2022 Segula Technologies - Office Français de la Biodiversité.
+#
+# This file is part of the Python package "okplm".
+#
+# The package "okplm" is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# The package "okplm" is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with "okplm".  If not, see <https://www.gnu.org/licenses/>.
+
+
+import math
+
+import numpy as np
+
+from okplm.kernels import exponential_smoothing, hypolimnion_recursion
+from okplm.parameters import as_parameters
+
+
+class OKPModel(object):
+    """Stateful simulator of the OKP model for one water body.
+
+    Args:
+        par_vals: a dictionary or an OKPParameters object (see the module
+            parameters) with values for the parameters ALPHA, BETA, A, B, C,
+            D, E, at_factor, sw_factor and mat. It is not modified.
+        climatology: a dictionary with the coefficients m_sr, a_sr and ph_sr
+            of the sinusoidal function fitted to solar radiation, without the
+            correction factor sw_factor (see streaming.calc_climatology).
+        periodicity: periodicity of the meteorological data and of the
+            simulation; it can take the values 'daily', 'weekly', 'monthly'.
+        backend: implementation of the model kernels used by advance()
+            ('python', 'numpy', 'numba' or 'auto'; see the module kernels).
+            If None, the value of the environment variable OKPLM_BACKEND is
+            used.
+
+    The state of a new model is empty: the first time step initializes the
+    recursions as in okp_model.run_okp.
+    """
+    __slots__ = ('A', 'B', 'C', 'D', 'E', 'alpha', 'beta', 'at_factor',
+                 'mat', 'm_fsr', 'a_fsr', 'ph_fsr', 'omega', 'backend',
+                 't', 'ftair', 'fet', 'thyp_prov', 'thyp')
+
+    def __init__(self, par_vals, climatology, periodicity='daily',
+                 backend=None):
+        # Parameter values, with ALPHA and BETA converted to periodicity
+        pars = as_parameters(par_vals, periodicity)
+        self.alpha = pars.alpha
+        self.beta = pars.beta
+        for k in ['A', 'B', 'C', 'D', 'E', 'at_factor', 'mat']:
+            setattr(self, k, pars[k])
+
+        # Coefficients of fsr, the sinusoidal function of solar radiation
+        self.m_fsr = pars.sw_factor*float(climatology['m_sr'])
+        self.a_fsr = pars.sw_factor*float(climatology['a_sr'])
+        self.ph_fsr = float(climatology['ph_sr'])
+        self.omega = 2*math.pi/pars.nper_yr
+
+        self.backend = backend
+        self.set_state(None)
+
+    def advance(self, tair, sr=None):
+        """Advance the model by a series of time steps.
+
+        Args:
+            tair: array of air temperature (ºC).
+            sr: array of solar radiation (W/m\\ :sup:`2`\\ ). It is not
+                used: the model uses solar radiation only through the
+                sinusoidal function given by the climatology.
+
+        Returns:
+            A tuple (tepi, thyp) of arrays of simulated epilimnion and
+            hypolimnion temperature (ºC).
+        """
+        tair = np.asarray(tair, dtype=float)
+        nmes = len(tair)
+        t = self.t + np.arange(nmes)
+
+        # Epilimnion temperature (see okp_model.calc_epilimnion_temperature)
+        ftair = exponential_smoothing(tair*self.at_factor - self.mat,
+                                      self.alpha, backend=self.backend,
+                                      y_prev=self.ftair)
+        fsr = self.m_fsr + self.a_fsr*np.sin(self.omega*t + self.ph_fsr)
+        tepi = self.A + self.B*ftair + self.C*fsr
+        tepi[np.less_equal(tepi, 0)] = 0
+
+        # Hypolimnion temperature (see okp_model.calc_hypolimnion_temperature)
+        if self.fet is None:
+            state = None
+        else:
+            state = (self.fet, self.thyp_prov, self.thyp)
+        thyp, state = hypolimnion_recursion(tepi, self.beta, self.D, self.A,
+                                            self.E, backend=self.backend,
+                                            state=state, return_state=True)
+
+        if nmes > 0:
+            self.t += nmes
+            self.ftair = float(ftair[-1])
+            self.fet, self.thyp_prov, self.thyp = [float(v) for v in state]
+        return tepi, thyp
+
+    def get_state(self):
+        """Return a snapshot of the state of the model.
+
+        Returns:
+            A dictionary with the number of simulated time steps (t) and the
+            values of ftair, fet, thyp_prov and thyp after the last time step
+            (None before the first time step). All the values are Python
+            numbers, so that the snapshot can be serialized (e.g., to JSON).
+        """
+        return {'t': self.t, 'ftair': self.ftair, 'fet': self.fet,
+                'thyp_prov': self.thyp_prov, 'thyp': self.thyp}
+
+    def set_state(self, state):
+        """Restore a snapshot of the state of the model.
+
+        Args:
+            state: a dictionary as returned by get_state(), or None to reset
+                the model to its initial (empty) state.
+        """
+        if state is None:
+            state = {'t': 0, 'ftair': None, 'fet': None, 'thyp_prov': None,
+                     'thyp': None}
+        self.t = int(state['t'])
+        for k in ['ftair', 'fet', 'thyp_prov', 'thyp']:
+            v = state[k]
+            setattr(self, k, None if v is None else float(v))
+
+    def step(self, tair, sr=None):
+        """Advance the model by one time step.
+
+        Args:
+            tair: air temperature (ºC).
+            sr: solar radiation (W/m\\ :sup:`2`\\ ). It is not used: the
+                model uses solar radiation only through the sinusoidal
+                function given by the climatology.
+
+        Returns:
+            A tuple (tepi, thyp) with the simulated epilimnion and hypolimnion
+            temperature (ºC).
+        """
+        # Epilimnion temperature
+        x = float(tair)*self.at_factor - self.mat
+        if self.ftair is None:
+            self.ftair = x
+        else:
+            self.ftair = self.alpha*x + (1 - self.alpha)*self.ftair
+        fsr = self.m_fsr + self.a_fsr*math.sin(self.omega*self.t +
+                                               self.ph_fsr)
+        tepi = self.A + self.B*self.ftair + self.C*fsr
+        if tepi <= 0:
+            tepi = 0.
+
+        # Hypolimnion temperature
+        if self.fet is None:
+            self.fet = tepi
+            self.thyp_prov = self.D*self.A + self.E*self.fet
+            thyp = self.thyp_prov
+        else:
+            self.fet = self.beta*tepi + (1 - self.beta)*self.fet
+            thyp_prov = self.D*self.A + self.E*self.fet
+            thyp = self.thyp + (thyp_prov - self.thyp_prov)
+            self.thyp_prov = thyp_prov
+        # epilimnion denser than hypolimnion (see kernels.overturn)
+        if abs(tepi - 4) <= abs(thyp - 4):
+            thyp = tepi
+        if thyp < 4:
+            thyp = 4.
+        self.thyp = thyp
+
+        self.t += 1
+        return tepi, thyp
@@ -0,0 +1,342 @@
+"""Chunked (streaming) simulation of the OKP model.
+
+The functions in this module run the OKP model on meteorological data files
+that are read by chunks of a fixed number of time steps, so that the memory
+used does not depend on the length of the simulation. The output file is
+written incrementally, chunk by chunk.
+
+The simulation needs two quantities computed over the whole simulation period:
+the mean air temperature (mat) and the coefficients of the sinusoidal function
+fitted to solar radiation. They are obtained in a first pass over the data file
+(see calc_climatology), unless they are provided. In the second pass, the
+model is simulated chunk by chunk, carrying the state of the recursions (ftair,
+fet, thyp_prov and thyp) from one chunk to the next with an OKPModel object
+(see the module simulator), so that the results are the same as for a
+simulation of the whole period at once.
+
+In the incremental mode (run_okp_incremental), the state of the model at the
+end of the simulation and the climatology are saved to a state file next to
+the parameter file. The next run simulates only the rows appended to the
+meteorological data file since then, and appends the results to the output
+file.
+
+This module contains the following functions:
+
+    * calc_climatology: calculate mean air temperature and sinusoidal fit of
+      solar radiation by chunks.
+    * run_okp_incremental: run the OKP model for the data appended since the
+      last run.
+    * run_okp_streaming: run the OKP model by chunks.
+
+"""
+# Copyright 2020-2022 Segula Technologies - Office Français de la Biodiversité.
+#
+# This file is part of the Python package "okplm".
+#
+# The package "okplm" is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# The package "okplm" is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with "okplm".  If not, see <https://www.gnu.org/licenses/>.
+
+
+import json
+import os
+
+import numpy as np
+
+import okplm
+from okplm.input_output import _meteo_columns, _write_text_rows
+from okplm.okp_model import fit_sinusoidal_batch, _estimate_lake_parameters
+from okplm.parameters import _periods_per_year
+from okplm.simulator import OKPModel
+
+# Default number of time steps of each chunk
+DEFAULT_CHUNK_SIZE = 3653
+
+
+def calc_climatology(meteo_file, periodicity='daily', start_date=None,
+                     end_date=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Calculate mean air temperature and sinusoidal fit of solar radiation.
+
+    The meteorological data file is read by chunks, accumulating the sums
+    needed to calculate the mean air temperature and the Fourier coefficients
+    of solar radiation for the main frequency (see okp_model.fit_sinusoidal).
+
+    Args:
+        meteo_file: path of the meteorological data file.
+        periodicity: periodicity of the meteorological data; it can take the
+            values 'daily', 'weekly', 'monthly'.
+        start_date: date of start of the simulation in the format 'YYYY-mm-dd'
+            (optional).
+        end_date: date of end of the simulation in the format 'YYYY-mm-dd'
+            (optional).
+        chunk_size: number of time steps read at once.
+
+    Returns:
+        A dictionary with the number of time steps (n), the mean air
+        temperature (mat) and the coefficients of the sinusoidal function
+        fitted to solar radiation (m_sr, a_sr, ph_sr), without applying the
+        correction factor sw_factor.
+    """
+    nper_yr = _periods_per_year(periodicity)
+    n = 0
+    sums = np.zeros(4)
+    for meteo in _iter_period(meteo_file, start_date, end_date, chunk_size):
+        t = n + np.arange(len(meteo['date']))
+        w = 2*np.pi*t/nper_yr
+        sums += [np.sum(meteo['tair']), np.sum(meteo['sr']),
+                 np.sum(meteo['sr']*np.cos(w)), np.sum(meteo['sr']*np.sin(w))]
+        n += len(t)
+    if n == 0:
+        raise ValueError('No meteorological data in the simulation period')
+
+    # Coefficients of the sinusoidal function (see fit_sinusoidal)
+    a1 = 2*sums[2]/n
+    b1 = 2*sums[3]/n
+    return {'n': n, 'mat': sums[0]/n, 'm_sr': sums[1]/n,
+            'a_sr': np.sqrt(a1**2 + b1**2), 'ph_sr': np.arctan2(a1, b1)}
+
+
+def run_okp_incremental(output_file, meteo_file, par_file, lake_file=None,
+                        periodicity='daily', state_file=None, backend=None,
+                        precision=None):
+    """Run the OKP model for the data appended since the last run.
+
+    The first run simulates the whole meteorological data file and writes
+    the state file, containing the climatology (mat, m_sr, a_sr, ph_sr) of the
+    simulated period, the state of the model after the last time step and the
+    position of the last row read in the meteorological data file. The
+    following runs read the rows appended to the meteorological data file
+    after that position, simulate them starting from the saved state, append
+    the results to the output file and update the state file. The climatology
+    is kept frozen to its value of the first run.
+
+    If the state file does not match the meteorological data file (e.g., the
+    file has been modified and not only appended to), or if the output file
+    does not exist, the whole file is simulated again.
+
+    Args:
+        output_file: path of the output file.
+        meteo_file: path of the meteorological data file.
+        par_file: path of the parameter file. If it does not exist, parameter
+            values are estimated from lake_file and written to par_file.
+        lake_file: path of the lake data file (optional, it is only necessary
+            if par_file is not provided).
+        periodicity: periodicity of the input meteorological data and of the
+            simulation; it can take the values 'daily', 'weekly', 'monthly'.
+        state_file: path of the state file. If None, the name of the parameter
+            file followed by '_state.json' is used (e.g., 'par_state.json'
+            for 'par.txt'), in the same folder.
+        backend: implementation of the model kernels ('python', 'numpy',
+            'numba' or 'auto'; see the module kernels). If None, the value of
+            the environment variable OKPLM_BACKEND is used.
+        precision: number of decimals of the temperature values written to
+            the output file (see input_output.write_output).
+
+    Returns:
+        The number of simulated time steps. The results are written or
+        appended to output_file and the state is written to state_file.
+    """
+    # Allow tilde expansion
+    output_file = os.path.expanduser(output_file)
+    meteo_file = os.path.expanduser(meteo_file)
+    par_file = os.path.expanduser(par_file)
+    if lake_file is not None:
+        lake_file = os.path.expanduser(lake_file)
+    if state_file is None:
+        state_file = os.path.splitext(par_file)[0] + '_state.json'
+    state_file = os.path.expanduser(state_file)
+
+    # Saved state, if it is valid for the current files
+    saved = _read_state(state_file, meteo_file, output_file, periodicity)
+    if saved is None:
+        position = None
+    else:
+        position = saved['meteo']
+    meteo, position = _read_appended(meteo_file, position)
+    if saved is not None and len(meteo['date']) > 0 and \
+            meteo['date'][0] <= np.datetime64(position['last_date'], 'D'):
+        raise ValueError('Dates of the rows appended to ' + meteo_file +
+                         ' are not after the last simulated date')
+
+    if saved is None:
+        # First run: climatology of the whole period
+        if len(meteo['date']) == 0:
+            raise ValueError('No meteorological data in ' + meteo_file)
+        nper_yr = _periods_per_year(periodicity)
+        m_sr, a_sr, ph_sr = fit_sinusoidal_batch(meteo['sr'], nper_yr)
+        climatology = {'n': len(meteo['tair']),
+                       'mat': float(np.mean(meteo['tair'])),
+                       'm_sr': float(m_sr), 'a_sr': float(a_sr),
+                       'ph_sr': float(ph_sr)}
+    else:
+        climatology = saved['climatology']
+
+    # Parameter values
+    if not os.path.exists(par_file):
+        pars = _estimate_lake_parameters(lake_file, climatology['mat'])
+        okplm.write_dict(pars, par_file)
+    else:
+        pars = okplm.read_dict(par_file)
+
+    # Simulation of the new time steps
+    model = OKPModel(pars, climatology, periodicity, backend=backend)
+    if saved is not None:
+        model.set_state(saved['model'])
+    tepi_sim, thyp_sim = model.advance(meteo['tair'], meteo['sr'])
+    with open(output_file, 'wt' if saved is None else 'at') as f:
+        if saved is None:
+            f.write('date tepi thyp\n')
+        _write_text_rows(f, meteo['date'], tepi_sim, thyp_sim, precision)
+
+    # Save state
+    if len(meteo['date']) > 0:
+        position['last_date'] = str(meteo['date'][-1])
+    state = {'periodicity': periodicity, 'climatology': climatology,
+             'model': model.get_state(), 'meteo': position}
+    tmp_file = state_file + '.tmp'
+    with open(tmp_file, 'wt') as f:
+        json.dump(state, f, indent=1)
+    os.replace(tmp_file, state_file)
+
+    return len(meteo['date'])
+
+
+def run_okp_streaming(output_file, meteo_file, par_file, lake_file=None,
+                      start_date=None, end_date=None, periodicity='daily',
+                      chunk_size=DEFAULT_CHUNK_SIZE, climatology=None,
+                      backend=None, precision=None):
+    """Run the OKP model by chunks.
+
+    Args:
+        output_file: path of the output file.
+        meteo_file: path of the meteorological data file.
+        par_file: path of the parameter file. If it does not exist, parameter
+            values are estimated from lake_file and written to par_file.
+        lake_file: path of the lake data file (optional, it is only necessary
+            if par_file is not provided).
+        start_date: date of start of the simulation in the format 'YYYY-mm-dd'.
+        end_date: date of end of the simulation in the format 'YYYY-mm-dd'.
+        periodicity: periodicity of the input meteorological data and of the
+            simulation; it can take the values 'daily', 'weekly', 'monthly'.
+        chunk_size: number of time steps simulated at once.
+        climatology: dictionary with the values of mat, m_sr, a_sr and ph_sr
+            (see calc_climatology). If None, they are calculated from the
+            meteorological data file in a first pass.
+        backend: implementation of the model kernels ('python', 'numpy',
+            'numba' or 'auto'; see the module kernels). If None, the value of
+            the environment variable OKPLM_BACKEND is used.
+        precision: number of decimals of the temperature values written to
+            the output file (see input_output.write_output).
+
+    Returns:
+        The climatology used in the simulation. A text file named output_file
+        is written, with the same format as with okp_model.run_okp. If the
+        par_file does not exist, it is also created by this function.
+    """
+    # Allow tilde expansion
+    output_file = os.path.expanduser(output_file)
+    meteo_file = os.path.expanduser(meteo_file)
+    par_file = os.path.expanduser(par_file)
+    if lake_file is not None:
+        lake_file = os.path.expanduser(lake_file)
+
+    # First pass: mean air temperature and sinusoidal fit of solar radiation
+    if climatology is None:
+        climatology = calc_climatology(meteo_file, periodicity, start_date,
+                                       end_date, chunk_size)
+
+    # Parameter values
+    if not os.path.exists(par_file):
+        pars = _estimate_lake_parameters(lake_file, climatology['mat'])
+        okplm.write_dict(pars, par_file)
+    else:
+        pars = okplm.read_dict(par_file)
+
+    # Second pass: simulation by chunks
+    model = OKPModel(pars, climatology, periodicity, backend=backend)
+    with open(output_file, 'wt') as f:
+        f.write('date tepi thyp\n')
+        for meteo in _iter_period(meteo_file, start_date, end_date,
+                                  chunk_size):
+            tepi_sim, thyp_sim = model.advance(meteo['tair'], meteo['sr'])
+            _write_text_rows(f, meteo['date'], tepi_sim, thyp_sim,
+                             precision)
+
+    return climatology
+
+
+def _read_appended(meteo_file, position=None):
+    """Read the rows of a meteorological data file after a given position.
+
+    position is None to read all the rows, or a dictionary with the offset
+    (in bytes) of the end of the rows already read, and the offset and
+    content of the last row read. The data and the updated position are
+    returned.
+    """
+    with open(meteo_file, 'rb') as f:
+        names = f.readline().decode('utf-8').split()
+        if position is None:
+            position = {'offset': f.tell(), 'last_line_offset': f.tell(),
+                        'last_line': '', 'last_date': None}
+        f.seek(position['offset'])
+        content = f.read()
+    meteo = _meteo_columns(names, content.decode('utf-8'), meteo_file)
+
+    # Position of the last row read
+    position = dict(position)
+    lines = content.rstrip().rsplit(b'\n', 1)
+    if lines[-1].strip():
+        position['last_line_offset'] = position['offset'] + \
+            len(content.rstrip()) - len(lines[-1])
+        position['last_line'] = lines[-1].decode('utf-8')
+    position['offset'] += len(content)
+    return meteo, position
+
+
+def _read_state(state_file, meteo_file, output_file, periodicity):
+    """Read a state file if it is valid for the given files.
+
+    The state is valid if the meteorological data file still contains the
+    last row read at the same position, and if the output file exists.
+    """
+    if not os.path.exists(state_file):
+        return None
+    with open(state_file, 'rt') as f:
+        state = json.load(f)
+    position = state['meteo']
+    last_line = position['last_line'].encode('utf-8')
+    valid = state['periodicity'] == periodicity and \
+        os.path.exists(output_file) and \
+        os.path.getsize(meteo_file) >= position['offset']
+    if valid:
+        with open(meteo_file, 'rb') as f:
+            f.seek(position['last_line_offset'])
+            valid = f.read(len(last_line)) == last_line
+    if not valid:
+        print('State file ' + state_file + ' does not match the ' +
+              'meteorological data and output files. Simulating the whole ' +
+              'period.')
+        return None
+    return state
+
+
+def _iter_period(meteo_file, start_date, end_date, chunk_size):
+    """Read the meteorological data of the simulation period by chunks."""
+    t_start = None if start_date is None else np.datetime64(start_date, 'D')
+    t_end = None if end_date is None else np.datetime64(end_date, 'D')
+    for meteo in okplm.iter_meteo(meteo_file, chunk_size):
+        ind = okplm.daterange_slice(meteo['date'], t_start, t_end)
+        if ind != slice(0, len(meteo['date'])):
+            meteo = {k: v[ind] for k, v in meteo.items()}
+        if len(meteo['date']) > 0:
+            yield meteo
+
@@ -6,6 +6,7 @@ selection of date ranges).
 The included functions are:
 
     - daily_f: apply function on daily periods.
+    - daterange_slice: return slice of sorted dates between two dates.
     - monthly_f: apply function on monthly periods.
     - select_daterange: return indices between two dates.
     - weekly_f: apply function on weekly periods.
@@ -31,7 +32,7 @@ The included functions are:
 # along with "okplm".  If not, see <https://www.gnu.org/licenses/>.
 
 
-from datetime import datetime
+from datetime import datetime, timedelta
 
 import numpy as np
 
@@ -40,107 +41,103 @@ def daily_f(t, x, funcname):
     """Apply a function using subdaily values as args to obtain daily values.
 
     Args:
-        t: datetime sequence at subdaily frequency. Missing timestamps are not
-            allowed.
-        x: data sequence, the same length of t.
+        t: datetime sequence (or numpy.datetime64 array) at subdaily
+            frequency. Missing timestamps are not allowed.
+        x: data sequence, the same length of t, or 2D array (e.g., lakes x
+            time) with the time along the last axis.
         funcname: the function to be used (sum, numpy.mean, etc.).
 
     Returns:
         A tuple of two sequences/arrays (t_day, y_day). The sequence t_day is a
-        datetime sequence at daily frequency. The sequence y_day is the output
-        data sequence, result of applying funcname to the x values for each
-        day. If the input data for a given day is less than 90% of the
-        measurements for a day, a nan value is returned.
+        datetime sequence at daily frequency (a numpy.datetime64 array if t is
+        a numpy.datetime64 array). The sequence y_day is the output data
+        sequence, result of applying funcname to the x values for each day
+        (along the last axis for 2D arrays). If the input data for a given day
+        is less than 90% of the measurements for a day, a nan value is
+        returned.
     """
+    t64, as_datetime = _as_datetime64(t)
+    x = np.asarray(x, dtype=float)
+
     # Arrange data by days
-    nmes = len(t)
-    x_day = dict()
-    for i in range(nmes):
-        t_day = t[i].strftime('%Y/%m/%d')
-        if t_day in x_day:
-            x_day[t_day].append(x[i])
-        else:
-            x_day[t_day] = [x[i]]
+    t_day, starts, x = _group(t64.astype('datetime64[D]'), x)
+    nmes_day = np.diff(np.append(starts, x.shape[-1]))
 
     # Make the calculations
-    t_day = []
-    y_day = []
-    dt = (t[1] - t[0]).total_seconds()  # measurement interval
+    dt = (t64[1] - t64[0])/np.timedelta64(1, 's')  # measurement interval
     nmesday = 86400//dt
-    for d in x_day:
-        t_day.append(datetime.strptime(d, '%Y/%m/%d'))
-        if len(x_day[d]) < nmesday*0.90:
-            y_day.append(np.nan)
-        else:
-            ind = np.logical_not(np.isnan(x_day[d]))
-            y_day.append(funcname(np.array(x_day[d])[ind]))
+    y_day = _reduce(x, starts, funcname, skipna=True)
+    y_day[..., nmes_day < nmesday*0.90] = np.nan
+
+    return _as_output(t_day, as_datetime), y_day
+
+
+def daterange_slice(t, t_start=None, t_end=None):
+    """Return the slice of sorted dates comprised between two dates.
 
-    # Sort the data
-    sorting_index = np.argsort(t_day)
-    t_day = np.array(t_day)[sorting_index]
-    y_day = np.array(y_day)[sorting_index]
+    The bounds are found by binary search (numpy.searchsorted), and the slice
+    can be used to obtain views of t and of the data arrays instead of
+    copies. For unsorted dates, use select_daterange.
 
-    return t_day, y_day
+    Args:
+        t: sorted array of dates (numpy.datetime64).
+        t_start: initial date (numpy.datetime64 or string in the format
+            'YYYY-mm-dd'). If None, the selection starts at the first date.
+        t_end: last date (numpy.datetime64 or string in the format
+            'YYYY-mm-dd'). If None, the selection ends at the last date.
+
+    Returns:
+        A slice object selecting the dates in t comprised between t_start and
+        t_end (or equal). A ValueError is raised if t is not sorted.
+    """
+    t = np.asarray(t)
+    if np.any(t[1:] < t[:-1]):
+        raise ValueError('The dates are not sorted')
+    i1 = 0 if t_start is None else \
+        int(np.searchsorted(t, np.datetime64(t_start), side='left'))
+    i2 = len(t) if t_end is None else \
+        int(np.searchsorted(t, np.datetime64(t_end), side='right'))
+    return slice(i1, max(i1, i2))
 
 
 def monthly_f(t, x, funcname, input_type):
     """Apply a function using daily/subdaily values to obtain monthly values.
 
     Args:
-        t: datetime sequence at daily or subdaily frequency. There should not
-            be missing timestamps.
-        x: data sequence, the same length of t.
+        t: datetime sequence (or numpy.datetime64 array) at daily or subdaily
+            frequency. There should not be missing timestamps.
+        x: data sequence, the same length of t, or 2D array (e.g., lakes x
+            time) with the time along the last axis.
         funcname: the function to be used (sum, numpy.mean, etc.).
         input_type: type of input data, "daily" or "subdaily".
 
     Returns:
         A tuple of two sequences/arrays (t_mon, y_mon). The sequence t_mon
-        is a datetime sequence at monthly frequency. The date indicates the
-        beginning of each month. The sequence y_mon is the output data
-        sequence, result of applying funcname to the x values for each month.
-        If data there are at least 3 days with missing data in a month, a nan
-        value is returned.
+        is a datetime sequence at monthly frequency (a numpy.datetime64 array
+        if t is a numpy.datetime64 array). The date indicates the beginning of
+        each month. The sequence y_mon is the output data sequence, result of
+        applying funcname to the x values for each month (along the last axis
+        for 2D arrays). If data there are at least 3 days with missing data in
+        a month, a nan value is returned.
     """
-    from calendar import monthrange
+    t64, as_datetime = _as_datetime64(t)
 
     # Convert subdaily data to daily data if necessary
     if input_type == 'subdaily':
-        t_day, x_day = daily_f(t, x, funcname)
+        t_day, x_day = daily_f(t64, x, funcname)
     else:
-        t_day, x_day = np.array(t), np.array(x)
+        t_day, x_day = t64.astype('datetime64[D]'), np.asarray(x, dtype=float)
 
     # Arrange the data by month
-    ndays = len(t_day)
-    x_mon = dict()
-    for i in range(ndays):
-        t_mon = t_day[i].strftime('%m/%Y')
-        if t_mon in x_mon:
-            x_mon[t_mon].append(x_day[i])
-        else:
-            x_mon[t_mon] = [x_day[i]]
+    t_mon, starts, x_day = _group(t_day.astype('datetime64[M]'), x_day)
 
     # Make the calculations
-    t_mon = []
-    y_mon = []
-    for d in x_mon:
-        t_mon.append(datetime.strptime(d, '%m/%Y'))
-        month, year = d.split('/')
-        month = int(month)
-        year = int(year)
-        ndaysmon = monthrange(year, month)[1]
-        if sum(np.isnan(x_mon[d])) >= 3:
-            # Not enough days of data available
-            y_mon.append(np.nan)
-        else:
-            ind = np.logical_not(np.isnan(x_mon[d]))
-            y_mon.append(funcname(np.array(x_mon[d])[ind]))
-
-    # Sort the data
-    sorting_index = np.argsort(t_mon)
-    t_mon = np.array(t_mon)[sorting_index]
-    y_mon = np.array(y_mon)[sorting_index]
+    y_mon = _reduce(x_day, starts, funcname, skipna=True)
+    nnan = np.add.reduceat(np.isnan(x_day).astype(int), starts, axis=-1)
+    # Not enough days of data available
+    y_mon[nnan >= 3] = np.nan
 
-    return t_mon, y_mon
+    return _as_output(t_mon.astype('datetime64[D]'), as_datetime), y_mon
 
 
 def select_daterange(t, t_start, t_end):
@@ -153,7 +150,8 @@ def select_daterange(t, t_start, t_end):
 
     Returns:
         An array of indices of dates in t comprised between t_start and t_end
-        (or equal).
+        (or equal). For sorted arrays of dates, daterange_slice is faster and
+        avoids copying the selected data.
     """
     t = np.array(t)
     ind1 = np.less_equal(t_start, t)
@@ -167,53 +165,143 @@ def weekly_f(t, x, funcname, input_type):
     """Apply a function using daily/subdaily values to obtain weekly values.
 
     Args:
-        t: datetime sequence at daily/subdaily frequency. There should not be
-            missing timestamps.
-        x: data sequence, the same length of t.
+        t: datetime sequence (or numpy.datetime64 array) at daily/subdaily
+            frequency. There should not be missing timestamps.
+        x: data sequence, the same length of t, or 2D array (e.g., lakes x
+            time) with the time along the last axis.
         funcname: the function to be used (sum, numpy.mean, etc.).
         input_type: type of input data, "daily" or "subdaily".
 
     Returns:
         A tuple of two sequences/arrays (t_week, y_week). The sequence t_week
-        is a datetime sequence at weekly frequency. The date indicates the
-        beginning of each week. The sequence y_week is the output data
-        sequence, result of applying funcname to the x values for each week.
-        If data is not available for all days for a given week, a nan value is
-        returned.
+        is a datetime sequence at weekly frequency (a numpy.datetime64 array if
+        t is a numpy.datetime64 array). The date indicates the beginning of
+        each week. The sequence y_week is the output data sequence, result of
+        applying funcname to the x values for each week (along the last axis
+        for 2D arrays). If data is not available for all days for a given
+        week, a nan value is returned.
     """
+    t64, as_datetime = _as_datetime64(t)
+
     # Convert subdaily data to daily data if necessary
     if input_type == 'subdaily':
-        t_day, x_day = daily_f(t, x, funcname)
+        t_day, x_day = daily_f(t64, x, funcname)
     else:
-        t_day, x_day = np.array(t), np.array(x)
+        t_day, x_day = t64.astype('datetime64[D]'), np.asarray(x, dtype=float)
 
-    # Arrange the data by weeks
+    # Arrange the data by weeks of 7 consecutive days
     ndays = len(t_day)  # number of days in the period
-    x_week = dict()
-    t_week = 1
-    for i in range(ndays):
-        if i % 7 == 0:
-            x_week[t_week] = [x_day[i]]
-        elif i % 7 < 6:
-            x_week[t_week].append(x_day[i])
-        else:
-            x_week[t_week].append(x_day[i])
-            t_week += 1
-    ind_week_start = np.mod(range(ndays), 7) == 0
-    t_week = t_day[ind_week_start]
+    starts = np.arange(0, ndays, 7)
+    t_week = t_day[starts]
 
     # Make the calculations
-    y_week = []
-    for w in x_week:
-        if len(x_week[w]) == 7:
-            y_week.append(funcname(x_week[w]))
-        else:
-            y_week.append(funcname(np.nan))
-    y_week = np.array(y_week)
+    y_week = _reduce(x_day, starts, funcname, skipna=False)
+    if ndays % 7 != 0:
+        # Last week incomplete
+        y_week[..., -1] = funcname(np.nan)
+
+    return _as_output(t_week, as_datetime), y_week
+
+
+def _as_datetime64(t):
+    """Convert a datetime sequence to a numpy.datetime64 array.
 
-    # Sort the data
-    sorting_index = np.argsort(t_week)
-    t_week = np.array(t_week)[sorting_index]
-    y_week = np.array(y_week)[sorting_index]
+    Returns the array and a flag that is True if t is not a numpy.datetime64
+    array (i.e., if the output dates must be converted back to datetime).
+    """
+    if isinstance(t, np.ndarray) and np.issubdtype(t.dtype, np.datetime64):
+        return t, False
+    try:
+        # microseconds since the epoch (much faster than the conversion of
+        # datetime objects by numpy)
+        t = np.fromiter(((d - _EPOCH)//_MICROSECOND for d in t),
+                        dtype=np.int64).astype('datetime64[us]')
+    except TypeError:
+        # e.g., dates or timezone-aware datetimes
+        t = np.asarray(t).astype('datetime64[us]')
+    return t, True
+
+
+def _as_output(t, as_datetime):
+    """Convert an array of dates to the type of the input dates."""
+    if as_datetime:
+        return t.astype('datetime64[us]').astype(datetime)
+    return t
+
+
+def _group(codes, x):
+    """Arrange data by groups of equal codes (e.g., days or months).
+
+    Returns the sorted unique codes, the index of the first value of each
+    group and the values sorted by group along the last axis.
+    """
+    if len(codes) > 1 and np.any(codes[1:] < codes[:-1]):
+        order = np.argsort(codes, kind='stable')
+        codes = codes[order]
+        x = x[..., order]
+    starts = np.flatnonzero(np.append(True, codes[1:] != codes[:-1]))
+    return codes[starts], starts, x
+
+
+def _reduce(x, starts, funcname, skipna):
+    """Apply a function to the groups of values starting at given indices.
 
-    return t_week, y_week
+    The groups are contiguous along the last axis of x. If skipna is True, nan
+    values are removed before applying the function. The usual functions
+    (sums, means, maxima and minima) are computed with numpy reductions;
+    other functions are applied to each group.
+    """
+    x = np.asarray(x, dtype=float)
+    if len(starts) == 0:
+        return np.empty(x.shape[:-1] + (0,))
+    if funcname not in _REDUCTIONS:
+        return _reduce_generic(x, starts, funcname, skipna)
+    kind, skipna_f = _REDUCTIONS[funcname]
+    skipna = skipna or skipna_f
+
+    if skipna:
+        valid = ~np.isnan(x)
+        n = np.add.reduceat(valid.astype(int), starts, axis=-1)
+    else:
+        valid = None
+        n = np.diff(np.append(starts, x.shape[-1]))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        if kind == 'sum' or kind == 'mean':
+            if valid is not None:
+                x = np.where(valid, x, 0)
+            y = np.add.reduceat(x, starts, axis=-1)
+            if kind == 'mean':
+                y = y/n
+        else:
+            ufunc = np.maximum if kind == 'max' else np.minimum
+            if valid is not None:
+                x = np.where(valid, x, -np.inf if kind == 'max' else np.inf)
+            y = np.where(n > 0, ufunc.reduceat(x, starts, axis=-1), np.nan)
+    return y
+
+
+def _reduce_generic(x, starts, funcname, skipna):
+    """Apply any function to each group of values (see _reduce)."""
+    ends = np.append(starts[1:], x.shape[-1])
+    x2 = x.reshape((-1, x.shape[-1]))
+    y = np.empty((x2.shape[0], len(starts)))
+    for i in range(x2.shape[0]):
+        for j, (i1, i2) in enumerate(zip(starts, ends)):
+            xg = x2[i, i1:i2]
+            if skipna:
+                xg = xg[~np.isnan(xg)]
+            y[i, j] = funcname(xg)
+    return y.reshape(x.shape[:-1] + (len(starts),))
+
+
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+
+# Functions computed with numpy reductions by _reduce: kind of reduction and
+# whether nan values are ignored by the function itself
+_REDUCTIONS = {sum: ('sum', False), np.sum: ('sum', False),
+               np.nansum: ('sum', True), np.mean: ('mean', False),
+               np.nanmean: ('mean', True), np.max: ('max', False),
+               np.amax: ('max', False), np.nanmax: ('max', True),
+               np.min: ('min', False), np.amin: ('min', False),
+               np.nanmin: ('min', True)}
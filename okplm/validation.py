@@ -1,8 +1,12 @@
 """Functions for the validation of simulation results.
 
-This module contains only one function, used to validate simulation results:
+This module contains functions used to validate simulation results:
 
 - error_statistics: calculate error statistics.
+- error_statistics_batch: calculate error statistics of several series at
+  once.
+- error_statistics_pairs: calculate error statistics of several pairs of
+  series at once.
 
 """
 # Copyright 2019 Segula Technologies - Agence Française pour la Biodiversité.
@@ -27,7 +31,7 @@ This module contains only one function, used to validate simulation results:
 import numpy as np
 
 
-def error_statistics(t_sim, v_sim, t_obs, v_obs):
+def error_statistics(t_sim, v_sim, t_obs, v_obs, skipna=False):
     """Calculate error statistics.
 
     Args:
@@ -35,47 +39,134 @@ def error_statistics(t_sim, v_sim, t_obs, v_obs):
         v_sim: array with simulated values.
         t_obs: time array of observed data.
         v_obs: observed values.
+        skipna: if True, pairs of values with missing data (nan) are
+            excluded. If False (default), they are counted in n and the
+            other indicators are nan.
 
     Returns:
         A tuple of six performance indicators (n, sd, r, me, mae, rmse),
         corresponding to the number of measurements (n), the standard deviation
         (sd), the correlation coefficient (r), the mean error (me), the mean
         absolute error (mae), and the root mean square error (rmse).
+        Observations out of the simulation period are excluded.
     """
-    # Make sure input data are arrays
-    t_sim = np.array(t_sim)
-    v_sim = np.array(v_sim)
-    t_obs = np.array(t_obs)
-    v_obs = np.array(v_obs)
+    # Select the simulated values corresponding to the observed values
+    v_sim, v_obs = _join(t_sim, v_sim, t_obs, v_obs)
 
-    # Make sure input data is well ordered and without repetitions
-    for c in ['_sim', '_obs']:
-        if len(eval('t' + c)) != len(np.unique(eval('t' + c))):
-            msg = 'Non unique time stamps in t' + c
-            raise ValueError(msg)
-        ind_ord = np.argsort(eval('t' + c))
-        locals()['t' + c] = eval('t' + c)[ind_ord]
-        locals()['v' + c] = eval('v' + c)[ind_ord]
-
-    # Exclude observations out of the simulation period
-    ind_in = np.in1d(t_obs, t_sim)
-    t_obs = t_obs[ind_in]
-    v_obs = v_obs[ind_in]
-
-    # Select simulated values corresponding to observed values
-    ind = np.in1d(t_sim, t_obs)
-    t_sim = t_sim[ind]
-    v_sim = v_sim[ind]
-
-    # Calculate residuals
-    res = v_sim - v_obs
+    # Missing values propagate to the error statistics
+    if not skipna and np.any(np.isnan(v_sim) | np.isnan(v_obs)):
+        return (len(v_sim),) + (np.nan,)*5
 
     # Calculate error statistics
-    n = len(t_sim)
-    sd = np.std(res)
-    r = np.corrcoef(v_sim, v_obs, rowvar=False)[0, 1]
-    me = np.mean(res)
-    mae = np.mean(np.abs(res))
-    rmse = np.sqrt(np.mean(res**2))
+    stats = error_statistics_batch(v_sim, v_obs)
+    return (int(stats[0]),) + tuple(float(v) for v in stats[1:])
+
+
+def error_statistics_batch(v_sim, v_obs):
+    """Calculate error statistics of several series at once.
+
+    Args:
+        v_sim: 2D array of simulated values (e.g., lakes x time), with one
+            series per row. Missing values are nan.
+        v_obs: 2D array of observed values, with the same shape as v_sim and
+            the same time steps. Missing values are nan.
+
+    Returns:
+        A tuple of six arrays (n, sd, r, me, mae, rmse) with the performance
+        indicators of each series (see error_statistics), computed over the
+        time steps with both a simulated and an observed value (as
+        error_statistics with skipna=True). The indicators
+        of series without such time steps are nan (and n is 0).
+    """
+    v_sim = np.asarray(v_sim, dtype=float)
+    v_obs = np.asarray(v_obs, dtype=float)
+    if v_sim.shape != v_obs.shape:
+        raise ValueError('v_sim and v_obs must have the same shape')
+
+    # Mask of pairs of values
+    valid = ~(np.isnan(v_sim) | np.isnan(v_obs))
+    n = valid.sum(axis=-1)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        # Residuals
+        res = np.where(valid, v_sim - v_obs, 0)
+        me = res.sum(axis=-1)/n
+        mae = np.abs(res).sum(axis=-1)/n
+        rmse = np.sqrt((res**2).sum(axis=-1)/n)
+        sd = np.sqrt(np.where(valid, (res - me[..., None])**2,
+                              0).sum(axis=-1)/n)
+
+        # Correlation coefficient
+        dsim = np.where(valid, v_sim - (np.where(valid, v_sim, 0).sum(
+                axis=-1)/n)[..., None], 0)
+        dobs = np.where(valid, v_obs - (np.where(valid, v_obs, 0).sum(
+                axis=-1)/n)[..., None], 0)
+        r = (dsim*dobs).sum(axis=-1) / \
+            np.sqrt((dsim**2).sum(axis=-1)*(dobs**2).sum(axis=-1))
+        r = np.clip(r, -1, 1)
 
     return n, sd, r, me, mae, rmse
+
+
+def error_statistics_pairs(pairs):
+    """Calculate error statistics of several pairs of series at once.
+
+    Args:
+        pairs: sequence of tuples (t_sim, v_sim, t_obs, v_obs), with the
+            arguments of error_statistics for each pair of simulated and
+            observed series (e.g., one pair per lake).
+
+    Returns:
+        A tuple of six arrays (n, sd, r, me, mae, rmse) with the performance
+        indicators of each pair (see error_statistics), excluding the pairs
+        of values with missing data (nan).
+    """
+    # Align each pair and pad the series with nan
+    joined = [_join(*pair) for pair in pairs]
+    nmax = max([len(v_sim) for v_sim, _ in joined] + [0])
+    sims = np.full((len(joined), nmax), np.nan)
+    obss = np.full((len(joined), nmax), np.nan)
+    for i, (v_sim, v_obs) in enumerate(joined):
+        sims[i, :len(v_sim)] = v_sim
+        obss[i, :len(v_obs)] = v_obs
+
+    return error_statistics_batch(sims, obss)
+
+
+def _join(t_sim, v_sim, t_obs, v_obs):
+    """Select the simulated and observed values with the same time stamps.
+
+    The times are matched by binary search (numpy.searchsorted) in the sorted
+    simulation times. Returns the arrays of simulated and observed values,
+    ordered by time.
+    """
+    # Make sure input data are arrays
+    t_sim = np.asarray(t_sim)
+    v_sim = np.asarray(v_sim, dtype=float)
+    t_obs = np.asarray(t_obs)
+    v_obs = np.asarray(v_obs, dtype=float)
+
+    # Make sure input data is well ordered and without repetitions
+    t_sim, v_sim = _sort_series(t_sim, v_sim, 't_sim')
+    t_obs, v_obs = _sort_series(t_obs, v_obs, 't_obs')
+
+    # Exclude observations out of the simulation period and select simulated
+    # values corresponding to observed values
+    ind = np.minimum(np.searchsorted(t_sim, t_obs), max(len(t_sim) - 1, 0))
+    if len(t_sim) == 0:
+        ind_in = np.zeros(len(t_obs), dtype=bool)
+    else:
+        ind_in = t_sim[ind] == t_obs
+
+    return v_sim[ind[ind_in]], v_obs[ind_in]
+
+
+def _sort_series(t, v, name):
+    """Sort a series by time, checking that the time stamps are unique."""
+    if len(t) > 1 and np.any(t[1:] <= t[:-1]):
+        ind_ord = np.argsort(t, kind='stable')
+        t = t[ind_ord]
+        v = v[ind_ord]
+        if np.any(t[1:] == t[:-1]):
+            raise ValueError('Non unique time stamps in ' + name)
+    return t, v
@@ -26,7 +26,9 @@ setup(
         'later (GPLv3+)'],
     python_requires='>=3.5',
     install_requires=['numpy'],
+    extras_require={'numba': ['numba']},
     entry_points={
         'console_scripts': [
-            'run_okp = okplm.okp_model:main']}
+            'run_okp = okplm.okp_model:main',
+            'run_okp_batch = okplm.batch:main']}
 )
@@ -0,0 +1,90 @@
+"""Test functions in batch.py.
+
+This script runs a batch of simulations of the daily example cases from a
+manifest file, checks that the results are the same as with run_okp(), that
+an interrupted batch is resumed from the journal file, and that the time steps
+are counted at the periodicity of the simulation with weekly output.
+"""
+import json
+import os.path
+import shutil
+import tempfile
+
+import numpy as np
+
+from okplm import read_manifest, run_batch, run_okp
+
+
+folder = os.path.join(os.path.dirname(__file__), '..', 'examples')
+
+with tempfile.TemporaryDirectory() as tmp_dir:
+    # Copy of the daily example cases, with four lakes each
+    cases = ['synthetic_case_daily', 'synthetic_case_par_given']
+    lines = ['name,folder,output,par,obs_data,val_results']
+    for case in cases:
+        shutil.copytree(os.path.join(folder, case),
+                        os.path.join(tmp_dir, case))
+        for i in range(4):
+            if case == 'synthetic_case_daily':
+                lines.append('%s_%d,%s,out_%d.txt,par_%d.txt,obs.txt,'
+                             'err_%d.txt' % (case, i, case, i, i, i))
+            else:
+                lines.append('%s_%d,%s,out_%d.txt,,,' % (case, i, case, i))
+    manifest = os.path.join(tmp_dir, 'manifest.csv')
+    with open(manifest, 'wt') as f:
+        f.write('\n'.join(lines) + '\n')
+
+    lakes = read_manifest(manifest)
+    assert len(lakes) == 8
+    assert lakes[4]['par_file'] == os.path.join(
+            tmp_dir, 'synthetic_case_par_given', 'par.txt')
+    assert lakes[4]['validation_data_file'] is None
+
+    # Interrupted batch: only the first lake was completed
+    with open(manifest + '.journal', 'wt') as f:
+        f.write(json.dumps({'name': lakes[0]['name'], 'n': 365}) + '\n')
+        f.write('{"name": "synthetic_ca')
+    summary = run_batch(manifest, processes=2)
+    assert summary['n_skipped'] == 1
+    assert summary['n_done'] == 7
+    assert summary['n_failed'] == 0
+    assert summary['n_steps'] == 7*365
+    assert not os.path.exists(lakes[0]['output_file'])
+
+    # Resumed batch: nothing to simulate
+    summary = run_batch(manifest, processes=1)
+    assert summary['n_skipped'] == 8 and summary['n_done'] == 0
+
+    # Results
+    for lake in lakes[1:]:
+        output_file = os.path.join(tmp_dir, 'ref.txt')
+        run_okp(output_file, lake['meteo_file'], lake['par_file'],
+                validation_data_file=lake['validation_data_file'],
+                validation_res_file=lake['validation_res_file'])
+        res = np.genfromtxt(lake['output_file'], names=True,
+                            encoding='utf-8', dtype=None)
+        ref = np.genfromtxt(output_file, names=True, encoding='utf-8',
+                            dtype=None)
+        assert np.array_equal(res, ref)
+        if lake['validation_res_file'] is not None:
+            assert os.path.exists(lake['validation_res_file'])
+
+    # Failed water bodies are not recorded in the journal
+    with open(manifest, 'at') as f:
+        f.write('missing,missing_folder,,,,\n')
+    summary = run_batch(manifest, processes=1)
+    assert summary['n_failed'] == 1 and summary['n_done'] == 0
+    summary = run_batch(manifest, processes=1, restart=True)
+    assert summary['n_done'] == 8 and summary['n_failed'] == 1
+
+    # Weekly output: the time steps are counted at the periodicity of the
+    # simulation, not of the output
+    summary = run_batch(manifest, processes=1, restart=True,
+                        output_periodicity='weekly')
+    assert summary['n_done'] == 8 and summary['n_steps'] == 8*365
+    with open(manifest + '.journal', 'rt') as f:
+        entries = [json.loads(line) for line in f if line.strip()]
+    assert all([entry['n'] == 365 for entry in entries])
+    res = np.genfromtxt(lakes[1]['output_file'], names=True,
+                        encoding='utf-8', dtype=None)
+    assert len(res) < 365
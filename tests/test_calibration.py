@@ -0,0 +1,118 @@
+"""Test the functions in calibration.py.
+
+This script checks that the calibration recovers the parameter values used to
+simulate synthetic observations, with differential evolution and with
+separable least squares, that the result does not depend on the backend, and
+that calibrate_okp() writes the calibrated parameter values to a parameter
+file.
+"""
+import os.path
+import tempfile
+
+import numpy as np
+
+from okplm import calibrate, calibrate_okp, calibrate_separable, read_dict
+from okplm import read_meteo, run_okp_arrays
+from okplm.calibration import _clipped_least_squares
+
+
+meteo_file = os.path.join(os.path.dirname(__file__), '..', 'examples',
+                          'synthetic_case_daily', 'meteo.txt')
+meteo = read_meteo(meteo_file)
+par_vals = {'A': 6.2, 'B': 1.007, 'C': -0.007, 'D': 0.51, 'E': 0.245,
+            'ALPHA': 0.071, 'BETA': 0.13, 'at_factor': 1.0,
+            'sw_factor': 1.0, 'mat': -0.407}
+
+# Synthetic observations, every 5 days
+res = run_okp_arrays(meteo['date'], meteo['tair'], meteo['sr'],
+                     par_vals=par_vals)
+obs_data = {'date': res['date'][::5], 'tepi': res['tepi'][::5],
+            'thyp': res['thyp'][::5]}
+obs_data['thyp'][3] = np.nan
+
+# Calibration from perturbed initial values
+par_init = dict(par_vals, A=4., B=0.8, ALPHA=0.2, BETA=0.3)
+bounds = {'A': (0, 10), 'B': (0.5, 1.5), 'ALPHA': (0.01, 0.5),
+          'BETA': (0.01, 0.5)}
+cal = calibrate(meteo['date'], meteo['tair'], meteo['sr'], obs_data,
+                par_init, bounds=bounds, popsize=20, maxiter=150, seed=0,
+                backend='numpy')
+assert cal['score'] < 0.05
+assert cal['nfev'] == 20*(cal['niter'] + 1)
+for k in par_vals:
+    if k in bounds:
+        assert bounds[k][0] <= cal['par_vals'][k] <= bounds[k][1]
+    else:
+        assert cal['par_vals'][k] == par_vals[k]
+assert abs(cal['par_vals']['A'] - 6.2) < 0.5
+assert abs(cal['par_vals']['ALPHA'] - 0.071) < 0.01
+assert par_init['A'] == 4.
+
+# Same result with another backend
+cal_python = calibrate(meteo['date'], meteo['tair'], meteo['sr'], obs_data,
+                       par_init, bounds=bounds, popsize=20, maxiter=5,
+                       seed=0, backend='python')
+cal_numpy = calibrate(meteo['date'], meteo['tair'], meteo['sr'], obs_data,
+                      par_init, bounds=bounds, popsize=20, maxiter=5, seed=0,
+                      backend='numpy')
+assert np.isclose(cal_python['score'], cal_numpy['score'])
+
+# Separable least squares
+cal_hyp = calibrate_separable(meteo['date'], meteo['tair'], meteo['sr'],
+                              obs_data, par_init, backend='numpy')
+assert cal_hyp['score'] < 0.05
+assert cal_hyp['par_vals']['D'] == par_init['D']
+for k in ['A', 'B', 'C', 'ALPHA']:
+    assert np.isclose(cal_hyp['par_vals'][k], par_vals[k], rtol=0.01,
+                      atol=1e-3)
+cal = calibrate_separable(meteo['date'], meteo['tair'], meteo['sr'],
+                          {'date': obs_data['date'], 'tepi': obs_data['tepi']},
+                          par_init, backend='numpy')
+assert cal['score'] < 0.01 and cal['nfev'] < 60
+assert cal['par_vals']['BETA'] == par_init['BETA']
+# the grid of BETA x E and the four golden-section searches (at least three
+# evaluations each) are counted
+assert cal_hyp['nfev'] >= cal['nfev'] + 24**2 + 4*3
+
+# Not enough observations above 0 ºC, or collinear regressors
+try:
+    calibrate_separable(meteo['date'], meteo['tair'], meteo['sr'],
+                        {'date': obs_data['date'][:2],
+                         'tepi': obs_data['tepi'][:2]}, par_init)
+except ValueError:
+    pass
+else:
+    raise AssertionError('Calibration with two observations accepted')
+try:
+    _clipped_least_squares(np.ones((1, 10, 3)), np.arange(1., 11.))
+except ValueError:
+    pass
+else:
+    raise AssertionError('Rank-deficient least squares fit accepted')
+
+# Empty simulation period
+try:
+    calibrate(meteo['date'][:0], meteo['tair'][:0], meteo['sr'][:0], obs_data,
+              par_init, bounds=bounds)
+except ValueError:
+    pass
+else:
+    raise AssertionError('Calibration without simulation period accepted')
+
+# Calibration from files
+with tempfile.TemporaryDirectory() as folder:
+    obs_file = os.path.join(folder, 'obs.txt')
+    with open(obs_file, 'wt') as f:
+        f.write('date tepi\n')
+        for t, v in zip(obs_data['date'], obs_data['tepi']):
+            f.write('%s %r\n' % (t, v))
+    par_file = os.path.join(folder, 'par.txt')
+    with open(par_file, 'wt') as f:
+        for k, v in par_init.items():
+            f.write('%s %r\n' % (k, v))
+    out_file = os.path.join(folder, 'par_cal.txt')
+    cal = calibrate_okp(meteo_file, obs_file, par_file,
+                        output_par_file=out_file, bounds={'A': (0, 10)},
+                        maxiter=20, seed=0)
+    assert read_dict(out_file) == cal['par_vals']
+    assert read_dict(par_file) == par_init
@@ -0,0 +1,94 @@
+"""Test the functions in ensemble.py.
+
+This script checks the Saltelli design, the estimation of the Sobol indices
+of analytic functions with known indices, that the ensemble simulated by
+blocks of members with run_ensemble() gives the same statistics as the
+simulations of each member with run_okp_arrays(), and that the ensembles of
+several water bodies give the same statistics as the ensembles of each one.
+"""
+import os.path
+
+import numpy as np
+
+from okplm import estimate_parameters, lake_type_constants, read_dict
+from okplm import read_meteo, run_ensemble, run_okp_arrays
+from okplm import saltelli_design, sobol_indices
+
+
+# Saltelli design
+bounds = {'x1': (0, 1), 'x2': (0, 2), 'x3': (-1, 1)}
+names, design = saltelli_design(bounds, 20000, seed=1)
+assert names == ('x1', 'x2', 'x3') and design.shape == (20000, 5, 3)
+for i, name in enumerate(names):
+    assert (design[..., i] >= bounds[name][0]).all()
+    assert (design[..., i] <= bounds[name][1]).all()
+    ab = design[:, 2 + i]
+    assert (ab[:, i] == design[:, 1, i]).all()
+    assert (np.delete(ab, i, axis=1) == np.delete(design[:, 0], i, 1)).all()
+
+# Sobol indices of an additive function (S1 = ST = 1/5, 4/5 and 0) and of a
+# product (S1 = 3/7 and ST = 4/7 for x1 and x2)
+first, total = sobol_indices(design[..., 0] + design[..., 1])
+assert np.allclose(first, [0.2, 0.8, 0], atol=0.03)
+assert np.allclose(total, [0.2, 0.8, 0], atol=0.03)
+y = design[..., 0]*design[..., 1]
+first, total = sobol_indices(np.stack([y, 2*y + 1], axis=-1))
+assert first.shape == (3, 2) and np.allclose(first[:, 0], first[:, 1])
+assert np.allclose(first[:, 0], [3/7, 3/7, 0], atol=0.03)
+assert np.allclose(total[:, 0], [4/7, 4/7, 0], atol=0.03)
+assert np.isnan(sobol_indices(np.ones((10, 5)))[0]).all()
+
+# Ensemble of simulations of a lake
+folder = os.path.join(os.path.dirname(__file__), '..', 'examples',
+                      'synthetic_case_daily')
+meteo = read_meteo(os.path.join(folder, 'meteo.txt'))
+lake_data = read_dict(os.path.join(folder, 'lake.txt'))
+bounds = {'surface': (4e5, 7e5), 'zmax': (40, 60), 'A1': (38, 42),
+          'at_factor': (0.9, 1.1)}
+res = run_ensemble(meteo['date'], meteo['tair'], meteo['sr'], lake_data,
+                   bounds, 10, block_size=3, seed=0, backend='numpy')
+assert res['nmembers'] == 60
+names, design = saltelli_design(bounds, 10, seed=0)
+assert res['factors'] == names
+nmes = len(meteo['tair'])
+sim = {'tepi': np.zeros((10, 6, nmes)), 'thyp': np.zeros((10, 6, nmes))}
+for j in range(10):
+    for m in range(6):
+        x = dict(zip(names, design[j, m]))
+        var_vals = dict(lake_data, surface=x['surface'], zmax=x['zmax'])
+        par_cts = dict(lake_type_constants('L'), A1=x['A1'])
+        par_vals = estimate_parameters(var_vals, par_cts)
+        par_vals.update(mat=np.mean(meteo['tair']),
+                        at_factor=x['at_factor'])
+        out = run_okp_arrays(meteo['date'], meteo['tair'], meteo['sr'],
+                             par_vals=par_vals)
+        sim['tepi'][j, m] = out['tepi']
+        sim['thyp'][j, m] = out['thyp']
+for k in ['tepi', 'thyp']:
+    y = sim[k][:, :2].reshape(20, -1)
+    np.testing.assert_allclose(res[k]['mean'], y.mean(axis=0), atol=1e-8)
+    np.testing.assert_allclose(res[k]['sd'], y.std(axis=0), atol=1e-6)
+    first, total = sobol_indices(sim[k])
+    np.testing.assert_allclose(res[k]['first_order'], first, atol=1e-6)
+    np.testing.assert_allclose(res[k]['total_order'], total, atol=1e-6)
+
+# Ensemble of two water bodies (a lake and a reservoir), with quantiles
+lakes = {k: np.array([lake_data[k], lake_data[k]]) for k in lake_data}
+lakes['type'] = np.array(['L', 'R'])
+lakes['altitude'][1] = 500
+tair = np.vstack([meteo['tair'], meteo['tair'] + 2])
+res = run_ensemble(meteo['date'], tair, meteo['sr'], lakes, bounds, 10,
+                   block_size=4, quantiles=[0.1, 0.9], seed=0)
+assert res['tepi']['mean'].shape == (2, nmes)
+assert res['thyp']['quantiles'].shape == (2, 2, nmes)
+assert res['thyp']['first_order'].shape == (4, 2, nmes)
+for i in range(2):
+    lake_i = {k: v[i] for k, v in lakes.items()}
+    res_i = run_ensemble(meteo['date'], tair[i], meteo['sr'], lake_i, bounds,
+                         10, quantiles=[0.1, 0.9], seed=0)
+    for k in ['tepi', 'thyp']:
+        for s in res_i[k]:
+            y = np.moveaxis(res[k][s], -2, 0)[i]
+            np.testing.assert_allclose(y, res_i[k][s], atol=1e-10)
+        assert (res[k]['min'][i] <= res_i[k]['quantiles'][0]).all()
+        assert (res[k]['max'][i] >= res_i[k]['quantiles'][1]).all()
@@ -0,0 +1,151 @@
+"""Test functions in input_output.py and cache.py.
+
+This script checks that the function read_meteo() reads the example
+meteorological data files as numpy.genfromtxt() does (also with comments and
+blank lines), that the function read_meteo_cached() returns the same data from
+the cache (and detects modifications of the file with strict validation), that
+the function read_meteo_range() reads the same rows as read_meteo() with the
+date index, and that the output files written by write_output() in the
+different formats are read back by read_output().
+"""
+import glob
+import os.path
+import shutil
+import tempfile
+
+import numpy as np
+
+from okplm import clear_cache, read_meteo, read_meteo_cached, read_meteo_range
+from okplm import read_output
+from okplm import write_output
+
+
+folder = os.path.join(os.path.dirname(__file__), '..', 'examples')
+
+# Test read_meteo
+for meteo_file in glob.glob(os.path.join(folder, '*', 'meteo.txt')):
+    meteo = read_meteo(meteo_file)
+    meteo_ref = np.genfromtxt(meteo_file, names=True, encoding='utf-8',
+                              dtype=None)
+    assert meteo['date'].dtype == np.dtype('datetime64[D]')
+    assert np.all(meteo['date'] == meteo_ref['date'].astype('datetime64[D]'))
+    for k in ['tair', 'sr']:
+        assert meteo[k].dtype == np.float64
+        assert np.array_equal(meteo[k], meteo_ref[k])
+
+# Comments, blank lines and malformed rows
+with tempfile.TemporaryDirectory() as meteo_dir:
+    meteo_file = os.path.join(meteo_dir, 'meteo.txt')
+    with open(meteo_file, 'wt') as f:
+        f.write('date tair sr\n# station 1\n2000-01-01 1.5 100\n' +
+                '2000-01-02 2.5 110  # estimated\n\n')
+    meteo = read_meteo(meteo_file)
+    assert np.all(meteo['date'] == np.array(['2000-01-01', '2000-01-02'],
+                                            dtype='datetime64[D]'))
+    assert np.array_equal(meteo['tair'], [1.5, 2.5])
+    assert np.array_equal(meteo['sr'], [100, 110])
+    with open(meteo_file, 'wt') as f:
+        f.write('date tair sr\n2000-01-01 1.5\n2000-01-02 2.5 110 120\n')
+    try:
+        read_meteo(meteo_file)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError('Meteorological file with short rows accepted')
+
+# Test read_meteo_cached
+with tempfile.TemporaryDirectory() as cache_dir:
+    meteo_file = os.path.join(folder, 'synthetic_case_daily', 'meteo.txt')
+    meteo_ref = read_meteo(meteo_file)
+    for i in range(2):
+        # the first call fills the cache, the second one reads from it
+        meteo = read_meteo_cached(meteo_file, cache_dir=cache_dir)
+        for k in meteo_ref:
+            assert meteo[k].dtype == meteo_ref[k].dtype
+            assert np.array_equal(meteo[k], meteo_ref[k])
+    assert isinstance(meteo['tair'], np.memmap)
+    assert len(os.listdir(cache_dir)) == 1
+
+    # size limit: only the last entry is kept
+    for case in ['weekly', 'monthly']:
+        read_meteo_cached(os.path.join(folder, 'synthetic_case_' + case,
+                                       'meteo.txt'),
+                          cache_dir=cache_dir, max_size=1)
+    assert len(os.listdir(cache_dir)) == 1
+    assert clear_cache(cache_dir) == 1
+
+    # file modified without changing its size and modification time: only
+    # detected with strict validation
+    with tempfile.TemporaryDirectory() as meteo_dir:
+        meteo_copy = os.path.join(meteo_dir, 'meteo.txt')
+        shutil.copy(meteo_file, meteo_copy)
+        read_meteo_cached(meteo_copy, cache_dir=cache_dir)
+        stat = os.stat(meteo_copy)
+        with open(meteo_copy, 'rt') as f:
+            content = f.read()
+        with open(meteo_copy, 'wt') as f:
+            f.write(content.replace(' 0.', ' 1.', 1))
+        os.utime(meteo_copy, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        meteo = read_meteo_cached(meteo_copy, cache_dir=cache_dir)
+        assert np.array_equal(meteo['tair'], meteo_ref['tair'])
+        meteo = read_meteo_cached(meteo_copy, cache_dir=cache_dir,
+                                  strict=True)
+        assert not np.array_equal(meteo['tair'], meteo_ref['tair'])
+        assert np.array_equal(meteo['tair'], read_meteo(meteo_copy)['tair'])
+        assert len(os.listdir(cache_dir)) == 1
+
+# Test read_meteo_range
+with tempfile.TemporaryDirectory() as meteo_dir:
+    meteo_file = os.path.join(meteo_dir, 'meteo.txt')
+    shutil.copy(os.path.join(folder, 'synthetic_case_daily', 'meteo.txt'),
+                meteo_file)
+    meteo_ref = read_meteo(meteo_file)
+    t = meteo_ref['date']
+    for start_date, end_date in [('2015-03-01', '2015-03-31'),
+                                 (None, '2015-01-10'), ('2015-12-20', None),
+                                 ('2000-01-01', '2030-01-01'),
+                                 ('2015-06-01', '2015-05-01')]:
+        meteo = read_meteo_range(meteo_file, start_date, end_date)
+        ind = np.ones(len(t), dtype=bool)
+        if start_date is not None:
+            ind &= t >= np.datetime64(start_date)
+        if end_date is not None:
+            ind &= t <= np.datetime64(end_date)
+        for k in meteo_ref:
+            assert np.array_equal(meteo[k], meteo_ref[k][ind])
+    assert os.path.exists(meteo_file + '.idx')
+
+    # the index is built again when the file is modified
+    with open(meteo_file, 'at') as f:
+        f.write('2030-01-01 1.5 100\n')
+    meteo = read_meteo_range(meteo_file, '2029-01-01')
+    assert len(meteo['date']) == 1 and meteo['tair'][0] == 1.5
+
+# Test write_output and read_output
+t = np.arange('1999-12-25', '2000-03-01', dtype='datetime64[D]')
+tepi = np.linspace(0, 25, len(t))/3
+thyp = 4 + tepi/7
+thyp[3] = np.nan
+with tempfile.TemporaryDirectory() as out_dir:
+    for output_format in ['text', 'npy', 'npz', 'raw']:
+        out_file = os.path.join(out_dir, 'output.' + output_format)
+        write_output(out_file, t, tepi, thyp, output_format=output_format)
+        output = read_output(out_file, output_format)
+        assert np.array_equal(output['date'], t)
+        if output_format == 'raw':
+            # float32 values
+            assert np.array_equal(output['tepi'], tepi.astype(np.float32))
+            assert np.array_equal(output['thyp'], thyp.astype(np.float32),
+                                  equal_nan=True)
+        else:
+            assert np.array_equal(output['tepi'], tepi)
+            assert np.array_equal(output['thyp'], thyp, equal_nan=True)
+
+    # text file with a given precision
+    out_file = os.path.join(out_dir, 'output.txt')
+    write_output(out_file, t, tepi, thyp, precision=2)
+    with open(out_file, 'rt') as f:
+        lines = f.read().splitlines()
+    assert lines[0] == 'date tepi thyp' and len(lines) == len(t) + 1
+    assert lines[2] == '1999-12-26 %.2f %.2f' % (tepi[1], thyp[1])
+    assert lines[4] == '1999-12-28 %.2f nan' % tepi[3]
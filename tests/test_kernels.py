@@ -0,0 +1,147 @@
+"""Test functions in kernels.py.
+
+This script checks that the vectorized implementations of the kernels in the
+module kernels.py give the same results as the reference loops.
+"""
+import warnings
+
+import numpy as np
+
+from okplm import kernels
+from okplm.kernels import BACKENDS, exponential_smoothing, get_backend
+from okplm.kernels import hypolimnion_recursion, overturn, water_density
+
+
+# Test exponential_smoothing
+rng = np.random.default_rng(1)
+x = 10*np.sin(2*np.pi*np.arange(3000)/365.25) + rng.normal(0, 2, 3000)
+for alpha in [0, 0.001, 0.07, 0.5, 0.99, 1]:
+    y_ref = exponential_smoothing(x, alpha, backend='python')
+    y_vec = exponential_smoothing(x, alpha, backend='numpy')
+    np.testing.assert_allclose(y_vec, y_ref, rtol=0, atol=1e-10)
+
+# Several series at once, one coefficient per series
+x2 = rng.normal(0, 5, (4, 500))
+alpha = np.array([0.02, 0.3, 1, 0.8])
+y_ref = exponential_smoothing(x2, alpha, backend='python')
+y_vec = exponential_smoothing(x2, alpha, backend='numpy')
+np.testing.assert_allclose(y_vec, y_ref, rtol=0, atol=1e-10)
+for i in range(4):
+    np.testing.assert_allclose(exponential_smoothing(x2[i], alpha[i]),
+                               y_vec[i], rtol=0, atol=1e-12)
+
+# Missing values are carried to all the following time steps by all the
+# backends, in series with and without missing values
+x3 = np.vstack([x[:2000], x[:2000], x[1000:]])
+x3[0, 100] = np.nan
+x3[2, 0] = np.nan
+for alpha in [0.3, np.array([0.3, 0.07, 1])]:
+    y_ref = exponential_smoothing(x3, alpha, backend='python')
+    assert np.isnan(y_ref[0, 100:]).all() and np.isnan(y_ref[2]).all()
+    for backend in ['numpy', 'numba']:
+        np.testing.assert_allclose(exponential_smoothing(x3, alpha, backend),
+                                   y_ref, rtol=0, atol=1e-10)
+        np.testing.assert_allclose(
+                exponential_smoothing(x3[0], 0.3, backend), y_ref[0], rtol=0,
+                atol=1e-10)
+
+# Test hypolimnion_recursion
+tepi = np.maximum(x + 5, 0)
+for beta, e in [(0.13, 0.24), (1, 0.96), (0.05, 0.6)]:
+    thyp_ref = hypolimnion_recursion(tepi, beta, 0.51, 6.2, e, 'python')
+    for backend in ['numpy', 'auto']:
+        thyp = hypolimnion_recursion(tepi, beta, 0.51, 6.2, e, backend)
+        np.testing.assert_allclose(thyp, thyp_ref, rtol=0, atol=1e-10)
+    assert np.all(thyp >= 4)
+
+# Segmented scan of the hypolimnion recursion on series with many overturns
+for seed in range(20):
+    rng = np.random.default_rng(seed)
+    n = rng.integers(1, 2000)
+    tair = rng.uniform(-5, 15) - rng.uniform(3, 15) * \
+        np.cos(2*np.pi*np.arange(n)/365.25) + rng.normal(0, 3, n)
+    tepi = np.maximum(rng.uniform(0, 10) + exponential_smoothing(tair, 0.1),
+                      0)
+    beta = rng.choice([0.13, 1])
+    e, a = rng.uniform(0.05, 1), rng.uniform(0, 15)
+    thyp_ref = hypolimnion_recursion(tepi, beta, 0.51, a, e, 'python')
+    thyp = hypolimnion_recursion(tepi, beta, 0.51, a, e, 'numpy')
+    np.testing.assert_allclose(thyp, thyp_ref, rtol=0, atol=1e-10)
+
+# Missing values of epilimnion temperature are carried to all the following
+# time steps by all the backends (single series and several series)
+tepi_nan = np.vstack([tepi, tepi])
+tepi_nan[0, 100] = np.nan
+for backend in ['python', 'numpy', 'numba']:
+    thyp = hypolimnion_recursion(tepi_nan, 0.13, 0.51, 6.2, 0.5, backend)
+    assert np.isnan(thyp[0, 100:]).all() and not np.isnan(thyp[0, :100]).any()
+    assert not np.isnan(thyp[1]).any()
+    np.testing.assert_allclose(
+            hypolimnion_recursion(tepi_nan[0], 0.13, 0.51, 6.2, 0.5, backend),
+            thyp[0], rtol=0, atol=1e-10)
+    np.testing.assert_allclose(
+            thyp, hypolimnion_recursion(tepi_nan, 0.13, 0.51, 6.2, 0.5,
+                                        'python'), rtol=0, atol=1e-10)
+
+# Epilimnion and hypolimnion temperature symmetric around 4 ºC: all the
+# backends take the same overturn decision, for single series (one time step,
+# with thyp = 8 - tepi) and several series
+tepi_sym = 4 + np.round(np.random.default_rng(2).uniform(-4, 4, 200), 2)
+thyp_sym = np.maximum(np.where(overturn(tepi_sym, 8 - tepi_sym), tepi_sym,
+                               8 - tepi_sym), 4)
+for backend in ['python', 'numpy', 'numba']:
+    thyp = [hypolimnion_recursion(tepi_sym[i:i + 1], 1, 1, 8, -1, backend)[0]
+            for i in range(len(tepi_sym))]
+    assert np.array_equal(thyp, thyp_sym)
+    thyp = hypolimnion_recursion(tepi_sym[:, None], 1, 1, 8, -1, backend)
+    assert np.array_equal(thyp[:, 0], thyp_sym)
+
+# Recursions by chunks, carrying the state from one chunk to the next
+tepi2 = np.vstack([tepi, tepi[::-1]])
+for backend in ['python', 'numpy', 'numba']:
+    for xs in [tepi, tepi2]:
+        y_ref = exponential_smoothing(xs, 0.07, backend)
+        thyp_ref = hypolimnion_recursion(xs, 0.13, 0.51, 6.2, 0.5, backend)
+        y_prev = None
+        state = None
+        y = []
+        thyp = []
+        for ind in np.array_split(np.arange(xs.shape[-1]), [0, 1, 40, 41]):
+            y.append(exponential_smoothing(xs[..., ind], 0.07, backend,
+                                           y_prev=y_prev))
+            y_prev = y[-1][..., -1] if len(ind) > 0 else y_prev
+            thyp_i, state_i = hypolimnion_recursion(
+                    xs[..., ind], 0.13, 0.51, 6.2, 0.5, backend, state=state,
+                    return_state=True)
+            thyp.append(thyp_i)
+            state = state_i if len(ind) > 0 else state
+        np.testing.assert_allclose(np.concatenate(y, axis=-1), y_ref,
+                                   rtol=0, atol=1e-10)
+        np.testing.assert_allclose(np.concatenate(thyp, axis=-1), thyp_ref,
+                                   rtol=0, atol=1e-10)
+
+# Test backend selection
+assert get_backend('numpy') == 'numpy'
+assert get_backend('auto') in BACKENDS
+numba = kernels.numba
+kernels.numba = None
+with warnings.catch_warnings(record=True) as w:
+    warnings.simplefilter('always')
+    assert get_backend('numba') == 'numpy'
+assert len(w) == 1 and issubclass(w[0].category, RuntimeWarning)
+kernels.numba = numba
+for alpha in [0.001, 0.07, 1]:
+    np.testing.assert_allclose(exponential_smoothing(x, alpha, 'numba'),
+                               exponential_smoothing(x, alpha, 'python'),
+                               rtol=0, atol=1e-10)
+
+# Test water_density and overturn
+temp = rng.uniform(-2, 30, (3, 4, 5))
+dens = water_density(temp)
+assert dens.shape == temp.shape
+assert water_density(list(temp[0, 0]))[2] == water_density(temp[0, 0, 2])
+assert np.isscalar(water_density(4.0)) and water_density(4.0) == 1000
+tepi = rng.uniform(0, 25, 1000)
+thyp = rng.uniform(4, 15, 1000)
+assert np.all(overturn(tepi, thyp) ==
+              (water_density(tepi) >= water_density(thyp)))
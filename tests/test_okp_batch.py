@@ -0,0 +1,106 @@
+"""Test the batched functions in okp_model.py.
+
+This script checks that the functions calc_epilimnion_temperature_batch() and
+calc_hypolimnion_temperature_batch() give the same results as the single-lake
+functions calc_epilimnion_temperature() and calc_hypolimnion_temperature(),
+that the sinusoidal fit with the cached basis (fit_sinusoidal_batch() and
+calc_sinusoidal()) gives the same results as fit_sinusoidal(), and that the
+Jacobians with respect to the parameters agree with finite differences.
+"""
+import os.path
+
+import numpy as np
+
+from okplm.okp_model import calc_epilimnion_temperature
+from okplm.okp_model import calc_epilimnion_temperature_batch
+from okplm.okp_model import calc_hypolimnion_temperature
+from okplm.okp_model import calc_hypolimnion_temperature_batch
+from okplm.okp_model import calc_sinusoidal, fit_sinusoidal
+from okplm.okp_model import fit_sinusoidal_batch, sinusoidal_basis
+from okplm.okp_model import JACOBIAN_PARAMETERS
+
+
+meteo_file = os.path.join(os.path.dirname(__file__), '..', 'examples',
+                          'synthetic_case_daily', 'meteo.txt')
+meteo = np.genfromtxt(meteo_file, names=True, encoding='utf-8', dtype=None)
+
+# Parameter values of three lakes
+par_lakes = [{'A': 6.2, 'B': 1.007, 'C': -0.007, 'D': 0.51, 'E': 0.245,
+              'ALPHA': 0.071, 'BETA': 0.13, 'at_factor': 1.0,
+              'sw_factor': 1.0, 'mat': -0.407},
+             {'A': 12.5, 'B': 0.95, 'C': 0.001, 'D': 0.51, 'E': 0.96,
+              'ALPHA': 0.2, 'BETA': 1.0, 'at_factor': 1.0,
+              'sw_factor': 1.0, 'mat': 1.5},
+             {'A': 9.0, 'B': 0.8, 'C': 0.0005, 'D': 0.51, 'E': 0.5,
+              'ALPHA': 0.03, 'BETA': 0.13, 'at_factor': 1.1,
+              'sw_factor': 0.9, 'mat': 0.0}]
+nlakes = len(par_lakes)
+par_vals = {k: np.array([p[k] for p in par_lakes]) for k in par_lakes[0]}
+tair = np.tile(meteo['tair'], (nlakes, 1))
+sr = np.tile(meteo['sr'], (nlakes, 1))
+
+for periodicity in ['daily', 'weekly', 'monthly']:
+    tepi = calc_epilimnion_temperature_batch(tair, sr, par_vals, periodicity)
+    thyp = calc_hypolimnion_temperature_batch(tepi, par_vals, periodicity)
+    assert tepi.shape == (nlakes, len(meteo))
+    assert thyp.shape == (nlakes, len(meteo))
+    for i in range(nlakes):
+        pars = dict(par_lakes[i])
+        tepi_i = calc_epilimnion_temperature(meteo['tair'], meteo['sr'], pars,
+                                             periodicity)
+        thyp_i = calc_hypolimnion_temperature(tepi_i, pars, periodicity)
+        np.testing.assert_allclose(tepi[i], tepi_i, rtol=0, atol=1e-10)
+        np.testing.assert_allclose(thyp[i], thyp_i, rtol=0, atol=1e-10)
+
+# Sinusoidal fit with the cached basis
+for period in [365.25, 52, 12]:
+    t = np.arange(len(meteo))
+    m, a, ph = fit_sinusoidal(t, sr, period)
+    m_b, a_b, ph_b = fit_sinusoidal_batch(sr, period)
+    for x, x_b in [(m, m_b), (a, a_b), (ph, ph_b)]:
+        assert x_b.shape == (nlakes,)
+        np.testing.assert_allclose(x_b, x, rtol=1e-12, atol=1e-12)
+    y = calc_sinusoidal(m_b, a_b, ph_b, len(meteo), period)
+    np.testing.assert_allclose(
+            y, m[:, None] + a[:, None]*np.sin(2*np.pi*t/period + ph[:, None]),
+            rtol=0, atol=1e-10)
+    assert sinusoidal_basis(len(meteo), period) is \
+        sinusoidal_basis(len(meteo), period)
+    assert not sinusoidal_basis(len(meteo), period).flags.writeable
+assert sinusoidal_basis(10, 12, np.float32).dtype == np.float32
+
+# Jacobians with respect to the parameters, compared with forward finite
+# differences (including clipping at 0 ºC, overturns, the 4 ºC floor and the
+# limit of BETA converted to the periodicity, reached by the second lake)
+for periodicity in ['daily', 'monthly']:
+    tepi, jac_epi = calc_epilimnion_temperature_batch(
+            tair, sr, par_vals, periodicity, return_jacobian=True)
+    thyp, jac_hyp = calc_hypolimnion_temperature_batch(
+            tepi, par_vals, periodicity, return_jacobian=True,
+            tepi_jacobian=jac_epi)
+    assert (tepi == 0).any() and (thyp == 4).any()
+    for k in JACOBIAN_PARAMETERS:
+        h = 1e-7*np.maximum(np.abs(par_vals[k]), 1e-3)
+        pars = dict(par_vals)
+        pars[k] = par_vals[k] + h
+        tepi_k = calc_epilimnion_temperature_batch(tair, sr, pars,
+                                                   periodicity)
+        thyp_k = calc_hypolimnion_temperature_batch(tepi_k, pars,
+                                                    periodicity)
+        np.testing.assert_allclose(jac_epi[k], (tepi_k - tepi)/h[:, None],
+                                   rtol=1e-4, atol=1e-4)
+        np.testing.assert_allclose(jac_hyp[k], (thyp_k - thyp)/h[:, None],
+                                   rtol=1e-4, atol=1e-4)
+    for i in range(nlakes):
+        pars = dict(par_lakes[i])
+        tepi_i, jac_epi_i = calc_epilimnion_temperature(
+                meteo['tair'], meteo['sr'], pars, periodicity,
+                return_jacobian=True)
+        thyp_i, jac_hyp_i = calc_hypolimnion_temperature(
+                tepi_i, pars, periodicity, return_jacobian=True,
+                tepi_jacobian=jac_epi_i)
+        for k in JACOBIAN_PARAMETERS:
+            np.testing.assert_allclose(jac_epi[k][i], jac_epi_i[k],
+                                       rtol=1e-10, atol=1e-10)
+            np.testing.assert_allclose(jac_hyp[k][i], jac_hyp_i[k],
+                                       rtol=1e-10, atol=1e-10)
@@ -38,9 +38,10 @@ okplm.run_okp(output_file, meteo_file, par_file, lake_file,
 # =============================================================================
 # Test 2: input and output periodicity
 # =============================================================================
-okplm.run_okp(output_file, meteo_file, par_file, lake_file,
-               periodicity=periodchoice,
-               output_periodicity='weekly')
+nmes = okplm.run_okp(output_file, meteo_file, par_file, lake_file,
+                     periodicity=periodchoice,
+                     output_periodicity='weekly')
+assert nmes == len(okplm.read_meteo(meteo_file)['date'])
 
 # =============================================================================
 # Test 3: validation, input periodicity
@@ -58,3 +59,35 @@ okplm.run_okp(output_file, meteo_file, par_file, lake_file,
                validation_data_file=validation_data_file,
                validation_res_file=validation_res_file,
                output_periodicity='monthly')
+
+# =============================================================================
+# Test 5: in-memory simulation, same results as run_okp
+# =============================================================================
+meteo = okplm.read_meteo(meteo_file)
+obs_data = okplm.read_meteo(validation_data_file)
+res = okplm.run_okp_arrays(meteo['date'], meteo['tair'], meteo['sr'],
+                           lake_data=okplm.read_dict(lake_file),
+                           periodicity=periodchoice,
+                           output_periodicity='monthly', obs_data=obs_data)
+output = okplm.read_output(output_file)
+assert (res['date'] == output['date']).all()
+assert (res['tepi'] == output['tepi']).all()
+assert (res['thyp'] == output['thyp']).all()
+assert res['par_vals'] == okplm.read_dict(par_file)
+with open(validation_res_file, 'rt') as f:
+    f.readline()
+    for k in ['tepi', 'thyp']:
+        assert f.readline().split() == \
+            ('%d %.3f %.3f %.3f %.3f %.3f' % res['validation'][k]).split()
+
+# =============================================================================
+# Test 6: date range of unsorted meteorological data (the rows of the period
+# are simulated in the order of the data)
+# =============================================================================
+t_rev = meteo['date'][::-1]
+res_rev = okplm.run_okp_arrays(t_rev, meteo['tair'][::-1], meteo['sr'][::-1],
+                               par_vals=okplm.read_dict(par_file),
+                               start_date=str(t_rev[-10]),
+                               end_date=str(t_rev[5]),
+                               periodicity=periodchoice)
+assert (res_rev['date'] == t_rev[5:-9]).all()
@@ -0,0 +1,56 @@
+"""Test functions in parameter_functions.py.
+
+This script checks that the estimation of parameter values for a table of
+water bodies gives the same results as the estimation for each water body,
+and that the lake data are not modified.
+"""
+import numpy as np
+
+from okplm import estimate_parameters, lake_type_constants
+
+
+# Table of water bodies (structured array)
+rng = np.random.default_rng(0)
+n = 1000
+lakes = np.zeros(n, dtype=[('latitude', float), ('altitude', float),
+                           ('zmax', float), ('surface', float),
+                           ('volume', float), ('type', 'U1')])
+lakes['latitude'] = rng.uniform(42, 51, n)
+lakes['altitude'] = rng.uniform(0, 2800, n)
+lakes['surface'] = 10**rng.uniform(3, 8, n)
+lakes['zmax'] = rng.uniform(1, 300, n)
+lakes['volume'] = lakes['surface']*lakes['zmax']*rng.uniform(0.1, 0.6, n)
+lakes['type'] = rng.choice(['L', 'R'], n)
+lakes_ref = lakes.copy()
+
+pars = estimate_parameters(lakes)
+assert np.array_equal(lakes, lakes_ref)
+for k in ['A', 'B', 'C', 'D', 'E', 'ALPHA', 'BETA', 'at_factor',
+          'sw_factor']:
+    assert pars[k].shape == (n,)
+
+# Same results for each water body, with a dictionary of scalars
+for i in range(0, n, 37):
+    var_vals = {k: lakes[k][i] for k in lakes.dtype.names}
+    var_vals_ref = dict(var_vals)
+    pars_i = estimate_parameters(var_vals,
+                                 lake_type_constants(var_vals['type']))
+    assert var_vals == var_vals_ref
+    for k, v in pars_i.items():
+        assert np.ndim(v) == 0
+        assert np.isclose(pars[k][i], v, rtol=1e-14, atol=0)
+
+# Dictionary of columns, with explicit constants
+columns = {k: list(lakes[k]) for k in lakes.dtype.names}
+pars2 = estimate_parameters(columns, lake_type_constants(columns['type']))
+for k in pars:
+    assert np.array_equal(pars2[k], pars[k])
+assert 'zmean' not in columns
+
+# Unknown type of water body
+try:
+    lake_type_constants(['L', 'X'])
+except ValueError:
+    pass
+else:
+    raise AssertionError('lake_type_constants accepted an unknown type')
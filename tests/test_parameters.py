@@ -0,0 +1,62 @@
+"""Test the class OKPParameters in parameters.py.
+
+This script checks that OKPParameters objects are immutable and hashable, and
+that the simulation functions do not modify the parameter values, so that
+they can be reused in several simulations and threads.
+"""
+import os.path
+import pickle
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from okplm import OKPParameters, as_parameters, read_meteo
+from okplm.okp_model import calc_epilimnion_temperature
+from okplm.okp_model import calc_hypolimnion_temperature
+
+
+par_vals = {'A': 6.2, 'B': 1.007, 'C': -0.007, 'D': 0.51, 'E': 0.245,
+            'ALPHA': 0.071, 'BETA': 0.13, 'at_factor': 1.0,
+            'sw_factor': 1.0, 'mat': -0.407}
+
+# Converted coefficients, immutability and hashing
+pars = OKPParameters(par_vals, 'weekly')
+assert pars.alpha == min(0.071*365.25/52, 1) and pars.beta == 0.13*365.25/52
+assert pars['ALPHA'] == pars.ALPHA == 0.071
+try:
+    pars.ALPHA = 1
+except AttributeError:
+    pass
+else:
+    raise AssertionError('OKPParameters object modified')
+assert pars == OKPParameters(dict(par_vals), 'weekly')
+assert pars != OKPParameters(par_vals, 'daily')
+assert len({pars, OKPParameters(par_vals, 'weekly')}) == 1
+assert pickle.loads(pickle.dumps(pars)) == pars
+assert pars.as_dict() == par_vals
+assert pars.replace(ALPHA=0.1).ALPHA == 0.1 and pars.ALPHA == 0.071
+assert as_parameters(pars, 'weekly') is pars
+assert as_parameters(pars, 'monthly').beta == 1
+
+# The simulation functions do not modify the parameter values
+meteo_file = os.path.join(os.path.dirname(__file__), '..', 'examples',
+                          'synthetic_case_daily', 'meteo.txt')
+meteo = read_meteo(meteo_file)
+par_vals_ref = dict(par_vals)
+for periodicity in ['daily', 'weekly', 'monthly']:
+    tepi_ref = calc_epilimnion_temperature(meteo['tair'], meteo['sr'],
+                                           par_vals, periodicity)
+    thyp_ref = calc_hypolimnion_temperature(tepi_ref, par_vals, periodicity)
+    assert par_vals == par_vals_ref
+    pars = OKPParameters(par_vals, periodicity)
+
+    def simulate(i):
+        tepi = calc_epilimnion_temperature(meteo['tair'], meteo['sr'],
+                                           pars, periodicity)
+        thyp = calc_hypolimnion_temperature(tepi, pars, periodicity)
+        return tepi, thyp
+
+    with ThreadPoolExecutor(4) as executor:
+        for tepi, thyp in executor.map(simulate, range(8)):
+            assert np.array_equal(tepi, tepi_ref)
+            assert np.array_equal(thyp, thyp_ref)
@@ -0,0 +1,49 @@
+"""Test the classes in reducers.py.
+
+This script checks that the online statistics updated by blocks of members
+(EnsembleStatistics) give the same mean, standard deviation, minimum and
+maximum as the statistics of all the members at once, and that the quantiles
+estimated with the P-square algorithm (P2Quantiles) are close to the exact
+quantiles.
+"""
+import numpy as np
+
+from okplm import EnsembleStatistics, P2Quantiles
+
+
+rng = np.random.RandomState(0)
+
+# Members (rows) of 2 lakes x 3 time steps, with normal, skewed and
+# constant values
+x = 15 + rng.normal(size=(2000, 2, 3))
+x[:, 1, :2] = rng.exponential(size=(2000, 2))
+x[:, 1, 2] = 4
+
+# Statistics updated by blocks of members of different sizes
+probs = [0.05, 0.5, 0.95]
+stats = EnsembleStatistics(quantiles=probs)
+for block in np.array_split(x, [1, 7, 100, 1000]):
+    stats.update(block)
+res = stats.result()
+assert res['count'] == 2000
+np.testing.assert_allclose(res['mean'], x.mean(axis=0), rtol=1e-12)
+np.testing.assert_allclose(res['sd'], x.std(axis=0), rtol=1e-10)
+assert (res['min'] == x.min(axis=0)).all()
+assert (res['max'] == x.max(axis=0)).all()
+assert res['quantiles'].shape == (3, 2, 3)
+np.testing.assert_allclose(res['quantiles'],
+                           np.quantile(x, probs, axis=0), atol=0.1)
+assert (res['quantiles'][:, 1, 2] == 4).all()
+
+# The quantiles do not depend on the size of the blocks
+p2 = P2Quantiles(probs)
+for v in x:
+    p2.update(v)
+assert (p2.result() == res['quantiles']).all()
+
+# Exact quantiles with less than five members, no statistics without members
+stats = EnsembleStatistics(quantiles=[0.5])
+assert stats.result()['mean'] is None and P2Quantiles([0.5]).result() is None
+stats.update(x[:3])
+assert (stats.result()['quantiles'][0] == np.median(x[:3], axis=0)).all()
+assert 'quantiles' not in EnsembleStatistics().result()
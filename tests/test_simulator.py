@@ -0,0 +1,57 @@
+"""Test the class OKPModel in simulator.py.
+
+This script checks that the simulation with an OKPModel object, step by step
+or by series of time steps, gives the same results as the functions in
+okp_model.py, and that the simulation can be continued from a saved state.
+"""
+import json
+import os.path
+
+import numpy as np
+
+from okplm import OKPModel, read_meteo
+from okplm.okp_model import calc_epilimnion_temperature
+from okplm.okp_model import calc_hypolimnion_temperature, fit_sinusoidal
+
+
+meteo_file = os.path.join(os.path.dirname(__file__), '..', 'examples',
+                          'synthetic_case_daily', 'meteo.txt')
+meteo = read_meteo(meteo_file)
+nmes = len(meteo['date'])
+par_vals = {'A': 6.2, 'B': 1.007, 'C': -0.007, 'D': 0.51, 'E': 0.245,
+            'ALPHA': 0.071, 'BETA': 0.13, 'at_factor': 1.0,
+            'sw_factor': 0.9, 'mat': -0.407}
+
+# Reference simulation of the whole period
+tepi_ref = calc_epilimnion_temperature(meteo['tair'], meteo['sr'],
+                                       dict(par_vals))
+thyp_ref = calc_hypolimnion_temperature(tepi_ref, dict(par_vals))
+m_sr, a_sr, ph_sr = fit_sinusoidal(np.arange(nmes), meteo['sr'], 365.25)
+climatology = {'m_sr': m_sr, 'a_sr': a_sr, 'ph_sr': ph_sr}
+
+# Step by step
+model = OKPModel(par_vals, climatology)
+res = np.array([model.step(tair, sr)
+                for tair, sr in zip(meteo['tair'], meteo['sr'])])
+np.testing.assert_allclose(res[:, 0], tepi_ref, rtol=0, atol=1e-10)
+np.testing.assert_allclose(res[:, 1], thyp_ref, rtol=0, atol=1e-10)
+assert model.get_state()['t'] == nmes
+
+# By series of time steps, saving and restoring the state
+for backend in ['python', 'numpy', 'numba']:
+    model = OKPModel(par_vals, climatology, backend=backend)
+    tepi, thyp = model.advance(meteo['tair'][:200], meteo['sr'][:200])
+    state = json.loads(json.dumps(model.get_state()))
+    model = OKPModel(par_vals, climatology, backend=backend)
+    model.set_state(state)
+    tepi2, thyp2 = model.advance(meteo['tair'][200:], meteo['sr'][200:])
+    np.testing.assert_allclose(np.concatenate([tepi, tepi2]), tepi_ref,
+                               rtol=0, atol=1e-10)
+    np.testing.assert_allclose(np.concatenate([thyp, thyp2]), thyp_ref,
+                               rtol=0, atol=1e-10)
+
+# Reset
+model.set_state(None)
+assert model.get_state() == {'t': 0, 'ftair': None, 'fet': None,
+                             'thyp_prov': None, 'thyp': None}
+assert not hasattr(model, '__dict__')
@@ -0,0 +1,99 @@
+"""Test functions in streaming.py.
+
+This script checks that the simulation by chunks of the example cases gives
+the same results as the simulation of the whole period at once, that
+iter_meteo() reads the same data as read_meteo(), and that the incremental
+simulation of appended data continues the previous simulation.
+"""
+import os.path
+import tempfile
+
+import numpy as np
+
+from okplm import OKPModel, calc_climatology, iter_meteo, read_dict
+from okplm import read_meteo, run_okp, run_okp_incremental
+
+
+folder = os.path.join(os.path.dirname(__file__), '..', 'examples')
+
+# Test iter_meteo
+meteo_file = os.path.join(folder, 'synthetic_case_daily', 'meteo.txt')
+meteo_ref = read_meteo(meteo_file)
+chunks = list(iter_meteo(meteo_file, 100))
+assert [len(c['date']) for c in chunks] == [100, 100, 100, 65]
+for k in meteo_ref:
+    assert np.array_equal(np.concatenate([c[k] for c in chunks]),
+                          meteo_ref[k])
+
+# Test simulation by chunks
+cases = [('synthetic_case_daily', 'daily', None, None),
+         ('synthetic_case_daily', 'daily', '2015-02-10', '2015-11-20'),
+         ('synthetic_case_weekly', 'weekly', None, None),
+         ('synthetic_case_monthly', 'monthly', None, None)]
+with tempfile.TemporaryDirectory() as tmp_dir:
+    for case, periodicity, start_date, end_date in cases:
+        lake_file = os.path.join(folder, case, 'lake.txt')
+        meteo_file = os.path.join(folder, case, 'meteo.txt')
+        res = dict()
+        for chunk_size in [None, 1, 7, 1000]:
+            par_file = os.path.join(tmp_dir, 'par.txt')
+            output_file = os.path.join(tmp_dir, 'output.txt')
+            if os.path.exists(par_file):
+                os.remove(par_file)
+            nmes = run_okp(output_file, meteo_file, par_file,
+                           lake_file=lake_file, start_date=start_date,
+                           end_date=end_date, periodicity=periodicity,
+                           chunk_size=chunk_size)
+            res[chunk_size] = np.genfromtxt(output_file, names=True,
+                                            encoding='utf-8', dtype=None)
+            assert nmes == len(res[chunk_size])
+            with open(par_file, 'rt') as f:
+                res[chunk_size, 'par'] = f.read()
+        for chunk_size in [1, 7, 1000]:
+            assert np.array_equal(res[chunk_size]['date'], res[None]['date'])
+            for k in ['tepi', 'thyp']:
+                assert np.allclose(res[chunk_size][k], res[None][k],
+                                   rtol=0, atol=1e-10)
+            for l1, l2 in zip(res[chunk_size, 'par'].split(),
+                              res[None, 'par'].split()):
+                try:
+                    assert np.isclose(float(l1), float(l2))
+                except ValueError:
+                    assert l1 == l2
+
+# Test incremental simulation: rows appended to the meteorological data file
+# are simulated from the saved state, with the climatology of the first run
+with tempfile.TemporaryDirectory() as tmp_dir:
+    lake_file = os.path.join(folder, 'synthetic_case_daily', 'lake.txt')
+    with open(os.path.join(folder, 'synthetic_case_daily', 'meteo.txt'),
+              'rt') as f:
+        lines = f.readlines()
+    meteo_file = os.path.join(tmp_dir, 'meteo.txt')
+    par_file = os.path.join(tmp_dir, 'par.txt')
+    output_file = os.path.join(tmp_dir, 'output.txt')
+    with open(meteo_file, 'wt') as f:
+        f.writelines(lines[:101])
+    assert run_okp_incremental(output_file, meteo_file, par_file,
+                               lake_file=lake_file) == 100
+    for i in range(101, len(lines), 50):
+        with open(meteo_file, 'at') as f:
+            f.writelines(lines[i:i + 50])
+        run_okp(output_file, meteo_file, par_file, incremental=True)
+    assert run_okp_incremental(output_file, meteo_file, par_file) == 0
+    assert os.path.exists(os.path.join(tmp_dir, 'par_state.json'))
+
+    meteo = read_meteo(meteo_file)
+    climatology = calc_climatology(meteo_file,
+                                   end_date=str(meteo['date'][99]))
+    tepi, thyp = OKPModel(read_dict(par_file), climatology).advance(
+            meteo['tair'], meteo['sr'])
+    res = np.genfromtxt(output_file, names=True, encoding='utf-8',
+                        dtype=None)
+    assert np.array_equal(res['date'], meteo['date'].astype(str))
+    np.testing.assert_allclose(res['tepi'], tepi, rtol=0, atol=1e-10)
+    np.testing.assert_allclose(res['thyp'], thyp, rtol=0, atol=1e-10)
+
+    # a modified file is simulated again
+    with open(meteo_file, 'wt') as f:
+        f.writelines(lines[:51])
+    assert run_okp_incremental(output_file, meteo_file, par_file) == 50
@@ -0,0 +1,92 @@
+"""Test the time functions in time_functions.py.
+
+This script checks the daily, weekly and monthly aggregations against simple
+loops over the days, weeks and months, including the rules for missing data,
+for datetime sequences and numpy.datetime64 arrays, and for 2D arrays (lakes x
+time), and the selection of date ranges.
+"""
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from okplm import daily_f, daterange_slice, monthly_f, select_daterange
+from okplm import weekly_f
+
+
+rng = np.random.default_rng(1)
+
+# Daily data with missing values
+t = [datetime(2003, 1, 30) + timedelta(days=i) for i in range(100)]
+x = rng.normal(10, 5, len(t))
+x[[3, 40, 41]] = np.nan  # February (1 nan) and March (2 nan) complete
+x[[70, 71, 72]] = np.nan  # April incomplete
+
+# Monthly values
+t_mon, y_mon = monthly_f(t, x, np.mean, 'daily')
+assert list(t_mon) == [datetime(2003, m, 1) for m in range(1, 6)]
+for t_m, y_m in zip(t_mon, y_mon):
+    xm = np.array([v for d, v in zip(t, x) if d.month == t_m.month])
+    if np.isnan(xm).sum() >= 3:
+        assert np.isnan(y_m)
+    else:
+        assert np.isclose(y_m, np.nanmean(xm))
+assert np.isnan(y_mon[3]) and not np.isnan(y_mon[1:3]).any()
+
+# Weekly values: weeks of 7 days from the first day, incomplete last week
+t_week, y_week = weekly_f(t, x, np.sum, 'daily')
+assert list(t_week) == t[::7] and len(y_week) == 15
+for w in range(14):
+    assert np.allclose(y_week[w], np.sum(x[7*w:7*w+7]), equal_nan=True)
+assert np.isnan(y_week[0]) and np.isnan(y_week[-1])
+assert np.isclose(weekly_f(t, x, np.nansum, 'daily')[1][0], np.nansum(x[:7]))
+
+# Daily values from data every 6 hours (day with less than 90% of data)
+t_sub = [datetime(2003, 1, 1, 6) + timedelta(hours=6*i) for i in range(40)]
+x_sub = np.arange(40.)
+x_sub[[8, 9]] = np.nan
+t_day, y_day = daily_f(t_sub, x_sub, np.max)
+assert list(t_day) == [datetime(2003, 1, 1) + timedelta(days=i)
+                       for i in range(11)]
+assert np.isnan(y_day[0]) and np.isnan(y_day[-1])  # 3 and 1 measurements
+assert y_day[1] == 6 and y_day[2] == 10 and y_day[3] == 14
+
+# Functions without a numpy reduction are applied to each group
+assert np.allclose(monthly_f(t, x, np.median, 'daily')[1][:3],
+                   [np.nanmedian(x[:2]), np.nanmedian(x[2:30]),
+                    np.nanmedian(x[30:61])])
+
+# numpy.datetime64 arrays and 2D arrays (lakes x time)
+t64 = np.array(t, dtype='datetime64[D]')
+xx = np.vstack([x, 2*x, x + 1])
+for func, input_type in [(monthly_f, 'daily'), (weekly_f, 'daily')]:
+    t_ref, y_ref = func(t, x, np.mean, input_type)
+    t_p, y_p = func(t64, xx, np.mean, input_type)
+    assert t_p.dtype == np.dtype('datetime64[D]')
+    assert np.all(t_p == np.array(t_ref, dtype='datetime64[D]'))
+    assert y_p.shape == (3, len(y_ref))
+    assert np.allclose(y_p, [y_ref, 2*y_ref, y_ref + 1], equal_nan=True)
+t_sub64 = np.array(t_sub, dtype='datetime64[s]')
+assert np.allclose(daily_f(t_sub64, np.vstack([x_sub, -x_sub]), np.min)[1],
+                   [daily_f(t_sub, x_sub, np.min)[1],
+                    -daily_f(t_sub, x_sub, np.max)[1]], equal_nan=True)
+
+# Selection of date ranges by binary search
+t64 = np.arange('2000-01-01', '2002-01-01', dtype='datetime64[D]')
+x = np.arange(len(t64), dtype=float)
+for t_start, t_end in [('2000-03-01', '2000-03-31'), (None, '2000-02-10'),
+                       ('2001-12-25', None), ('1999-01-01', '2003-01-01'),
+                       ('2001-05-01', '2001-04-01'), (None, None)]:
+    ind = daterange_slice(t64, t_start, t_end)
+    mask = np.ones(len(t64), dtype=bool)
+    if t_start is not None:
+        mask &= select_daterange(t64, np.datetime64(t_start), t64[-1])
+    if t_end is not None:
+        mask &= select_daterange(t64, t64[0], np.datetime64(t_end))
+    assert np.array_equal(t64[ind], t64[mask])
+    assert np.shares_memory(x[ind], x) or len(x[ind]) == 0
+try:
+    daterange_slice(t64[::-1], '2000-03-01', '2000-03-31')
+except ValueError:
+    pass
+else:
+    raise AssertionError('Unsorted dates accepted')
@@ -1,9 +1,12 @@
 """Test functions in validation.py.
 
-This script tests the function error_statistics() from the module
-validation.py.
+This script tests the functions error_statistics(), error_statistics_batch()
+and error_statistics_pairs() from the module validation.py.
 """
-from okplm import error_statistics
+import numpy as np
+
+from okplm import error_statistics, error_statistics_batch
+from okplm import error_statistics_pairs
 
 
 # Test error_statistics
@@ -18,3 +21,44 @@ t_obs = [33, 5, 6, 15]
 v_obs = [3, 5, 7, 15]
 
 res = error_statistics(t_sim, v_sim, t_obs, v_obs)
+
+# Unsorted observations out of the simulation period, with missing values
+t_sim = np.arange('2000-01-01', '2001-01-01', dtype='datetime64[D]')
+v_sim = np.sin(np.arange(len(t_sim))/20)
+t_obs = np.array(['2000-05-03', '1999-12-31', '2000-01-01', '2000-03-02',
+                  '2000-12-31', '2001-01-01', '2000-07-14'],
+                 dtype='datetime64[D]')
+v_obs = np.array([0.5, 3, -0.1, np.nan, 0.2, 1, 0.9])
+res = error_statistics(t_sim, v_sim, t_obs, v_obs)
+assert res[0] == 5 and np.all(np.isnan(res[1:]))
+res = error_statistics(t_sim, v_sim, t_obs, v_obs, skipna=True)
+sim = v_sim[[0, 123, 195, 365]]
+obs = np.array([-0.1, 0.5, 0.9, 0.2])
+assert res[0] == 4
+assert np.allclose(res[1:], [np.std(sim - obs), np.corrcoef(sim, obs)[0, 1],
+                             np.mean(sim - obs), np.mean(np.abs(sim - obs)),
+                             np.sqrt(np.mean((sim - obs)**2))])
+try:
+    error_statistics(t_sim, v_sim, t_obs[[0, 0]], v_obs[[0, 0]])
+except ValueError:
+    pass
+else:
+    raise AssertionError('Non unique time stamps accepted')
+
+# Test error_statistics_batch and error_statistics_pairs
+rng = np.random.default_rng(0)
+sims = rng.normal(size=(5, 50))
+obss = sims + rng.normal(size=(5, 50))
+obss[rng.random((5, 50)) < 0.3] = np.nan
+obss[4] = np.nan
+pairs = []
+for i in range(5):
+    ind = np.flatnonzero(~np.isnan(obss[i]))
+    pairs.append((np.arange(50), sims[i], ind, obss[i, ind]))
+res_batch = error_statistics_batch(sims, obss)
+res_pairs = error_statistics_pairs(pairs)
+for i in range(4):
+    res = error_statistics(*pairs[i])
+    assert np.allclose([v[i] for v in res_batch], res)
+    assert np.allclose([v[i] for v in res_pairs], res)
+assert res_batch[0][4] == 0 and np.all(np.isnan([v[4] for v in res_batch[1:]]))